@@ -2,112 +2,396 @@
 # -*- coding: utf-8 -*-
 
 """
-Скрипт для добавления реальных каналов
+Массовое добавление каналов из списка @username, ссылок t.me и числовых ID
+
+Пример запуска:
+    python add_real_channels.py channels.txt
+    python add_real_channels.py channels.csv @channel_name https://t.me/other --report report.csv
+    python add_real_channels.py channels.txt --no-resolve --dry-run
 """
 
+import argparse
 import asyncio
-from database import Database
+import csv
+import io
 import os
+import re
+from collections import Counter
 from dotenv import load_dotenv
+from loguru import logger
+from telethon import utils
+from telethon.errors import (
+    RPCError, ChannelPrivateError, ChannelInvalidError, UsernameNotOccupiedError, UsernameInvalidError,
+)
+from telethon.tl.functions.channels import GetChannelsRequest
+from telethon.tl.types import Channel, ChannelForbidden, Chat, InputChannel, InputPeerChannel, PeerChannel
+from database import create_database
+from parser import MessageParser
+import telethon_session
 
 # Загрузка переменных окружения
 load_dotenv()
 
-# ВНИМАНИЕ: Замените эти значения на свои реальные каналы
-# Каналы могут быть указаны как числовые ID или username
-# Примеры:
-# - Числовой ID: -1001234567890 (должен начинаться с -100)
-# - Username: @channel_name (должен начинаться с @)
-REAL_CHANNELS = [
-    # Замените эти примеры на свои реальные каналы
-    {"id": "@telegram", "name": "Официальный канал Telegram"},
-    {"id": "@durov", "name": "Канал Павла Дурова"},
-    # Добавьте свои каналы здесь
-]
-
-# Убедитесь, что целевой канал указан в .env файле (TARGET_CHANNEL_ID)
-# и бот добавлен в этот канал с правами на отправку сообщений
-
-async def add_real_channels():
-    """Добавляет реальные каналы в базу данных."""
-    # Инициализация базы данных
-    db = Database()
-    
-    try:
-        # Подключение к базе данных
-        connected = await db.connect()
-        if not connected:
-            print("Не удалось подключиться к базе данных.")
-            return
-        
-        # Очищаем существующие каналы
-        await clear_existing_channels(db)
-        
-        print("Добавление реальных каналов в базу данных...")
-        
-        # Добавление каналов
-        print("\nДобавление каналов:")
-        for channel in REAL_CHANNELS:
+# Результаты добавления
+STATUS_ADDED = "added"
+STATUS_EXISTS = "exists"
+STATUS_DUPLICATE = "duplicate"
+STATUS_INVALID = "invalid"
+STATUS_NOT_FOUND = "not_found"
+STATUS_PRIVATE = "private"
+STATUS_BANNED = "banned"
+STATUS_NOT_CHANNEL = "not_channel"
+STATUS_UNRESOLVED = "unresolved"
+STATUS_ERROR = "error"
+
+STATUS_LABELS = {
+    STATUS_ADDED: "✅ добавлен",
+    STATUS_EXISTS: "☑️ уже в списке",
+    STATUS_DUPLICATE: "🔁 повтор в списке",
+    STATUS_INVALID: "❌ неверный формат",
+    STATUS_NOT_FOUND: "❌ не найден",
+    STATUS_PRIVATE: "🔒 закрыт для аккаунта",
+    STATUS_BANNED: "⛔ аккаунт заблокирован в канале",
+    STATUS_NOT_CHANNEL: "❌ не канал и не группа",
+    STATUS_UNRESOLVED: "❔ нет в кэше сессии (укажите @username)",
+    STATUS_ERROR: "⚠️ ошибка",
+}
+
+# Статусы, при которых канал записывается в базу
+STORED_STATUSES = (STATUS_ADDED, STATUS_EXISTS)
+
+USERNAME_RE = re.compile(r"[A-Za-z][A-Za-z0-9_]{3,31}")
+
+
+def parse_channel_list(text, filename=None):
+    """Разбирает список каналов.
+
+    В .csv канал берется из первой колонки, название — из второй; в остальных
+    случаях каналы разделяются переводами строк, пробелами или запятыми.
+
+    Returns:
+        Список (значение, название или None) в исходном порядке
+    """
+    if filename and filename.lower().endswith(".csv"):
+        delimiter = ";" if text.count(";") > text.count(",") else ","
+        rows = [row for row in csv.reader(io.StringIO(text), delimiter=delimiter) if row]
+        items = [(row[0].strip(), row[1].strip() if len(row) > 1 and row[1].strip() else None) for row in rows]
+    else:
+        items = [(value, None) for value in re.split(r"[\s,;]+", text)]
+    # Пропускаем пустые значения и заголовок CSV
+    return [(value, name) for value, name in items if value and value.lower() != "channel_id"]
+
+
+class OnboardResult:
+    """Результат добавления одного значения из списка."""
+
+    __slots__ = ("value", "channel_id", "status", "name", "detail")
+
+    def __init__(self, value, channel_id=None, status=None, name=None, detail=None):
+        self.value = value
+        self.channel_id = channel_id
+        self.status = status
+        self.name = name
+        self.detail = detail
+
+    def describe(self):
+        line = f"{self.value}: {STATUS_LABELS.get(self.status, self.status)}"
+        if self.channel_id and self.channel_id != self.value:
+            line += f" ({self.channel_id})"
+        if self.name:
+            line += f" — {self.name}"
+        if self.detail:
+            line += f" [{self.detail}]"
+        return line
+
+
+class ChannelOnboarding:
+    """Массовое добавление каналов с параллельной проверкой через Telethon.
+
+    Значения приводятся к виду, в котором каналы хранятся в базе
+    (MessageParser.normalize_channel_id, затем @username или -100…),
+    повторы отбрасываются. Каналы, которые уже есть в кэше сессии Telethon,
+    проверяются пачками по batch_size одним запросом channels.getChannels,
+    остальные @username разрешаются по одному, не больше concurrency
+    одновременно. Все запросы идут через общий лимит парсера (bulk_limiter).
+    Разрешенные сущности попадают в кэш парсера, поэтому первый цикл проверки
+    их не запрашивает. Найденные каналы записываются одной транзакцией.
+    """
+
+    def __init__(self, parser, concurrency=None, batch_size=100, resolve=True):
+        """Инициализирует добавление.
+
+        Args:
+            parser: Экземпляр MessageParser (с подключенным Telethon клиентом, если resolve)
+            concurrency: Сколько @username разрешается одновременно
+            batch_size: Каналов в одном запросе channels.getChannels
+            resolve: Проверять каналы через Telethon; False — только привести
+                к единому виду и записать
+        """
+        self.parser = parser
+        self.db = parser.db
+        self.concurrency = concurrency or int(os.getenv("ONBOARD_CONCURRENCY", "5"))
+        self.batch_size = batch_size
+        self.resolve = resolve
+
+    def canonical_id(self, value):
+        """Приводит ID, @username или ссылку t.me к виду, в котором канал хранится в базе.
+
+        Returns:
+            '@username', '-100…' (или '-…' для обычной группы) либо None, если формат неверный
+        """
+        value = value.strip()
+        # Ссылки-приглашения не разрешаются без вступления в канал
+        if "joinchat/" in value or "t.me/+" in value:
+            return None
+        normalized = self.parser.normalize_channel_id(value)
+        if re.fullmatch(r"-?\d+", normalized):
+            number = int(normalized)
+            # normalize_channel_id убирает префикс -100 у каналов
+            return str(utils.get_peer_id(PeerChannel(number))) if number > 0 else str(number)
+        username = normalized[1:] if normalized.startswith("@") else normalized
+        return f"@{username}" if USERNAME_RE.fullmatch(username) else None
+
+    def prepare(self, items):
+        """Приводит значения к единому виду и отмечает неверные и повторы.
+
+        Returns:
+            Кортеж (результаты по всем значениям, результаты для проверки)
+        """
+        results, pending, seen = [], [], {}
+        for value, name in items:
+            channel_id = self.canonical_id(value)
+            result = OnboardResult(value, channel_id, name=name)
+            results.append(result)
+            if channel_id is None:
+                result.status = STATUS_INVALID
+            elif channel_id.lower() in seen:
+                result.status = STATUS_DUPLICATE
+                result.detail = seen[channel_id.lower()].value
+            else:
+                seen[channel_id.lower()] = result
+                pending.append(result)
+        return results, pending
+
+    def _accept(self, result, entity):
+        """Проверяет тип разрешенной сущности и запоминает ее в кэше парсера."""
+        if isinstance(entity, (Channel, Chat)):
+            result.name = result.name or entity.title
+            self.parser.entity_cache[result.channel_id] = entity
+            return entity
+        self.parser.entity_cache.pop(result.channel_id, None)
+        if isinstance(entity, ChannelForbidden):
+            result.status = STATUS_BANNED
+            result.name = result.name or entity.title
+        else:
+            result.status = STATUS_NOT_CHANNEL
+        return None
+
+    @staticmethod
+    def _fail(result, error):
+        if isinstance(error, (UsernameNotOccupiedError, UsernameInvalidError, ChannelInvalidError, ValueError)):
+            result.status = STATUS_NOT_FOUND
+        elif isinstance(error, ChannelPrivateError):
+            result.status = STATUS_PRIVATE
+        else:
+            result.status = STATUS_ERROR
+            result.detail = str(error)
+
+    async def _fetch_batch(self, batch):
+        """Проверяет пачку каналов из кэша сессии одним запросом."""
+        client = self.parser.client
+        request = GetChannelsRequest([InputChannel(peer.channel_id, peer.access_hash) for _, peer in batch])
+        try:
+            response = await self.parser.call_limited(lambda: client(request))
+        except RPCError as e:
+            if len(batch) == 1:
+                self._fail(batch[0][0], e)
+                return {}
+            # Один недоступный канал отклоняет всю пачку: проверяем ее половины отдельно
+            middle = len(batch) // 2
+            found = await self._fetch_batch(batch[:middle])
+            found.update(await self._fetch_batch(batch[middle:]))
+            return found
+        found = {}
+        chats = {chat.id: chat for chat in response.chats}
+        for result, peer in batch:
+            entity = chats.get(peer.channel_id)
+            if entity is None:
+                result.status = STATUS_NOT_FOUND
+            elif self._accept(result, entity) is not None:
+                found[result] = entity
+        return found
+
+    async def _lookup(self, result, semaphore):
+        """Разрешает канал по одному: @username, которого нет в кэше сессии, или обычную группу."""
+        async with semaphore:
             try:
-                channel_id = channel["id"]
-                name = channel["name"]
-                
-                # Если канал указан через @username, сохраняем как есть
-                # Иначе преобразуем в числовой ID
-                if isinstance(channel_id, str) and channel_id.startswith('@'):
-                    final_id = channel_id
-                else:
-                    # Убедитесь, что ID числовой и начинается с -100
-                    final_id = int(str(channel_id))
-                
-                await db.add_channel(final_id, name)
-                print(f"✅ Канал {final_id} ({name}) добавлен")
+                entity = await self.parser.call_limited(lambda: self.parser.get_channel_entity(result.channel_id))
             except Exception as e:
-                print(f"❌ Ошибка при добавлении канала {channel['id']}: {e}")
-        
-        print("\nПроверьте, что бот добавлен в следующие каналы:")
-        for channel in REAL_CHANNELS:
-            print(f"  - {channel['name']} ({channel['id']})")
-        
-        print("\nВажно: Бот должен быть добавлен как администратор в каналы, которые нужно мониторить.")
-        print("Кроме того, бот должен быть добавлен в целевой канал с правами на отправку сообщений.")
-        print("\nПосле добавления каналов запустите check_channels.py для проверки доступа.")
-    
-    except Exception as e:
-        print(f"Ошибка при добавлении реальных каналов: {e}")
+                self._fail(result, e)
+                return {}
+        entity = self._accept(result, entity)
+        return {result: entity} if entity is not None else {}
+
+    async def resolve_all(self, pending):
+        """Проверяет каналы через Telethon.
+
+        Returns:
+            Словарь {результат: сущность} для найденных каналов
+        """
+        session = self.parser.client.session
+        cached, lookups = [], []
+        for result in pending:
+            try:
+                peer = session.get_input_entity(result.channel_id)
+            except ValueError:
+                peer = None
+            if isinstance(peer, InputPeerChannel):
+                cached.append((result, peer))
+            elif peer is not None:
+                # Обычная группа или пользователь из кэша: сущность без запроса списком
+                lookups.append(result)
+            elif result.channel_id.startswith("@"):
+                lookups.append(result)
+            else:
+                # Числовой ID нельзя разрешить без access_hash из кэша сессии
+                result.status = STATUS_UNRESOLVED
+
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def fetch(batch):
+            async with semaphore:
+                return await self._fetch_batch(batch)
+
+        batches = [cached[i:i + self.batch_size] for i in range(0, len(cached), self.batch_size)]
+        parts = await asyncio.gather(
+            *(fetch(batch) for batch in batches),
+            *(self._lookup(result, semaphore) for result in lookups)
+        )
+        found = {}
+        for part in parts:
+            found.update(part)
+        logger.info(
+            f"Разрешено каналов: {len(found)} из {len(pending)} "
+            f"(из кэша пачками: {len(cached)}, запросов по имени: {len(lookups)})"
+        )
+        return found
+
+    async def run(self, items, dry_run=False):
+        """Добавляет каналы из списка.
+
+        Args:
+            items: Список (значение, название или None), см. parse_channel_list
+            dry_run: Только проверить, не изменяя базу данных
+
+        Returns:
+            Список OnboardResult в порядке значений
+        """
+        results, pending = self.prepare(items)
+        if self.resolve and pending:
+            found = await self.resolve_all(pending)
+            # Разные значения могут указывать на один канал (@username и -100…)
+            peers = {}
+            for result in pending:
+                entity = found.get(result)
+                if entity is None:
+                    continue
+                first = peers.setdefault(utils.get_peer_id(entity), result)
+                if first is not result:
+                    result.status = STATUS_DUPLICATE
+                    result.detail = first.value
+        accepted = [result for result in pending if result.status is None]
+
+        existing = {str(channel['channel_id']).lower() for channel in await self.db.get_channels()}
+        for result in accepted:
+            result.status = STATUS_EXISTS if result.channel_id.lower() in existing else STATUS_ADDED
+        if accepted and not dry_run:
+            await self.db.add_channels([(result.channel_id, result.name) for result in accepted])
+
+        counts = Counter(result.status for result in results)
+        logger.info("Добавление каналов завершено: " + ", ".join(f"{s} {n}" for s, n in counts.most_common()))
+        return results
+
+
+def summary(results, limit=30):
+    """Сводка: количество по результатам и до limit значений, которые не добавлены."""
+    counts = Counter(result.status for result in results)
+    lines = [f"Обработано значений: {len(results)}"]
+    for status, label in STATUS_LABELS.items():
+        if counts.get(status):
+            lines.append(f"{label}: {counts[status]}")
+    problems = [result for result in results if result.status not in STORED_STATUSES]
+    if problems and limit:
+        lines.append("")
+        lines += [result.describe() for result in problems[:limit]]
+        if len(problems) > limit:
+            lines.append(f"...и еще {len(problems) - limit}")
+    return "\n".join(lines)
+
+
+def write_report(results, f):
+    """Записывает отчет по каждому значению в CSV (текстовый файл f)."""
+    writer = csv.writer(f, delimiter=";")
+    writer.writerow(("value", "channel_id", "status", "name", "detail"))
+    for result in results:
+        writer.writerow((result.value, result.channel_id or "", result.status, result.name or "", result.detail or ""))
+
+
+async def main_async(args):
+    items = []
+    for source in args.sources:
+        if os.path.isfile(source):
+            with open(source, encoding="utf-8-sig") as f:
+                items += parse_channel_list(f.read(), source)
+        else:
+            items += parse_channel_list(source)
+    if not items:
+        logger.warning("Список каналов пуст")
+        return
+
+    db = create_database()
+    if not await db.connect():
+        logger.error("Не удалось подключиться к базе данных.")
+        return
+
+    parser = MessageParser(db, os.getenv("TARGET_CHANNEL_ID"))
+    try:
+        resolve = not args.no_resolve
+        if resolve and not await parser.initialize_telethon():
+            logger.error("Не удалось инициализировать Telethon клиент. Запустите с --no-resolve, чтобы добавить каналы без проверки.")
+            return
+
+        onboarding = ChannelOnboarding(parser, concurrency=args.concurrency, batch_size=args.batch_size, resolve=resolve)
+        results = await onboarding.run(items, dry_run=args.dry_run)
+        for result in results:
+            print(result.describe())
+        print()
+        print(summary(results, limit=0))
+        if args.report:
+            with open(args.report, "w", encoding="utf-8", newline="") as f:
+                write_report(results, f)
+            print(f"Отчет сохранен в {args.report}")
     finally:
-        # Закрытие соединения с базой данных
+        await telethon_session.close_clients()
         await db.close()
 
-async def clear_existing_channels(db):
-    """Удаляет существующие каналы из базы данных."""
-    try:
-        print("Удаление существующих каналов...")
-        channels = await db.get_channels()
-        for channel in channels:
-            await db.remove_channel(channel['channel_id'])
-            print(f"✅ Канал {channel['channel_id']} удален")
-    except Exception as e:
-        print(f"Ошибка при удалении каналов: {e}")
 
 def main():
     """Запускает скрипт."""
-    print("Запуск скрипта для добавления реальных каналов...")
-    print("\nВНИМАНИЕ: Перед запуском отредактируйте файл add_real_channels.py")
-    print("и замените примеры каналов на свои реальные каналы.")
-    
-    confirm = input("\nПродолжить? (y/n): ")
-    if confirm.lower() != 'y':
-        print("Отмена.")
-        return
-    
+    arg_parser = argparse.ArgumentParser(description="Массовое добавление каналов мониторинга")
+    arg_parser.add_argument("sources", nargs="+", help="Файлы .txt/.csv со списком каналов или сами @username, ссылки t.me и ID")
+    arg_parser.add_argument("--concurrency", type=int, default=None, help="@username, разрешаемых одновременно")
+    arg_parser.add_argument("--batch-size", type=int, default=100, help="Каналов в одном запросе channels.getChannels")
+    arg_parser.add_argument("--no-resolve", action="store_true", help="Не проверять каналы через Telethon")
+    arg_parser.add_argument("--dry-run", action="store_true", help="Не записывать каналы в базу данных")
+    arg_parser.add_argument("--report", default=None, help="Сохранить отчет по каждому значению в CSV")
+    args = arg_parser.parse_args()
+
     try:
-        # Запускаем асинхронную функцию
-        asyncio.run(add_real_channels())
+        asyncio.run(main_async(args))
     except KeyboardInterrupt:
         print("Скрипт остановлен пользователем")
-    except Exception as e:
-        print(f"Ошибка при выполнении скрипта: {e}")
+
 
 if __name__ == "__main__":
-    main() 
\ No newline at end of file
+    main()
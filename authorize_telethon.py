@@ -8,13 +8,16 @@
 import os
 import sys
 import asyncio
-from telethon import TelegramClient
 from telethon.errors import SessionPasswordNeededError
 from dotenv import load_dotenv
 
 # Загрузка переменных окружения
 load_dotenv()
 
+import config
+import telethon_session
+from database import create_database
+
 # Получение настроек Telethon
 API_ID = os.getenv("TELEGRAM_API_ID")
 API_HASH = os.getenv("TELEGRAM_API_HASH")
@@ -29,21 +32,26 @@ if not API_ID or not API_HASH or not PHONE:
     print("TELEGRAM_PHONE=ваш_номер_телефона")
     sys.exit(1)
 
+async def close(db):
+    """Отключает клиент, записывает сессию и закрывает базу."""
+    await telethon_session.close_clients()
+    if db:
+        await db.close()
+
 async def main():
     print(f"Авторизация Telethon клиента для номера {PHONE}...")
     
-    # Создаем клиент Telethon
-    client = TelegramClient(
-        'telegram_parser_session', 
-        API_ID, 
-        API_HASH,
-        device_model="Windows Desktop",
-        system_version="4.16.30-vxCUSTOM",
-        app_version="1.0.0"
-    )
+    # Сессия в базе (TELETHON_SESSION_STORE=database) требует подключения к ней
+    db = None
+    if config.TELETHON_SESSION_STORE.lower() == "database":
+        db = create_database()
+        if not await db.connect():
+            print("Ошибка: не удалось подключиться к базе данных.")
+            return
+        await db.migrate_schema()
     
-    # Подключаемся
-    await client.connect()
+    # Создаем и подключаем клиент Telethon
+    client = await telethon_session.get_client(db=db)
     
     # Проверяем, авторизован ли клиент
     if await client.is_user_authorized():
@@ -62,7 +70,7 @@ async def main():
         if len(channels) > 10:
             print(f"...и еще {len(channels) - 10} каналов")
         
-        await client.disconnect()
+        await close(db)
         return
     
     # Отправляем код авторизации
@@ -99,7 +107,7 @@ async def main():
     else:
         print("Авторизация не удалась.")
     
-    await client.disconnect()
+    await close(db)
 
 if __name__ == "__main__":
     asyncio.run(main()) 
\ No newline at end of file
@@ -0,0 +1,195 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Дозагрузка истории каналов с проверкой по текущим ключевым словам
+
+Пример запуска:
+    python backfill.py @channel_name -1001234567890 --days 14
+    python backfill.py --all --days 7 --takeout
+"""
+
+import argparse
+import asyncio
+import os
+from datetime import datetime, timedelta, timezone
+from dotenv import load_dotenv
+from loguru import logger
+from telethon.errors import FloodWaitError, TakeoutInitDelayError
+from database import create_database
+from parser import MessageParser
+import telethon_session
+
+# Загрузка переменных окружения
+load_dotenv()
+
+
+class HistoryBackfill:
+    """Постраничная дозагрузка истории каналов с контрольными точками.
+
+    История читается от новых сообщений к старым через iter_messages, пачками
+    по chunk_size сообщений. После каждой пачки сообщения проходят обычную
+    проверку парсера (process_messages), а ID самого старого просмотренного
+    сообщения сохраняется в backfill_state, поэтому прерванная дозагрузка
+    продолжается с того же места. Перед каждой пачкой дозагрузка ждет
+    окончания текущего цикла живого опроса и делает паузу, уступая ему лимиты API.
+    """
+
+    def __init__(self, parser, chunk_size=None, use_takeout=False, pause=None):
+        """Инициализирует дозагрузку.
+
+        Args:
+            parser: Экземпляр MessageParser с подключенным Telethon клиентом
+            chunk_size: Количество сообщений в одной пачке
+            use_takeout: Использовать takeout-сессию Telethon (повышенные лимиты экспорта)
+            pause: Пауза между пачками в секундах
+        """
+        self.parser = parser
+        self.db = parser.db
+        self.chunk_size = chunk_size or int(os.getenv("BACKFILL_CHUNK_SIZE", "500"))
+        self.use_takeout = use_takeout
+        self.pause = pause if pause is not None else float(os.getenv("BACKFILL_PAUSE", "2.0"))
+
+    async def _wait_for_idle(self):
+        """Ждет окончания цикла живого опроса каналов."""
+        while self.parser.cycle_in_progress:
+            await asyncio.sleep(1)
+        if self.pause:
+            await asyncio.sleep(self.pause)
+
+    async def _process_batch(self, channel_id, batch, keywords, stopwords):
+        # Пачка собрана от новых к старым, проверяем от старых к новым
+        batch = list(reversed(batch))
+        await self.parser.archive_messages(channel_id, batch)
+        forwarded = await self.parser.process_messages(channel_id, batch, keywords, stopwords, trace=False)
+        await self.db.flush()
+        return forwarded
+
+    async def _scan(self, client, entity, channel_id, offset_id, scanned, since):
+        """Читает историю канала начиная с offset_id до даты since."""
+        # Вместе со списками слов загружаются наборы правил каналов
+        await self.parser.load_rules()
+        keywords, stopwords = self.parser.keywords, self.parser.stopwords
+        forwarded = 0
+        batch = []
+
+        await self._wait_for_idle()
+        async for msg in client.iter_messages(entity, offset_id=offset_id, wait_time=1):
+            if msg.date and msg.date < since:
+                break
+            batch.append(self.parser.convert_message(msg))
+
+            if len(batch) >= self.chunk_size:
+                forwarded += await self._process_batch(channel_id, batch, keywords, stopwords)
+                scanned += len(batch)
+                offset_id = batch[-1].message_id
+                await self.db.save_backfill_state(channel_id, offset_id, scanned)
+                logger.info(f"Дозагрузка {channel_id}: просмотрено {scanned}, контрольная точка {offset_id}")
+                batch = []
+
+                await self._wait_for_idle()
+                # Правила могли измениться, пока мы ждали: перезагружаются вместе с наборами
+                await self.parser.load_rules()
+                keywords, stopwords = self.parser.keywords, self.parser.stopwords
+
+        if batch:
+            forwarded += await self._process_batch(channel_id, batch, keywords, stopwords)
+            scanned += len(batch)
+            offset_id = batch[-1].message_id
+
+        await self.db.save_backfill_state(channel_id, offset_id, scanned, done=True)
+        return scanned, forwarded
+
+    async def backfill_channel(self, channel_id, days=7, restart=False):
+        """Дозагружает историю канала за последние days дней.
+
+        Returns:
+            Кортеж (всего просмотрено сообщений, переслано в этом запуске)
+        """
+        if restart:
+            await self.db.reset_backfill_state(channel_id)
+
+        state = await self.db.get_backfill_state(channel_id)
+        if state and state['done']:
+            logger.info(f"Дозагрузка канала {channel_id} уже завершена (используйте restart для повтора)")
+            return state['scanned'], 0
+
+        offset_id = state['offset_id'] if state else 0
+        scanned = state['scanned'] if state else 0
+        since = datetime.now(timezone.utc) - timedelta(days=days)
+        client = self.parser.client
+
+        entity = await self.parser.get_channel_entity(channel_id)
+        logger.info(f"Начинаем дозагрузку истории канала {channel_id} за {days} дн. с сообщения {offset_id or 'последнего'}")
+
+        while True:
+            try:
+                if self.use_takeout:
+                    try:
+                        async with client.takeout(channels=True, megagroups=True) as takeout:
+                            return await self._scan(takeout, entity, channel_id, offset_id, scanned, since)
+                    except TakeoutInitDelayError as e:
+                        logger.warning(f"Takeout-сессия будет доступна через {e.seconds} сек., продолжаем без нее")
+                        self.use_takeout = False
+                        continue
+                return await self._scan(client, entity, channel_id, offset_id, scanned, since)
+            except FloodWaitError as e:
+                logger.warning(f"Превышен лимит запросов при дозагрузке. Ожидаем {e.seconds} секунд")
+                await asyncio.sleep(e.seconds)
+                # Продолжаем с последней сохраненной контрольной точки
+                state = await self.db.get_backfill_state(channel_id)
+                if state:
+                    offset_id, scanned = state['offset_id'], state['scanned']
+
+
+async def main_async(args):
+    db = create_database()
+    if not await db.connect():
+        logger.error("Не удалось подключиться к базе данных.")
+        return
+
+    parser = MessageParser(db, os.getenv("TARGET_CHANNEL_ID"))
+    try:
+        if not await parser.initialize_telethon():
+            logger.error("Не удалось инициализировать Telethon клиент.")
+            return
+
+        channel_ids = list(args.channels)
+        if args.all:
+            channel_ids += [c['channel_id'] for c in await db.get_channels()]
+        if not channel_ids:
+            logger.warning("Не указаны каналы для дозагрузки")
+            return
+
+        backfill = HistoryBackfill(parser, chunk_size=args.chunk_size, use_takeout=args.takeout, pause=args.pause)
+        for channel_id in channel_ids:
+            try:
+                scanned, forwarded = await backfill.backfill_channel(channel_id, days=args.days, restart=args.restart)
+                logger.info(f"Канал {channel_id}: просмотрено {scanned}, переслано {forwarded}")
+            except Exception as e:
+                logger.error(f"Ошибка при дозагрузке канала {channel_id}: {e}")
+    finally:
+        await telethon_session.close_clients()
+        await db.close()
+
+
+def main():
+    """Запускает скрипт."""
+    arg_parser = argparse.ArgumentParser(description="Дозагрузка истории каналов")
+    arg_parser.add_argument("channels", nargs="*", help="ID или @username каналов")
+    arg_parser.add_argument("--all", action="store_true", help="Все активные каналы из базы данных")
+    arg_parser.add_argument("--days", type=int, default=7, help="Глубина истории в днях")
+    arg_parser.add_argument("--chunk-size", type=int, default=None, help="Сообщений в одной пачке")
+    arg_parser.add_argument("--pause", type=float, default=None, help="Пауза между пачками, сек.")
+    arg_parser.add_argument("--takeout", action="store_true", help="Использовать takeout-сессию")
+    arg_parser.add_argument("--restart", action="store_true", help="Начать заново, игнорируя контрольные точки")
+    args = arg_parser.parse_args()
+
+    try:
+        asyncio.run(main_async(args))
+    except KeyboardInterrupt:
+        print("Скрипт остановлен пользователем")
+
+
+if __name__ == "__main__":
+    main()
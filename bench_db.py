@@ -0,0 +1,250 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Бенчмарк слоя базы данных с проверкой регрессий
+
+Заполняет базу до заданных размеров, под параллельной нагрузкой измеряет
+горячие запросы парсера (process_channel) и обработчиков бота и сравнивает
+p99 с сохраненным эталоном. При регрессии скрипт завершается с кодом 1.
+
+Бэкенд выбирается как обычно (DB_BACKEND, SQLITE_PATH, DB_*). Используйте
+отдельную базу: бенчмарк добавляет в нее тестовые каналы и сообщения.
+
+Пример запуска:
+    DB_BACKEND=sqlite SQLITE_PATH=bench.db python bench_db.py --processed 1e6 --save-baseline
+    DB_BACKEND=sqlite SQLITE_PATH=bench.db python bench_db.py --processed 1e6
+"""
+
+import argparse
+import asyncio
+import json
+import random
+import sys
+import time
+from loguru import logger
+import config
+from database import create_database
+from metrics import percentile
+
+# Строк processed_messages за один запрос при заполнении
+SEED_CHUNK = 1_000_000
+
+
+def channel_ids(count):
+    return [f"-100{1000000 + i}" for i in range(count)]
+
+
+async def count_processed(db):
+    if config.DB_BACKEND.lower() == "sqlite":
+        return await db._fetchval('SELECT COUNT(*) FROM processed_messages')
+    async with db.pool.acquire() as conn:
+        return await conn.fetchval('SELECT COUNT(*) FROM processed_messages')
+
+
+async def seed_processed(db, channels, per_channel, start):
+    """Вставляет per_channel сообщений для каждого канала, начиная с ID start."""
+    if config.DB_BACKEND.lower() == "sqlite":
+        # Генерируем строки внутри SQLite рекурсивным CTE, без передачи из Python
+        sql = '''
+            WITH RECURSIVE seq(n) AS (SELECT ? UNION ALL SELECT n + 1 FROM seq WHERE n < ?)
+            INSERT OR IGNORE INTO processed_messages (channel_id, message_id)
+            SELECT ?, n FROM seq
+        '''
+        for channel_id in channels:
+            await db._execute(sql, (start, start + per_channel - 1, channel_id))
+    else:
+        async with db.pool.acquire() as conn:
+            await conn.execute('''
+                INSERT INTO processed_messages (channel_id, message_id)
+                SELECT c, n FROM unnest($1::text[]) AS c, generate_series($2::bigint, $3::bigint) AS n
+                ON CONFLICT DO NOTHING
+            ''', channels, start, start + per_channel - 1)
+
+
+async def seed(db, args):
+    """Доводит размеры таблиц до заданных в аргументах."""
+    channels = channel_ids(args.channels)
+    await db.add_channels([(channel_id, f"Бенчмарк {channel_id}") for channel_id in channels])
+    await db.add_keywords([f"ключ{i}" for i in range(args.keywords)])
+    await db.add_stopwords([f"стоп{i}" for i in range(args.stopwords)])
+
+    existing = await count_processed(db)
+    if existing >= args.processed:
+        print(f"processed_messages: {existing} строк, заполнение не требуется")
+        return
+
+    per_channel = -(-args.processed // len(channels))
+    # Заполняем порциями по SEED_CHUNK строк, чтобы видеть прогресс на больших объемах
+    step = max(1, SEED_CHUNK // len(channels))
+    started = time.perf_counter()
+    for offset in range(1, per_channel + 1, step):
+        size = min(step, per_channel - offset + 1)
+        await seed_processed(db, channels, size, offset)
+        done = (offset + size - 1) * len(channels)
+        print(f"\rЗаполнение processed_messages: {done}/{per_channel * len(channels)}", end="", flush=True)
+    print(f"\nЗаполнено за {time.perf_counter() - started:.1f} с")
+
+
+def build_operations(db, args, per_channel):
+    """Горячие запросы цикла парсера и обработчиков бота."""
+    channels = channel_ids(args.channels)
+    rng = random.Random(args.seed)
+    new_ids = iter(range(10 ** 12, 10 ** 13))
+
+    async def processed_hit():
+        await db.is_message_processed(rng.choice(channels), rng.randint(1, per_channel))
+
+    async def processed_miss():
+        await db.is_message_processed(rng.choice(channels), per_channel + rng.randint(1, 10 ** 6))
+
+    async def mark_processed():
+        await db.mark_message_processed(rng.choice(channels), next(new_ids))
+        await db.flush()
+
+    async def channel_state():
+        await db.get_channel_state(rng.choice(channels))
+
+    async def counts():
+        await db.get_counts()
+
+    async def keywords_page():
+        await db.get_keywords_page(after_id=rng.randint(0, max(1, args.keywords - 20)))
+
+    async def channels_page():
+        await db.get_channels_page(after_id=rng.randint(0, max(1, args.channels - 20)))
+
+    return {
+        "is_message_processed_hit": processed_hit,
+        "is_message_processed_miss": processed_miss,
+        "mark_message_processed": mark_processed,
+        "get_channel_state": channel_state,
+        "get_channels": db.get_channels,
+        "get_keywords": db.get_keywords,
+        "get_stopwords": db.get_stopwords,
+        "get_counts": counts,
+        "get_keywords_page": keywords_page,
+        "get_channels_page": channels_page,
+    }
+
+
+async def measure(operation, iterations, concurrency):
+    """Выполняет operation iterations раз в concurrency параллельных потоках."""
+    latencies = []
+    remaining = iterations
+
+    async def worker():
+        nonlocal remaining
+        while remaining > 0:
+            remaining -= 1
+            started = time.perf_counter()
+            await operation()
+            latencies.append(time.perf_counter() - started)
+
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    latencies.sort()
+    return {
+        "p50": percentile(latencies, 0.50),
+        "p95": percentile(latencies, 0.95),
+        "p99": percentile(latencies, 0.99),
+    }
+
+
+def compare(results, baseline, tolerance, min_delta):
+    """Возвращает список регрессий p99 относительно эталона."""
+    regressions = []
+    for name, stats in results.items():
+        reference = baseline.get(name)
+        if not reference:
+            continue
+        limit = max(reference["p99"] * (1 + tolerance), reference["p99"] + min_delta)
+        if stats["p99"] > limit:
+            regressions.append(f"{name}: p99 {stats['p99'] * 1000:.2f} мс > {limit * 1000:.2f} мс "
+                               f"(эталон {reference['p99'] * 1000:.2f} мс)")
+    return regressions
+
+
+async def run_benchmark(args):
+    db = create_database()
+    if not await db.connect():
+        print("Не удалось подключиться к базе данных")
+        return 2
+
+    try:
+        await seed(db, args)
+        per_channel = -(-args.processed // args.channels)
+        operations = build_operations(db, args, per_channel)
+        selected = [name for name in operations if not args.only or name in args.only]
+
+        print(f"\nБэкенд: {config.DB_BACKEND}, строк: {args.processed}, каналов: {args.channels}, "
+              f"ключевых слов: {args.keywords}, параллельность: {args.concurrency}")
+        print(f"{'запрос':<28} {'p50, мс':>9} {'p95, мс':>9} {'p99, мс':>9}")
+        results = {}
+        for name in selected:
+            # Прогрев кэшей и подготовленных выражений
+            await measure(operations[name], min(50, args.iterations), 1)
+            stats = await measure(operations[name], args.iterations, args.concurrency)
+            results[name] = stats
+            print(f"{name:<28} {stats['p50'] * 1000:>9.3f} {stats['p95'] * 1000:>9.3f} {stats['p99'] * 1000:>9.3f}")
+    finally:
+        await db.close()
+
+    # Эталон хранится отдельно для каждого бэкенда и размера базы
+    key = f"{config.DB_BACKEND.lower()}:{args.processed}:{args.concurrency}"
+    try:
+        with open(args.baseline, encoding="utf-8") as f:
+            baselines = json.load(f)
+    except FileNotFoundError:
+        baselines = {}
+
+    if args.save_baseline:
+        baselines[key] = results
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(baselines, f, indent=2, ensure_ascii=False)
+        print(f"\nЭталон {key} сохранен в {args.baseline}")
+        return 0
+
+    if key not in baselines:
+        print(f"\nЭталон {key} не найден в {args.baseline}, сравнение пропущено (используйте --save-baseline)")
+        return 0
+
+    regressions = compare(results, baselines[key], args.tolerance, args.min_delta_ms / 1000)
+    if regressions:
+        print("\n❌ Регрессия p99:")
+        for line in regressions:
+            print(f"  {line}")
+        return 1
+    print(f"\n✅ p99 в пределах эталона (+{args.tolerance:.0%})")
+    return 0
+
+
+def main():
+    """Запускает бенчмарк."""
+    arg_parser = argparse.ArgumentParser(description="Бенчмарк слоя базы данных")
+    arg_parser.add_argument("--processed", type=float, default=1e5, help="Строк в processed_messages (1e3 … 1e8)")
+    arg_parser.add_argument("--channels", type=int, default=100, help="Количество каналов")
+    arg_parser.add_argument("--keywords", type=int, default=500, help="Количество ключевых слов")
+    arg_parser.add_argument("--stopwords", type=int, default=100, help="Количество стоп-слов")
+    arg_parser.add_argument("--iterations", type=int, default=2000, help="Выполнений каждого запроса")
+    arg_parser.add_argument("--concurrency", type=int, default=8, help="Параллельных запросов")
+    arg_parser.add_argument("--only", nargs="*", help="Измерить только указанные запросы")
+    arg_parser.add_argument("--baseline", default="bench_baseline.json", help="Файл эталона")
+    arg_parser.add_argument("--save-baseline", action="store_true", help="Сохранить результаты как эталон")
+    arg_parser.add_argument("--tolerance", type=float, default=0.25, help="Допустимый рост p99 (доля)")
+    arg_parser.add_argument("--min-delta-ms", type=float, default=1.0, help="Рост p99 меньше этого значения не считается регрессией")
+    arg_parser.add_argument("--seed", type=int, default=1, help="Зерно генератора случайных чисел")
+    args = arg_parser.parse_args()
+    args.processed = int(args.processed)
+
+    # Логи каждого запроса искажают замер
+    logger.remove()
+    logger.add(sys.stderr, level="WARNING")
+
+    try:
+        sys.exit(asyncio.run(run_benchmark(args)))
+    except KeyboardInterrupt:
+        print("Бенчмарк остановлен пользователем")
+
+
+if __name__ == "__main__":
+    main()
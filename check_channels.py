@@ -2,117 +2,248 @@
 # -*- coding: utf-8 -*-
 
 """
-Скрипт для проверки доступа к каналам
+Проверка состояния всех каналов мониторинга через Telethon
+
+Пример запуска:
+    python check_channels.py
+    python check_channels.py --inactive-days 14 --concurrency 10 --dry-run
 """
 
+import argparse
 import asyncio
-import logging
-from dotenv import load_dotenv
 import os
-from telegram import Bot
-from database import Database
-from parser import MessageParser
-
-# Настройка логирования
-logging.basicConfig(
-    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s", level=logging.INFO
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+from dotenv import load_dotenv
+from loguru import logger
+from telethon import utils
+from telethon.errors import (
+    ChannelPrivateError, ChannelInvalidError, ChannelBannedError, ChatForbiddenError,
+    UsernameNotOccupiedError, UsernameInvalidError, PeerIdInvalidError,
 )
-logger = logging.getLogger(__name__)
+from telethon.tl.types import Channel, ChannelForbidden
+from database import create_database
+from parser import MessageParser
+from fanout import RateLimiter
+import metrics
+import telethon_session
 
 # Загрузка переменных окружения
 load_dotenv()
 
-# Получаем настройки из переменных окружения
-BOT_TOKEN = os.getenv("BOT_TOKEN")
-TARGET_CHANNEL_ID = os.getenv("TARGET_CHANNEL_ID")
+# Статусы каналов по результату проверки
+STATUS_OK = "ok"
+STATUS_PRIVATE = "private"
+STATUS_BANNED = "banned"
+STATUS_RENAMED = "renamed"
+STATUS_DEAD = "dead"
+STATUS_INACTIVE = "inactive"
+STATUS_ERROR = "error"
+
+STATUS_LABELS = {
+    STATUS_OK: "✅ доступен",
+    STATUS_RENAMED: "✏️ переименован",
+    STATUS_INACTIVE: "💤 нет новых сообщений",
+    STATUS_PRIVATE: "🔒 закрыт для аккаунта",
+    STATUS_BANNED: "⛔ аккаунт заблокирован в канале",
+    STATUS_DEAD: "💀 не существует (отключен)",
+    STATUS_ERROR: "⚠️ ошибка проверки",
+}
+
+
+class AuditResult:
+    """Результат проверки одного канала."""
+
+    __slots__ = ("channel_id", "status", "title", "last_post_at", "detail")
+
+    def __init__(self, channel_id, status, title=None, last_post_at=None, detail=None):
+        self.channel_id = channel_id
+        self.status = status
+        self.title = title
+        self.last_post_at = last_post_at
+        self.detail = detail
+
+    def describe(self):
+        line = f"{self.channel_id} ({self.title or '—'}): {STATUS_LABELS.get(self.status, self.status)}"
+        if self.last_post_at:
+            line += f", последнее сообщение {self.last_post_at.strftime('%Y-%m-%d')}"
+        if self.detail:
+            line += f" — {self.detail}"
+        return line
+
+
+class ChannelAudit:
+    """Параллельная проверка каналов мониторинга.
+
+    Каналы проверяются одновременно (не больше concurrency сразу) через общий
+    клиент Telethon парсера, а все запросы к API проходят через общий лимит
+    парсера (bulk_limiter, BULK_API_RATE запросов в минуту), FloodWait
+    приостанавливает всех. Для каждого канала разрешается сущность и читается
+    последнее сообщение; результат записывается в таблицу channels, а
+    несуществующие каналы отключаются, чтобы планировщик не тратил на них лимиты.
+    """
+
+    def __init__(self, parser, concurrency=None, rate=None, inactive_days=None):
+        """Инициализирует проверку.
+
+        Args:
+            parser: Экземпляр MessageParser с подключенным Telethon клиентом
+            concurrency: Сколько каналов проверяется одновременно
+            rate: Собственный лимит запросов к API в минуту (0 — без ограничения);
+                по умолчанию используется общий лимит парсера
+            inactive_days: Через сколько дней без сообщений канал считается неактивным
+        """
+        self.parser = parser
+        self.db = parser.db
+        self.concurrency = concurrency or int(os.getenv("AUDIT_CONCURRENCY", "5"))
+        self.limiter = RateLimiter(rate) if rate is not None else parser.bulk_limiter
+        self.inactive_days = inactive_days or int(os.getenv("AUDIT_INACTIVE_DAYS", "30"))
+
+    async def _call(self, request):
+        return await self.parser.call_limited(request, self.limiter)
+
+    async def check_channel(self, channel):
+        """Проверяет один канал из таблицы channels."""
+        channel_id = str(channel['channel_id'])
+        stored_name = channel['name']
+        # Сущность разрешается заново: кэш парсера мог устареть
+        self.parser.entity_cache.pop(channel_id, None)
+        try:
+            entity = await self._call(lambda: self.parser.get_channel_entity(channel_id))
+        except (UsernameNotOccupiedError, UsernameInvalidError, ChannelInvalidError, PeerIdInvalidError) as e:
+            return AuditResult(channel_id, STATUS_DEAD, stored_name, detail=type(e).__name__)
+        except ValueError as e:
+            # Имя пользователя никому не принадлежит; числовой ID без доступа к каналу не разрешается
+            status = STATUS_DEAD if channel_id.startswith('@') else STATUS_PRIVATE
+            return AuditResult(channel_id, status, stored_name, detail=str(e))
+        except ChannelPrivateError:
+            return AuditResult(channel_id, STATUS_PRIVATE, stored_name)
+        except (ChannelBannedError, ChatForbiddenError):
+            return AuditResult(channel_id, STATUS_BANNED, stored_name)
+
+        if isinstance(entity, ChannelForbidden):
+            self.parser.entity_cache.pop(channel_id, None)
+            return AuditResult(channel_id, STATUS_BANNED, entity.title)
+        title = getattr(entity, 'title', None) or utils.get_display_name(entity)
+
+        try:
+            messages = await self._call(lambda: self.parser.client.get_messages(entity, limit=1))
+        except ChannelPrivateError:
+            return AuditResult(channel_id, STATUS_PRIVATE, title)
+        except (ChannelBannedError, ChatForbiddenError):
+            return AuditResult(channel_id, STATUS_BANNED, title)
+        last_post_at = messages[0].date if messages else None
+
+        if last_post_at is None or datetime.now(timezone.utc) - last_post_at > timedelta(days=self.inactive_days):
+            return AuditResult(channel_id, STATUS_INACTIVE, title, last_post_at)
+        username = getattr(entity, 'username', None) if isinstance(entity, Channel) else None
+        renamed_from = None
+        if channel_id.startswith('@') and username and username.lower() != channel_id[1:].lower():
+            renamed_from = channel_id
+        elif stored_name and stored_name != title:
+            renamed_from = stored_name
+        if renamed_from:
+            return AuditResult(channel_id, STATUS_RENAMED, title, last_post_at, detail=f"было: {renamed_from}")
+        return AuditResult(channel_id, STATUS_OK, title, last_post_at)
+
+    async def run(self, channels=None, dry_run=False):
+        """Проверяет каналы и записывает результаты.
+
+        Args:
+            channels: Строки таблицы channels; по умолчанию все активные каналы
+            dry_run: Только проверить, не изменяя базу данных
+
+        Returns:
+            Список AuditResult в порядке каналов
+        """
+        if channels is None:
+            channels = list(await self.db.get_channels())
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def check(channel):
+            async with semaphore:
+                try:
+                    return await self.check_channel(channel)
+                except Exception as e:
+                    logger.error(f"Ошибка при проверке канала {channel['channel_id']}: {e}")
+                    return AuditResult(str(channel['channel_id']), STATUS_ERROR, channel['name'], detail=str(e))
+
+        logger.info(f"Проверка {len(channels)} каналов (одновременно {self.concurrency})...")
+        results = await asyncio.gather(*(check(channel) for channel in channels))
+
+        # Доступный канал снимается с карантина парсера
+        for result in results:
+            if result.status in (STATUS_OK, STATUS_RENAMED, STATUS_INACTIVE):
+                self.parser.breaker.record_success(result.channel_id)
+        counts = Counter(result.status for result in results)
+        for status in STATUS_LABELS:
+            metrics.CHANNEL_AUDIT_STATUS.set(counts.get(status, 0), status=status)
+        if not dry_run:
+            # Ошибки проверки не меняют запись канала
+            await self.db.save_channel_audit([
+                (r.channel_id, r.status, r.title, r.last_post_at, r.status != STATUS_DEAD)
+                for r in results if r.status != STATUS_ERROR
+            ])
+        logger.info("Проверка каналов завершена: " + ", ".join(f"{s} {n}" for s, n in counts.most_common()))
+        return results
+
 
-async def check_channels():
-    """Проверяет доступ к каналам и отправляет тестовое сообщение."""
-    # Инициализация базы данных и бота
-    db = Database()
-    bot = Bot(BOT_TOKEN)
-    
+def summary(results, limit=30):
+    """Сводка: количество по статусам и до limit каналов, требующих внимания."""
+    counts = Counter(result.status for result in results)
+    lines = [f"Проверено каналов: {len(results)}"]
+    for status, label in STATUS_LABELS.items():
+        if counts.get(status):
+            lines.append(f"{label}: {counts[status]}")
+    problems = [result for result in results if result.status != STATUS_OK]
+    if problems and limit:
+        lines.append("")
+        lines += [result.describe() for result in problems[:limit]]
+        if len(problems) > limit:
+            lines.append(f"...и еще {len(problems) - limit}")
+    return "\n".join(lines)
+
+
+async def main_async(args):
+    db = create_database()
+    if not await db.connect():
+        logger.error("Не удалось подключиться к базе данных.")
+        return
+
+    parser = MessageParser(db, os.getenv("TARGET_CHANNEL_ID"))
     try:
-        # Подключение к базе данных
-        connected = await db.connect()
-        if not connected:
-            logger.error("Не удалось подключиться к базе данных.")
+        if not await parser.initialize_telethon():
+            logger.error("Не удалось инициализировать Telethon клиент.")
             return
-        
-        # Создаем парсер
-        parser = MessageParser(bot, db, TARGET_CHANNEL_ID)
-        
-        # Получаем список каналов
-        channels = await db.get_channels()
-        
-        if not channels:
+
+        audit = ChannelAudit(parser, concurrency=args.concurrency, rate=args.rate, inactive_days=args.inactive_days)
+        results = await audit.run(dry_run=args.dry_run)
+        if not results:
             logger.warning("Нет каналов для проверки.")
             return
-        
-        logger.info(f"Проверка доступа к {len(channels)} каналам...")
-        
-        # Проверяем доступ к каждому каналу
-        for channel in channels:
-            channel_id = channel['channel_id']
-            channel_name = channel['name'] or str(channel_id)
-            
-            logger.info(f"Проверка канала {channel_name} ({channel_id})...")
-            
-            # Проверяем доступ к каналу
-            has_access, actual_id = await parser.check_channel_access(channel_id)
-            
-            if has_access:
-                logger.info(f"✅ Доступ к каналу {channel_name} ({channel_id}) успешно получен.")
-                
-                # Отправляем тестовое сообщение в целевой канал
-                try:
-                    await bot.send_message(
-                        chat_id=TARGET_CHANNEL_ID,
-                        text=f"✅ Тестовое сообщение: Канал {channel_name} ({channel_id}) доступен для мониторинга."
-                    )
-                    logger.info(f"✅ Тестовое сообщение отправлено в целевой канал {TARGET_CHANNEL_ID}")
-                except Exception as e:
-                    logger.error(f"❌ Ошибка отправки тестового сообщения: {e}")
-            else:
-                logger.error(f"❌ Нет доступа к каналу {channel_name} ({channel_id})")
-                
-                # Отправляем сообщение об ошибке в целевой канал
-                try:
-                    await bot.send_message(
-                        chat_id=TARGET_CHANNEL_ID,
-                        text=f"❌ Ошибка: Нет доступа к каналу {channel_name} ({channel_id})"
-                    )
-                except Exception as e:
-                    logger.error(f"❌ Ошибка отправки сообщения об ошибке: {e}")
-        
-        # Проверяем доступ к целевому каналу
-        try:
-            target_chat = await bot.get_chat(chat_id=TARGET_CHANNEL_ID)
-            logger.info(f"✅ Доступ к целевому каналу {target_chat.title} ({TARGET_CHANNEL_ID}) успешно получен.")
-        except Exception as e:
-            logger.error(f"❌ Нет доступа к целевому каналу {TARGET_CHANNEL_ID}: {e}")
-        
-    except Exception as e:
-        logger.error(f"Ошибка при проверке каналов: {e}")
+        for result in results:
+            print(result.describe())
+        print()
+        print(summary(results, limit=0))
     finally:
-        # Закрытие соединения с базой данных
+        await telethon_session.close_clients()
         await db.close()
 
-async def main_async():
-    """Асинхронная функция для запуска проверки каналов."""
-    await check_channels()
 
 def main():
     """Запускает скрипт."""
-    print("Запуск скрипта для проверки доступа к каналам...")
-    
+    arg_parser = argparse.ArgumentParser(description="Проверка состояния каналов мониторинга")
+    arg_parser.add_argument("--concurrency", type=int, default=None, help="Каналов одновременно")
+    arg_parser.add_argument("--rate", type=int, default=None, help="Запросов к API в минуту (по умолчанию BULK_API_RATE, 0 — без ограничения)")
+    arg_parser.add_argument("--inactive-days", type=int, default=None, help="Дней без сообщений до статуса inactive")
+    arg_parser.add_argument("--dry-run", action="store_true", help="Не записывать результаты в базу данных")
+    args = arg_parser.parse_args()
+
     try:
-        # Запускаем асинхронную функцию
-        asyncio.run(main_async())
+        asyncio.run(main_async(args))
     except KeyboardInterrupt:
         print("Скрипт остановлен пользователем")
-    except Exception as e:
-        print(f"Ошибка при выполнении скрипта: {e}")
+
 
 if __name__ == "__main__":
-    main() 
\ No newline at end of file
+    main()
@@ -1,6 +1,6 @@
 import re
 import asyncio
-from database import Database
+from database import create_database
 
 async def check_keywords_in_message(message_text, keywords, stopwords):
     """Проверяет наличие ключевых слов в сообщении и отсутствие стоп-слов"""
@@ -57,7 +57,7 @@ async def main():
 Пресс-секретарь президента РФ добавил, что такого развития событий не хотелось бы."""
     
     # Подключаемся к базе данных
-    db = Database()
+    db = create_database()
     await db.connect()
     
     # Получаем ключевые слова и стоп-слова из базы данных
@@ -0,0 +1,151 @@
+import logging
+import os
+import time
+from telethon.errors import (
+    ChannelPrivateError, ChannelInvalidError, ChannelBannedError, ChatForbiddenError, UserBannedInChannelError,
+    UsernameNotOccupiedError, UsernameInvalidError, PeerIdInvalidError,
+)
+
+logger = logging.getLogger(__name__)
+
+# Классы ошибок канала (совпадают со статусами check_channels.py)
+FAILURE_DEAD = "dead"
+FAILURE_PRIVATE = "private"
+FAILURE_BANNED = "banned"
+FAILURE_ERROR = "error"
+
+# Канал с постоянной ошибкой уходит на карантин сразу и может быть отключен
+PERMANENT_FAILURES = (FAILURE_DEAD, FAILURE_PRIVATE, FAILURE_BANNED)
+
+
+def classify_error(error):
+    """Определяет класс ошибки получения сообщений канала."""
+    if isinstance(error, (UsernameNotOccupiedError, UsernameInvalidError, ChannelInvalidError, PeerIdInvalidError)):
+        return FAILURE_DEAD
+    if isinstance(error, ChannelPrivateError):
+        return FAILURE_PRIVATE
+    if isinstance(error, (ChannelBannedError, ChatForbiddenError, UserBannedInChannelError)):
+        return FAILURE_BANNED
+    # ValueError ("Could not find the input entity") — тоже временная ошибка:
+    # так Telethon отвечает и при пустом кэше сущностей сессии (например, после
+    # перехода на другое хранилище сессии), поэтому канал уходит на карантин
+    # только после failure_threshold ошибок подряд и не отключается
+    return FAILURE_ERROR
+
+
+class ChannelCircuit:
+    """Состояние автомата одного канала."""
+
+    __slots__ = ("kind", "failures", "first_failure_at", "open_until", "opens", "last_error")
+
+    def __init__(self, kind, first_failure_at):
+        self.kind = kind
+        self.failures = 0
+        self.first_failure_at = first_failure_at
+        self.open_until = 0.0
+        self.opens = 0
+        self.last_error = None
+
+
+class CircuitBreaker:
+    """Автоматы отключения каналов, получение сообщений из которых не удается.
+
+    Ошибки подряд считаются по каналу и классу. Временная ошибка переводит
+    канал на карантин после failure_threshold ошибок подряд, постоянная
+    (канал не существует, закрыт или аккаунт заблокирован) — сразу. Карантин
+    длится backoff секунд и удваивается при каждой следующей неудаче, но не
+    дольше max_backoff; по его окончании канал получает одну попытку,
+    успешная попытка снимает карантин. Канал с постоянной ошибкой дольше
+    deactivate_days дней парсер отключает.
+    """
+
+    def __init__(self, failure_threshold=None, backoff=None, max_backoff=None, deactivate_days=None):
+        """Инициализирует автоматы.
+
+        Args:
+            failure_threshold: Временных ошибок подряд до карантина
+            backoff: Первый карантин в секундах
+            max_backoff: Максимальный карантин в секундах
+            deactivate_days: Через сколько дней постоянной ошибки канал отключается (0 — не отключать)
+        """
+        self.failure_threshold = failure_threshold or int(os.getenv("CIRCUIT_FAILURES", "3"))
+        self.backoff = backoff or float(os.getenv("CIRCUIT_BACKOFF", "600"))
+        self.max_backoff = max_backoff or float(os.getenv("CIRCUIT_MAX_BACKOFF", "86400"))
+        self.deactivate_days = float(
+            deactivate_days if deactivate_days is not None else os.getenv("CIRCUIT_DEACTIVATE_DAYS", "7")
+        )
+        self.circuits = {}
+
+    def allow(self, channel_id, now=None):
+        """True, если канал не на карантине (или карантин истек и можно попробовать снова)."""
+        circuit = self.circuits.get(str(channel_id))
+        return circuit is None or circuit.open_until <= (now or time.time())
+
+    def record_success(self, channel_id):
+        """Сбрасывает ошибки канала. Возвращает True, если канал был на карантине."""
+        circuit = self.circuits.pop(str(channel_id), None)
+        if circuit and circuit.opens:
+            logger.info(f"Канал {channel_id} снова доступен, карантин снят")
+            return True
+        return False
+
+    def record_failure(self, channel_id, kind, error=None, now=None):
+        """Учитывает ошибку канала и при необходимости отправляет его на карантин.
+
+        Returns:
+            ChannelCircuit канала
+        """
+        now = now or time.time()
+        key = str(channel_id)
+        circuit = self.circuits.get(key)
+        if circuit is None:
+            circuit = self.circuits[key] = ChannelCircuit(kind, now)
+        elif circuit.kind != kind:
+            # Ошибки другого класса считаются заново, но карантин продолжает удваиваться
+            circuit.kind = kind
+            circuit.failures = 0
+            circuit.first_failure_at = now
+        circuit.failures += 1
+        circuit.last_error = str(error)[:200] if error else kind
+        if kind in PERMANENT_FAILURES or circuit.failures >= self.failure_threshold:
+            seconds = min(self.max_backoff, self.backoff * 2 ** circuit.opens)
+            circuit.opens += 1
+            circuit.open_until = now + seconds
+            logger.warning(
+                f"Канал {channel_id} на карантине на {seconds / 60:.0f} мин.: {kind}, "
+                f"ошибок подряд {circuit.failures} ({circuit.last_error})"
+            )
+        return circuit
+
+    def should_deactivate(self, circuit, now=None):
+        """True, если канал с постоянной ошибкой пора отключить."""
+        return (
+            bool(self.deactivate_days) and circuit.kind in PERMANENT_FAILURES
+            and (now or time.time()) - circuit.first_failure_at >= self.deactivate_days * 86400
+        )
+
+    def reset(self, channel_id):
+        """Снимает карантин вручную. Возвращает True, если канал был на карантине."""
+        return self.circuits.pop(str(channel_id), None) is not None
+
+    def quarantined(self, now=None):
+        """Каналы на карантине: список (channel_id, ChannelCircuit), ближайшие к окончанию первыми."""
+        now = now or time.time()
+        return sorted(
+            ((channel_id, circuit) for channel_id, circuit in self.circuits.items() if circuit.open_until > now),
+            key=lambda item: item[1].open_until
+        )
+
+    def snapshot(self):
+        """Состояние для снимка теплого состояния (warm_state.py)."""
+        return {
+            channel_id: [c.kind, c.failures, c.first_failure_at, c.open_until, c.opens, c.last_error]
+            for channel_id, c in self.circuits.items()
+        }
+
+    def restore(self, data):
+        """Восстанавливает состояние из снимка."""
+        for channel_id, (kind, failures, first_failure_at, open_until, opens, last_error) in data.items():
+            circuit = ChannelCircuit(kind, first_failure_at)
+            circuit.failures, circuit.open_until, circuit.opens, circuit.last_error = failures, open_until, opens, last_error
+            self.circuits[channel_id] = circuit
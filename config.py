@@ -7,6 +7,13 @@ load_dotenv()
 # Telegram Bot Token
 BOT_TOKEN = os.getenv("BOT_TOKEN")
 
+# Storage backend: "postgres" (default) or "sqlite"
+DB_BACKEND = os.getenv("DB_BACKEND", "postgres")
+
+# SQLite parameters (used when DB_BACKEND=sqlite)
+SQLITE_PATH = os.getenv("SQLITE_PATH", "telegram_parser.db")
+SQLITE_BATCH_SIZE = int(os.getenv("SQLITE_BATCH_SIZE", "100"))
+
 # PostgreSQL connection parameters
 DB_HOST = os.getenv("DB_HOST", "localhost")
 DB_PORT = os.getenv("DB_PORT", "5432")
@@ -14,6 +21,13 @@ DB_NAME = os.getenv("DB_NAME", "telegram_parser")
 DB_USER = os.getenv("DB_USER", "postgres")
 DB_PASSWORD = os.getenv("DB_PASSWORD", "password")
 
+# Telethon session: name (file name without .session / key in the database),
+# storage ("file" — Telethon-compatible .session file, "database" — the bot database)
+# and how often buffered session changes are written, seconds
+TELETHON_SESSION_NAME = os.getenv("TELETHON_SESSION_NAME", "telegram_parser_session")
+TELETHON_SESSION_STORE = os.getenv("TELETHON_SESSION_STORE", "file")
+TELETHON_SESSION_FLUSH_INTERVAL = float(os.getenv("TELETHON_SESSION_FLUSH_INTERVAL", "60"))
+
 # Target channel ID for forwarding messages
 TARGET_CHANNEL_ID = os.getenv("TARGET_CHANNEL_ID")
 
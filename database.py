@@ -1,11 +1,367 @@
+import re
+import time
+from contextlib import asynccontextmanager
+from datetime import datetime, timedelta, timezone
 import asyncpg
 from loguru import logger
 import config
+import metrics
+
+
+class BaseDatabase:
+    """Интерфейс хранилища, которым пользуются парсер, планировщик и бот.
+
+    Конкретные реализации: Database (PostgreSQL) и SQLiteDatabase
+    (встроенная SQLite для однонодовых установок). Выбор выполняет
+    create_database() по значению config.DB_BACKEND.
+    """
+
+    async def connect(self):
+        raise NotImplementedError
+
+    async def close(self):
+        raise NotImplementedError
+
+    async def migrate_schema(self):
+        """Приводит схему существующей базы к актуальному виду."""
+
+    async def flush(self):
+        """Сбрасывает на диск накопленные отложенные записи."""
+
+    async def add_channel(self, channel_id, name=None):
+        raise NotImplementedError
+
+    async def remove_channel(self, channel_id):
+        raise NotImplementedError
+
+    async def get_channels(self):
+        raise NotImplementedError
+
+    async def save_channel_audit(self, results):
+        """Записывает результаты проверки каналов (см. check_channels.py).
+
+        Args:
+            results: Список кортежей (channel_id, status, название или None,
+                дата последнего сообщения или None, is_active)
+        """
+        raise NotImplementedError
+
+    async def add_keyword(self, word):
+        """Добавляет или включает ключевое слово. Возвращает True, если слова среди активных не было."""
+        raise NotImplementedError
+
+    async def remove_keyword(self, word):
+        raise NotImplementedError
+
+    async def get_keywords(self):
+        raise NotImplementedError
+
+    async def add_stopword(self, word):
+        raise NotImplementedError
+
+    async def remove_stopword(self, word):
+        raise NotImplementedError
+
+    async def get_stopwords(self):
+        raise NotImplementedError
+
+    async def mark_message_processed(self, channel_id, message_id):
+        raise NotImplementedError
+
+    async def is_message_processed(self, channel_id, message_id):
+        raise NotImplementedError
+
+    async def get_channel_state(self, channel_id):
+        """Возвращает (first_run, last_message_id) для канала."""
+        raise NotImplementedError
+
+    async def archive_messages(self, channel_id, messages):
+        """Сохраняет тексты полученных сообщений в локальный архив."""
+        raise NotImplementedError
+
+    async def mark_archive_forwarded(self, channel_id, message_id):
+        """Отмечает сообщение архива пересланным."""
+        raise NotImplementedError
+
+    async def search_archive(self, keyword, since, limit=1000):
+        """Ищет в архиве еще не пересланные сообщения-кандидаты для ключевого слова по полнотекстовому индексу."""
+        raise NotImplementedError
+
+    async def prune_archive(self, days):
+        """Удаляет из архива сообщения старше days дней."""
+        raise NotImplementedError
+
+    def iter_processed_messages(self, since=None, until=None, channels=None, batch_size=5000):
+        """Читает processed_messages пачками по batch_size строк (см. export_history.py).
+
+        Args:
+            since: Начало периода по processed_at (включительно) или None
+            until: Конец периода (не включительно) или None
+            channels: Список ID каналов или None — все каналы
+            batch_size: Строк в одной пачке
+
+        Returns:
+            Асинхронный итератор списков строк (channel_id, message_id, processed_at)
+        """
+        raise NotImplementedError
+
+    def iter_archived_messages(self, since=None, until=None, channels=None, batch_size=5000):
+        """Читает архив сообщений пачками по batch_size строк, фильтр по дате сообщения.
+
+        Returns:
+            Асинхронный итератор списков строк (channel_id, message_id, date, text)
+        """
+        raise NotImplementedError
+
+    async def add_channels(self, channels):
+        """Добавляет список (channel_id, name) одной транзакцией. Возвращает количество строк."""
+        raise NotImplementedError
+
+    async def add_keywords(self, words):
+        """Добавляет список ключевых слов одной транзакцией. Возвращает количество строк."""
+        raise NotImplementedError
+
+    async def add_stopwords(self, words):
+        """Добавляет список стоп-слов одной транзакцией. Возвращает количество строк."""
+        raise NotImplementedError
+
+    async def remove_all_keywords(self):
+        """Удаляет все ключевые слова одним запросом."""
+        raise NotImplementedError
+
+    async def remove_all_stopwords(self):
+        """Удаляет все стоп-слова одним запросом."""
+        raise NotImplementedError
+
+    async def get_counts(self):
+        """Возвращает количество активных каналов, ключевых слов и стоп-слов."""
+        raise NotImplementedError
+
+    async def get_channels_page(self, after_id=None, before_id=None, limit=20):
+        """Возвращает страницу активных каналов (rows, has_prev, has_next) по ключу id."""
+        raise NotImplementedError
+
+    async def get_keywords_page(self, after_id=None, before_id=None, limit=20):
+        """Возвращает страницу активных ключевых слов (rows, has_prev, has_next) по ключу id."""
+        raise NotImplementedError
+
+    async def get_stopwords_page(self, after_id=None, before_id=None, limit=20):
+        """Возвращает страницу активных стоп-слов (rows, has_prev, has_next) по ключу id."""
+        raise NotImplementedError
+
+    async def remove_channel_by_id(self, row_id):
+        """Удаляет канал по id строки и возвращает его channel_id."""
+        raise NotImplementedError
+
+    async def remove_keyword_by_id(self, row_id):
+        """Удаляет ключевое слово по id строки и возвращает его."""
+        raise NotImplementedError
+
+    async def remove_stopword_by_id(self, row_id):
+        """Удаляет стоп-слово по id строки и возвращает его."""
+        raise NotImplementedError
+
+    async def upsert_dialogs(self, dialogs, seen_at):
+        """Сохраняет в индекс диалогов список (channel_id, title, username) с отметкой seen_at."""
+        raise NotImplementedError
+
+    async def remove_dialog(self, channel_id):
+        """Удаляет канал из индекса диалогов."""
+        raise NotImplementedError
+
+    async def prune_dialogs(self, seen_before):
+        """Удаляет из индекса каналы, не встречавшиеся при обновлении начиная с seen_before."""
+        raise NotImplementedError
+
+    async def get_dialogs_updated_at(self):
+        """Возвращает время последнего обновления индекса диалогов или None."""
+        raise NotImplementedError
+
+    async def get_dialogs_page(self, query=None, after_id=None, before_id=None, limit=20):
+        """Возвращает страницу индекса диалогов (rows, has_prev, has_next) с признаком monitored."""
+        raise NotImplementedError
+
+    async def get_dialog(self, row_id):
+        """Возвращает запись индекса диалогов по id строки или None."""
+        raise NotImplementedError
+
+    async def get_backfill_state(self, channel_id):
+        """Возвращает контрольную точку дозагрузки истории канала или None."""
+        raise NotImplementedError
+
+    async def save_backfill_state(self, channel_id, offset_id, scanned, done=False):
+        """Сохраняет контрольную точку дозагрузки истории канала."""
+        raise NotImplementedError
+
+    async def reset_backfill_state(self, channel_id):
+        """Удаляет контрольную точку, чтобы дозагрузка началась заново."""
+        raise NotImplementedError
+
+    async def get_rule_set(self, name):
+        """Возвращает набор правил по имени (id, name, owner_id, target_chat, rate_limit) или None."""
+        raise NotImplementedError
+
+    async def add_rule_set(self, name, owner_id=None, target_chat=None, rate_limit=None):
+        """Создает набор правил и возвращает его ID.
+
+        У существующего набора обновляются переданные (не None) параметры
+        подписки: владелец, чат для пересылки и лимит пересылок в минуту.
+        """
+        raise NotImplementedError
+
+    async def remove_rule_set(self, rule_set_id):
+        """Удаляет набор правил вместе с его словами и подключениями к каналам."""
+        raise NotImplementedError
+
+    async def add_rule_set_words(self, rule_set_id, words, stop=False):
+        """Добавляет в набор ключевые (stop=False) или стоп-слова. Возвращает их количество."""
+        raise NotImplementedError
+
+    async def remove_rule_set_word(self, rule_set_id, word, stop=False):
+        """Удаляет ключевое или стоп-слово из набора. Возвращает True, если слово было."""
+        raise NotImplementedError
+
+    async def attach_rule_set(self, channel_id, rule_set_id):
+        """Подключает набор к каналу (DEFAULT_RULE_SET_ID — набор по умолчанию)."""
+        raise NotImplementedError
+
+    async def detach_rule_set(self, channel_id, rule_set_id):
+        """Отключает набор от канала. Возвращает True, если он был подключен."""
+        raise NotImplementedError
+
+    async def get_rule_sets(self):
+        """Возвращает наборы правил: словари id, name, owner_id, target_chat, rate_limit, keywords, stopwords."""
+        raise NotImplementedError
+
+    async def get_rule_set_attachments(self):
+        """Возвращает подключения наборов к каналам: список пар (channel_id, rule_set_id)."""
+        raise NotImplementedError
+
+    async def save_hit_counts(self, keyword_rows, channel_rows):
+        """Прибавляет накопленные за цикл счетчики совпадений (см. hit_counters.py) одной транзакцией.
+
+        Args:
+            keyword_rows: Кортежи (ID набора, ключевое слово, совпадений, пересылок,
+                время последнего совпадения или None)
+            channel_rows: Кортежи (channel_id, совпадений, пересылок, время последнего совпадения или None)
+        """
+        raise NotImplementedError
+
+    async def get_keyword_stats(self):
+        """Возвращает счетчики всех ключевых слов, включая слова наборов правил.
+
+        Returns:
+            Словари rule_set_id, rule_set (имя набора, None — набор по умолчанию),
+            keyword, hits, forwards, last_hit_at; у слов без совпадений hits = 0
+        """
+        raise NotImplementedError
+
+    async def get_channel_stats(self, limit=10):
+        """Возвращает limit каналов с наибольшим числом совпадений: словари channel_id, name, hits, forwards, last_hit_at."""
+        raise NotImplementedError
+
+    async def load_telethon_session(self, name):
+        """Загружает сессию Telethon (TELETHON_SESSION_STORE=database).
+
+        Returns:
+            Кортеж (строка параметров подключения или None, сущности,
+            состояния обновлений, отправленные файлы) в формате таблиц
+            SQLiteSession Telethon
+        """
+        raise NotImplementedError
+
+    async def save_telethon_session(self, name, session, entities, states, files):
+        """Записывает изменения сессии Telethon одной транзакцией."""
+        raise NotImplementedError
+
+
+# ID набора правил по умолчанию (глобальные таблицы keywords и stopwords)
+# в таблице channel_rule_sets
+DEFAULT_RULE_SET_ID = 0
+
+RULE_SET_COLUMNS = 'id, name, owner_id, target_chat, rate_limit'
+
+
+# Ключевые слова набора по умолчанию и наборов правил со счетчиками совпадений
+KEYWORD_STATS_QUERY = '''
+    SELECT 0 AS rule_set_id, NULL AS rule_set, k.word AS keyword, COALESCE(s.hits, 0) AS hits,
+           COALESCE(s.forwards, 0) AS forwards, s.last_hit_at
+    FROM keywords k
+    LEFT JOIN keyword_stats s ON s.rule_set_id = 0 AND s.keyword = k.word
+    WHERE k.is_active = {true}
+    UNION ALL
+    SELECT w.rule_set_id, r.name, w.word, COALESCE(s.hits, 0), COALESCE(s.forwards, 0), s.last_hit_at
+    FROM rule_set_words w
+    JOIN rule_sets r ON r.id = w.rule_set_id
+    LEFT JOIN keyword_stats s ON s.rule_set_id = w.rule_set_id AND s.keyword = w.word
+    WHERE w.is_stopword = {false}
+'''
+
+
+def group_rule_sets(sets, words):
+    """Собирает строки rule_sets и rule_set_words в список наборов со словами."""
+    result = {row['id']: dict(row, keywords=[], stopwords=[]) for row in sets}
+    for row in words:
+        rule_set = result.get(row['rule_set_id'])
+        if rule_set is not None:
+            rule_set['stopwords' if row['is_stopword'] else 'keywords'].append(row['word'])
+    return list(result.values())
+
+
+def like_pattern(query):
+    """Шаблон LIKE для поиска подстроки: \\, % и _ экранируются (ESCAPE '\\')."""
+    escaped = (query or '').lower().replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+    return f"%{escaped}%"
+
+
+def keyset_page(rows, limit, after_id=None, before_id=None):
+    """Обрезает выборку limit + 1 строк до страницы и определяет наличие соседних страниц.
+
+    При переходе назад (before_id) строки приходят в порядке убывания id.
+    """
+    rows = list(rows)
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    if before_id is not None:
+        return list(reversed(rows)), has_more, True
+    return rows, after_id is not None, has_more
+
+
+def archive_terms(keyword):
+    """Разбивает ключевое слово (в т.ч. составное слово1+слово2) на токены для поиска в архиве."""
+    terms = []
+    for part in keyword.lower().split("+"):
+        terms.extend(re.findall(r'\w+', part))
+    return terms
+
+
+def archive_date(value):
+    """Приводит дату сообщения к aware-datetime в UTC."""
+    if value is None:
+        return datetime.now(timezone.utc)
+    if value.tzinfo is None:
+        return value.replace(tzinfo=timezone.utc)
+    return value.astimezone(timezone.utc)
+
+
+class Database(BaseDatabase):
+    """Хранилище на PostgreSQL (asyncpg)."""
 
-class Database:
     def __init__(self):
         self.pool = None
 
+    @asynccontextmanager
+    async def _acquire(self):
+        """Берет соединение из пула, измеряя ожидание и время использования."""
+        started = time.perf_counter()
+        async with self.pool.acquire() as conn:
+            acquired = time.perf_counter()
+            metrics.DB_POOL_WAIT_SECONDS.observe(acquired - started)
+            try:
+                yield conn
+            finally:
+                metrics.DB_QUERY_SECONDS.observe(time.perf_counter() - acquired, backend="postgres")
+
     async def connect(self):
         try:
             self.pool = await asyncpg.create_pool(
@@ -15,9 +371,9 @@ class Database:
                 user=config.DB_USER,
                 password=config.DB_PASSWORD
             )
-            
+
             # Создаем таблицу для хранения информации о каналах и ключевых словах
-            async with self.pool.acquire() as conn:
+            async with self._acquire() as conn:
                 await conn.execute('''
                     CREATE TABLE IF NOT EXISTS channels (
                         id SERIAL PRIMARY KEY,
@@ -26,7 +382,14 @@ class Database:
                         is_active BOOLEAN DEFAULT TRUE
                     )
                 ''')
-                
+                # Результат последней проверки канала (check_channels.py)
+                await conn.execute('''
+                    ALTER TABLE channels
+                        ADD COLUMN IF NOT EXISTS status TEXT,
+                        ADD COLUMN IF NOT EXISTS last_post_at TIMESTAMPTZ,
+                        ADD COLUMN IF NOT EXISTS checked_at TIMESTAMPTZ
+                ''')
+
                 await conn.execute('''
                     CREATE TABLE IF NOT EXISTS keywords (
                         id SERIAL PRIMARY KEY,
@@ -34,7 +397,7 @@ class Database:
                         is_active BOOLEAN DEFAULT TRUE
                     )
                 ''')
-                
+
                 await conn.execute('''
                     CREATE TABLE IF NOT EXISTS stopwords (
                         id SERIAL PRIMARY KEY,
@@ -42,7 +405,7 @@ class Database:
                         is_active BOOLEAN DEFAULT TRUE
                     )
                 ''')
-                
+
                 await conn.execute('''
                     CREATE TABLE IF NOT EXISTS processed_messages (
                         id SERIAL PRIMARY KEY,
@@ -52,7 +415,149 @@ class Database:
                         UNIQUE(channel_id, message_id)
                     )
                 ''')
-            
+
+                # Архив текстов сообщений для повторной проверки новых ключевых слов
+                await conn.execute('''
+                    CREATE TABLE IF NOT EXISTS message_archive (
+                        channel_id TEXT NOT NULL,
+                        message_id BIGINT NOT NULL,
+                        text TEXT NOT NULL,
+                        date TIMESTAMPTZ NOT NULL,
+                        tsv TSVECTOR GENERATED ALWAYS AS (to_tsvector('russian', text)) STORED,
+                        PRIMARY KEY (channel_id, message_id)
+                    )
+                ''')
+                # Отметка пересылки: такое сообщение не пересылается повторно при проверке архива
+                await conn.execute(
+                    'ALTER TABLE message_archive ADD COLUMN IF NOT EXISTS forwarded BOOLEAN NOT NULL DEFAULT FALSE'
+                )
+                await conn.execute(
+                    'CREATE INDEX IF NOT EXISTS message_archive_tsv_idx ON message_archive USING GIN (tsv)'
+                )
+                await conn.execute(
+                    'CREATE INDEX IF NOT EXISTS message_archive_date_idx ON message_archive (date)'
+                )
+
+                # Индекс каналов, доступных через аккаунт Telethon
+                await conn.execute('''
+                    CREATE TABLE IF NOT EXISTS dialogs (
+                        id SERIAL PRIMARY KEY,
+                        channel_id TEXT UNIQUE NOT NULL,
+                        title TEXT,
+                        title_lower TEXT,
+                        username TEXT,
+                        updated_at TIMESTAMPTZ NOT NULL
+                    )
+                ''')
+
+                # Контрольные точки дозагрузки истории каналов
+                await conn.execute('''
+                    CREATE TABLE IF NOT EXISTS backfill_state (
+                        channel_id TEXT PRIMARY KEY,
+                        offset_id BIGINT NOT NULL DEFAULT 0,
+                        scanned BIGINT NOT NULL DEFAULT 0,
+                        done BOOLEAN DEFAULT FALSE,
+                        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                    )
+                ''')
+
+                # Наборы правил, которые подключаются к отдельным каналам.
+                # Набор с владельцем (owner_id) — подписка пользователя со своим
+                # чатом для пересылки и лимитом пересылок в минуту.
+                # rule_set_id = 0 в channel_rule_sets — набор по умолчанию
+                # (таблицы keywords и stopwords), поэтому внешнего ключа там нет
+                await conn.execute('''
+                    CREATE TABLE IF NOT EXISTS rule_sets (
+                        id SERIAL PRIMARY KEY,
+                        name TEXT UNIQUE NOT NULL,
+                        owner_id BIGINT,
+                        target_chat TEXT,
+                        rate_limit INTEGER
+                    )
+                ''')
+                await conn.execute('''
+                    CREATE TABLE IF NOT EXISTS rule_set_words (
+                        id SERIAL PRIMARY KEY,
+                        rule_set_id INTEGER NOT NULL REFERENCES rule_sets (id) ON DELETE CASCADE,
+                        word TEXT NOT NULL,
+                        is_stopword BOOLEAN NOT NULL DEFAULT FALSE,
+                        UNIQUE (rule_set_id, is_stopword, word)
+                    )
+                ''')
+                await conn.execute('''
+                    CREATE TABLE IF NOT EXISTS channel_rule_sets (
+                        channel_id TEXT NOT NULL,
+                        rule_set_id INTEGER NOT NULL,
+                        PRIMARY KEY (channel_id, rule_set_id)
+                    )
+                ''')
+
+                # Счетчики совпадений по ключевым словам (rule_set_id = 0 — набор по умолчанию) и каналам
+                await conn.execute('''
+                    CREATE TABLE IF NOT EXISTS keyword_stats (
+                        rule_set_id INTEGER NOT NULL,
+                        keyword TEXT NOT NULL,
+                        hits BIGINT NOT NULL DEFAULT 0,
+                        forwards BIGINT NOT NULL DEFAULT 0,
+                        last_hit_at TIMESTAMPTZ,
+                        PRIMARY KEY (rule_set_id, keyword)
+                    )
+                ''')
+                await conn.execute('''
+                    CREATE TABLE IF NOT EXISTS channel_stats (
+                        channel_id TEXT PRIMARY KEY,
+                        hits BIGINT NOT NULL DEFAULT 0,
+                        forwards BIGINT NOT NULL DEFAULT 0,
+                        last_hit_at TIMESTAMPTZ
+                    )
+                ''')
+
+                # Сессии Telethon (TELETHON_SESSION_STORE=database), по таблицам SQLiteSession
+                await conn.execute('''
+                    CREATE TABLE IF NOT EXISTS telethon_sessions (
+                        name TEXT PRIMARY KEY,
+                        dc_id INTEGER,
+                        server_address TEXT,
+                        port INTEGER,
+                        auth_key BYTEA,
+                        takeout_id BIGINT
+                    )
+                ''')
+                await conn.execute('''
+                    CREATE TABLE IF NOT EXISTS telethon_entities (
+                        session_name TEXT NOT NULL,
+                        id BIGINT NOT NULL,
+                        hash BIGINT NOT NULL,
+                        username TEXT,
+                        phone TEXT,
+                        name TEXT,
+                        date BIGINT,
+                        PRIMARY KEY (session_name, id)
+                    )
+                ''')
+                await conn.execute('''
+                    CREATE TABLE IF NOT EXISTS telethon_update_state (
+                        session_name TEXT NOT NULL,
+                        id BIGINT NOT NULL,
+                        pts BIGINT,
+                        qts BIGINT,
+                        date BIGINT,
+                        seq BIGINT,
+                        PRIMARY KEY (session_name, id)
+                    )
+                ''')
+                await conn.execute('''
+                    CREATE TABLE IF NOT EXISTS telethon_sent_files (
+                        session_name TEXT NOT NULL,
+                        md5_digest BYTEA NOT NULL,
+                        file_size BIGINT NOT NULL,
+                        type INTEGER NOT NULL,
+                        id BIGINT,
+                        hash BIGINT,
+                        PRIMARY KEY (session_name, md5_digest, file_size, type)
+                    )
+                ''')
+
             logger.info("База данных успешно подключена и инициализирована")
             return True
         except Exception as e:
@@ -63,84 +568,138 @@ class Database:
         if self.pool:
             await self.pool.close()
 
+    async def migrate_schema(self):
+        """Проверяет и мигрирует схему базы данных."""
+        try:
+            async with self._acquire() as conn:
+                # Проверяем текущий тип channel_id в таблице channels
+                table_info = await conn.fetch("""
+                    SELECT column_name, data_type
+                    FROM information_schema.columns
+                    WHERE table_name = 'channels' AND column_name = 'channel_id'
+                """)
+
+                if table_info and table_info[0]['data_type'] == 'bigint':
+                    logger.info("Миграция схемы: изменение типа channel_id с BIGINT на TEXT")
+
+                    # Создаем временную таблицу с новой схемой
+                    await conn.execute("""
+                        CREATE TABLE channels_temp (
+                            id SERIAL PRIMARY KEY,
+                            channel_id TEXT UNIQUE NOT NULL,
+                            name TEXT,
+                            is_active BOOLEAN DEFAULT TRUE,
+                            status TEXT,
+                            last_post_at TIMESTAMPTZ,
+                            checked_at TIMESTAMPTZ
+                        )
+                    """)
+
+                    # Копируем данные со преобразованием
+                    await conn.execute("""
+                        INSERT INTO channels_temp (id, channel_id, name, is_active)
+                        SELECT id, CAST(channel_id AS TEXT), name, is_active FROM channels
+                    """)
+
+                    # Удаляем старую таблицу и переименовываем новую
+                    await conn.execute("DROP TABLE channels")
+                    await conn.execute("ALTER TABLE channels_temp RENAME TO channels")
+
+                    logger.info("Миграция схемы успешно завершена")
+        except Exception as e:
+            logger.error(f"Ошибка при миграции схемы базы данных: {e}")
+            # Продолжаем работу, даже если миграция не удалась
+
     async def add_channel(self, channel_id, name=None):
-        async with self.pool.acquire() as conn:
+        async with self._acquire() as conn:
             await conn.execute(
-                'INSERT INTO channels (channel_id, name) VALUES ($1, $2) ON CONFLICT (channel_id) DO UPDATE SET name = $2',
-                channel_id, name
+                'INSERT INTO channels (channel_id, name) VALUES ($1, $2) ON CONFLICT (channel_id) DO UPDATE SET name = $2, is_active = TRUE',
+                str(channel_id), name
             )
-    
+
     async def remove_channel(self, channel_id):
-        async with self.pool.acquire() as conn:
+        async with self._acquire() as conn:
             await conn.execute(
                 'DELETE FROM channels WHERE channel_id = $1',
-                channel_id
+                str(channel_id)
             )
-    
+
     async def get_channels(self):
-        async with self.pool.acquire() as conn:
+        async with self._acquire() as conn:
             channels = await conn.fetch('SELECT * FROM channels WHERE is_active = TRUE')
             return channels
-    
+
+    async def save_channel_audit(self, results):
+        if not results:
+            return
+        async with self._acquire() as conn:
+            await conn.executemany(
+                'UPDATE channels SET status = $2, name = COALESCE($3, name), last_post_at = $4, '
+                'is_active = $5, checked_at = NOW() WHERE channel_id = $1',
+                [(str(c), s, n, archive_date(d) if d else None, a) for c, s, n, d, a in results]
+            )
+
     async def add_keyword(self, word):
-        async with self.pool.acquire() as conn:
-            await conn.execute(
-                'INSERT INTO keywords (word) VALUES ($1) ON CONFLICT (word) DO UPDATE SET is_active = TRUE',
+        async with self._acquire() as conn:
+            result = await conn.execute(
+                'INSERT INTO keywords (word) VALUES ($1) ON CONFLICT (word) DO UPDATE SET is_active = TRUE '
+                'WHERE keywords.is_active IS NOT TRUE',
                 word
             )
-    
+            return result != 'INSERT 0 0'
+
     async def remove_keyword(self, word):
-        async with self.pool.acquire() as conn:
+        async with self._acquire() as conn:
             await conn.execute(
                 'DELETE FROM keywords WHERE word = $1',
                 word
             )
-    
+
     async def get_keywords(self):
-        async with self.pool.acquire() as conn:
+        async with self._acquire() as conn:
             keywords = await conn.fetch('SELECT * FROM keywords WHERE is_active = TRUE')
             return [k['word'] for k in keywords]
-    
+
     async def add_stopword(self, word):
-        async with self.pool.acquire() as conn:
+        async with self._acquire() as conn:
             await conn.execute(
                 'INSERT INTO stopwords (word) VALUES ($1) ON CONFLICT (word) DO UPDATE SET is_active = TRUE',
                 word
             )
-    
+
     async def remove_stopword(self, word):
-        async with self.pool.acquire() as conn:
+        async with self._acquire() as conn:
             await conn.execute(
                 'DELETE FROM stopwords WHERE word = $1',
                 word
             )
-    
+
     async def get_stopwords(self):
-        async with self.pool.acquire() as conn:
+        async with self._acquire() as conn:
             stopwords = await conn.fetch('SELECT * FROM stopwords WHERE is_active = TRUE')
             return [s['word'] for s in stopwords]
-    
+
     async def mark_message_processed(self, channel_id, message_id):
-        async with self.pool.acquire() as conn:
+        async with self._acquire() as conn:
             try:
                 # Преобразуем channel_id в строку для единообразия
                 if not isinstance(channel_id, str):
                     channel_id = str(channel_id)
-                    
+
                 await conn.execute(
                     'INSERT INTO processed_messages (channel_id, message_id) VALUES ($1, $2) ON CONFLICT DO NOTHING',
                     channel_id, message_id
                 )
             except Exception as e:
                 logger.error(f"Ошибка при пометке сообщения как обработанного: {e}")
-    
+
     async def is_message_processed(self, channel_id, message_id):
-        async with self.pool.acquire() as conn:
+        async with self._acquire() as conn:
             try:
                 # Преобразуем channel_id в строку для единообразия
                 if not isinstance(channel_id, str):
                     channel_id = str(channel_id)
-                    
+
                 result = await conn.fetchval(
                     'SELECT EXISTS(SELECT 1 FROM processed_messages WHERE channel_id = $1 AND message_id = $2)',
                     channel_id, message_id
@@ -148,4 +707,394 @@ class Database:
                 return result
             except Exception as e:
                 logger.error(f"Ошибка при проверке статуса обработки сообщения: {e}")
-                return False 
\ No newline at end of file
+                return False
+
+    async def get_channel_state(self, channel_id):
+        async with self._acquire() as conn:
+            # Последний обработанный ID; его отсутствие означает первый запуск
+            last_message_id = await conn.fetchval(
+                'SELECT message_id FROM processed_messages WHERE channel_id = $1 ORDER BY message_id DESC LIMIT 1',
+                str(channel_id)
+            )
+            return last_message_id is None, last_message_id
+
+    async def archive_messages(self, channel_id, messages):
+        rows = [
+            (str(channel_id), m.message_id, m.text, archive_date(getattr(m, 'date', None)))
+            for m in messages if m.text
+        ]
+        if not rows:
+            return
+        async with self._acquire() as conn:
+            await conn.executemany(
+                'INSERT INTO message_archive (channel_id, message_id, text, date) VALUES ($1, $2, $3, $4) '
+                'ON CONFLICT (channel_id, message_id) DO UPDATE SET text = EXCLUDED.text '
+                'WHERE message_archive.text IS DISTINCT FROM EXCLUDED.text',
+                rows
+            )
+
+    async def search_archive(self, keyword, since, limit=1000):
+        terms = archive_terms(keyword)
+        if not terms:
+            return []
+        # Префиксный поиск (слово:*) приближает семантику поиска подстроки
+        query = ' & '.join(f'{t}:*' for t in terms)
+        async with self._acquire() as conn:
+            return await conn.fetch(
+                'SELECT channel_id, message_id, text, date FROM message_archive '
+                'WHERE tsv @@ to_tsquery(\'russian\', $1) AND date >= $2 AND NOT forwarded ORDER BY date LIMIT $3',
+                query, archive_date(since), limit
+            )
+
+    async def mark_archive_forwarded(self, channel_id, message_id):
+        async with self._acquire() as conn:
+            await conn.execute(
+                'UPDATE message_archive SET forwarded = TRUE WHERE channel_id = $1 AND message_id = $2',
+                str(channel_id), message_id
+            )
+
+    async def prune_archive(self, days):
+        async with self._acquire() as conn:
+            await conn.execute(
+                'DELETE FROM message_archive WHERE date < $1',
+                datetime.now(timezone.utc) - timedelta(days=days)
+            )
+
+    async def _stream(self, table, columns, time_column, since, until, channels, batch_size):
+        """Читает таблицу курсором на стороне сервера пачками по batch_size строк."""
+        conditions, args = [], []
+        for op, value in (('>=', since), ('<', until)):
+            if value is not None:
+                args.append(value)
+                conditions.append(f'{time_column} {op} ${len(args)}')
+        if channels:
+            args.append([str(c) for c in channels])
+            conditions.append(f'channel_id = ANY(${len(args)})')
+        where = f' WHERE {" AND ".join(conditions)}' if conditions else ''
+        # Выгрузка держит отдельное соединение и не учитывается в метриках запросов;
+        # снимок repeatable read только для чтения не блокирует запись парсера
+        async with self.pool.acquire() as conn:
+            async with conn.transaction(isolation='repeatable_read', readonly=True):
+                cursor = await conn.cursor(f'SELECT {columns} FROM {table}{where}', *args)
+                while True:
+                    rows = await cursor.fetch(batch_size)
+                    if not rows:
+                        break
+                    yield rows
+
+    def iter_processed_messages(self, since=None, until=None, channels=None, batch_size=5000):
+        # processed_at хранится без часового пояса (UTC)
+        since, until = (archive_date(v).replace(tzinfo=None) if v else None for v in (since, until))
+        return self._stream('processed_messages', 'channel_id, message_id, processed_at', 'processed_at',
+                            since, until, channels, batch_size)
+
+    def iter_archived_messages(self, since=None, until=None, channels=None, batch_size=5000):
+        since, until = (archive_date(v) if v else None for v in (since, until))
+        return self._stream('message_archive', 'channel_id, message_id, date, text', 'date',
+                            since, until, channels, batch_size)
+
+    async def add_channels(self, channels):
+        channel_ids = [str(c[0]) for c in channels]
+        names = [c[1] for c in channels]
+        async with self._acquire() as conn:
+            async with conn.transaction():
+                result = await conn.execute(
+                    'INSERT INTO channels (channel_id, name) '
+                    'SELECT DISTINCT ON (channel_id) channel_id, name FROM unnest($1::text[], $2::text[]) AS t(channel_id, name) '
+                    'ON CONFLICT (channel_id) DO UPDATE SET name = COALESCE(EXCLUDED.name, channels.name), is_active = TRUE',
+                    channel_ids, names
+                )
+        return int(result.split()[-1])
+
+    async def _add_words(self, table, words):
+        async with self._acquire() as conn:
+            async with conn.transaction():
+                result = await conn.execute(
+                    f'INSERT INTO {table} (word) SELECT DISTINCT unnest($1::text[]) '
+                    'ON CONFLICT (word) DO UPDATE SET is_active = TRUE',
+                    list(words)
+                )
+        return int(result.split()[-1])
+
+    async def add_keywords(self, words):
+        return await self._add_words('keywords', words)
+
+    async def add_stopwords(self, words):
+        return await self._add_words('stopwords', words)
+
+    async def remove_all_keywords(self):
+        async with self._acquire() as conn:
+            await conn.execute('DELETE FROM keywords')
+
+    async def remove_all_stopwords(self):
+        async with self._acquire() as conn:
+            await conn.execute('DELETE FROM stopwords')
+
+    async def get_counts(self):
+        async with self._acquire() as conn:
+            row = await conn.fetchrow('''
+                SELECT
+                    (SELECT COUNT(*) FROM channels WHERE is_active = TRUE) AS channels,
+                    (SELECT COUNT(*) FROM keywords WHERE is_active = TRUE) AS keywords,
+                    (SELECT COUNT(*) FROM stopwords WHERE is_active = TRUE) AS stopwords
+            ''')
+            return dict(row)
+
+    async def _page(self, table, columns, after_id, before_id, limit):
+        # Имена таблиц и колонок задаются только в коде, не пользователем
+        if before_id is not None:
+            sql = f'SELECT {columns} FROM {table} WHERE is_active = TRUE AND id < $1 ORDER BY id DESC LIMIT $2'
+            args = (before_id, limit + 1)
+        else:
+            sql = f'SELECT {columns} FROM {table} WHERE is_active = TRUE AND id > $1 ORDER BY id LIMIT $2'
+            args = (after_id or 0, limit + 1)
+        async with self._acquire() as conn:
+            rows = await conn.fetch(sql, *args)
+        return keyset_page(rows, limit, after_id, before_id)
+
+    async def get_channels_page(self, after_id=None, before_id=None, limit=20):
+        return await self._page('channels', 'id, channel_id, name', after_id, before_id, limit)
+
+    async def get_keywords_page(self, after_id=None, before_id=None, limit=20):
+        return await self._page('keywords', 'id, word', after_id, before_id, limit)
+
+    async def get_stopwords_page(self, after_id=None, before_id=None, limit=20):
+        return await self._page('stopwords', 'id, word', after_id, before_id, limit)
+
+    async def remove_channel_by_id(self, row_id):
+        async with self._acquire() as conn:
+            return await conn.fetchval('DELETE FROM channels WHERE id = $1 RETURNING channel_id', row_id)
+
+    async def remove_keyword_by_id(self, row_id):
+        async with self._acquire() as conn:
+            return await conn.fetchval('DELETE FROM keywords WHERE id = $1 RETURNING word', row_id)
+
+    async def remove_stopword_by_id(self, row_id):
+        async with self._acquire() as conn:
+            return await conn.fetchval('DELETE FROM stopwords WHERE id = $1 RETURNING word', row_id)
+
+    async def upsert_dialogs(self, dialogs, seen_at):
+        rows = [(str(c), t, (t or '').lower(), u, seen_at) for c, t, u in dialogs]
+        if not rows:
+            return
+        async with self._acquire() as conn:
+            await conn.executemany(
+                'INSERT INTO dialogs (channel_id, title, title_lower, username, updated_at) VALUES ($1, $2, $3, $4, $5) '
+                'ON CONFLICT (channel_id) DO UPDATE SET title = $2, title_lower = $3, username = $4, updated_at = $5',
+                rows
+            )
+
+    async def remove_dialog(self, channel_id):
+        async with self._acquire() as conn:
+            await conn.execute('DELETE FROM dialogs WHERE channel_id = $1', str(channel_id))
+
+    async def prune_dialogs(self, seen_before):
+        async with self._acquire() as conn:
+            await conn.execute('DELETE FROM dialogs WHERE updated_at < $1', seen_before)
+
+    async def get_dialogs_updated_at(self):
+        async with self._acquire() as conn:
+            return await conn.fetchval('SELECT MAX(updated_at) FROM dialogs')
+
+    async def get_dialogs_page(self, query=None, after_id=None, before_id=None, limit=20):
+        pattern = like_pattern(query)
+        columns = '''d.id, d.channel_id, d.title, d.username,
+            EXISTS(SELECT 1 FROM channels c WHERE c.channel_id = d.channel_id
+                   OR lower(c.channel_id) = '@' || lower(d.username)) AS monitored'''
+        if before_id is not None:
+            sql = f"SELECT {columns} FROM dialogs d WHERE d.title_lower LIKE $1 ESCAPE '\\' AND d.id < $2 ORDER BY d.id DESC LIMIT $3"
+            args = (pattern, before_id, limit + 1)
+        else:
+            sql = f"SELECT {columns} FROM dialogs d WHERE d.title_lower LIKE $1 ESCAPE '\\' AND d.id > $2 ORDER BY d.id LIMIT $3"
+            args = (pattern, after_id or 0, limit + 1)
+        async with self._acquire() as conn:
+            rows = await conn.fetch(sql, *args)
+        return keyset_page(rows, limit, after_id, before_id)
+
+    async def get_dialog(self, row_id):
+        async with self._acquire() as conn:
+            return await conn.fetchrow('SELECT * FROM dialogs WHERE id = $1', row_id)
+
+    async def get_backfill_state(self, channel_id):
+        async with self._acquire() as conn:
+            return await conn.fetchrow(
+                'SELECT * FROM backfill_state WHERE channel_id = $1',
+                str(channel_id)
+            )
+
+    async def save_backfill_state(self, channel_id, offset_id, scanned, done=False):
+        async with self._acquire() as conn:
+            await conn.execute(
+                'INSERT INTO backfill_state (channel_id, offset_id, scanned, done, updated_at) '
+                'VALUES ($1, $2, $3, $4, CURRENT_TIMESTAMP) '
+                'ON CONFLICT (channel_id) DO UPDATE SET offset_id = $2, scanned = $3, done = $4, '
+                'updated_at = CURRENT_TIMESTAMP',
+                str(channel_id), offset_id, scanned, done
+            )
+
+    async def reset_backfill_state(self, channel_id):
+        async with self._acquire() as conn:
+            await conn.execute('DELETE FROM backfill_state WHERE channel_id = $1', str(channel_id))
+
+    async def get_rule_set(self, name):
+        async with self._acquire() as conn:
+            row = await conn.fetchrow(f'SELECT {RULE_SET_COLUMNS} FROM rule_sets WHERE name = $1', name)
+        return dict(row) if row else None
+
+    async def add_rule_set(self, name, owner_id=None, target_chat=None, rate_limit=None):
+        async with self._acquire() as conn:
+            return await conn.fetchval(
+                'INSERT INTO rule_sets (name, owner_id, target_chat, rate_limit) VALUES ($1, $2, $3, $4) '
+                'ON CONFLICT (name) DO UPDATE SET owner_id = COALESCE(EXCLUDED.owner_id, rule_sets.owner_id), '
+                'target_chat = COALESCE(EXCLUDED.target_chat, rule_sets.target_chat), '
+                'rate_limit = COALESCE(EXCLUDED.rate_limit, rule_sets.rate_limit) RETURNING id',
+                name, owner_id, None if target_chat is None else str(target_chat), rate_limit
+            )
+
+    async def remove_rule_set(self, rule_set_id):
+        async with self._acquire() as conn:
+            async with conn.transaction():
+                await conn.execute('DELETE FROM channel_rule_sets WHERE rule_set_id = $1', rule_set_id)
+                await conn.execute('DELETE FROM keyword_stats WHERE rule_set_id = $1', rule_set_id)
+                await conn.execute('DELETE FROM rule_sets WHERE id = $1', rule_set_id)
+
+    async def add_rule_set_words(self, rule_set_id, words, stop=False):
+        async with self._acquire() as conn:
+            result = await conn.execute(
+                'INSERT INTO rule_set_words (rule_set_id, word, is_stopword) '
+                'SELECT $1, w, $3 FROM (SELECT DISTINCT unnest($2::text[]) AS w) AS t ON CONFLICT DO NOTHING',
+                rule_set_id, list(words), stop
+            )
+        return int(result.split()[-1])
+
+    async def remove_rule_set_word(self, rule_set_id, word, stop=False):
+        async with self._acquire() as conn:
+            result = await conn.execute(
+                'DELETE FROM rule_set_words WHERE rule_set_id = $1 AND word = $2 AND is_stopword = $3',
+                rule_set_id, word, stop
+            )
+        return result != 'DELETE 0'
+
+    async def attach_rule_set(self, channel_id, rule_set_id):
+        async with self._acquire() as conn:
+            await conn.execute(
+                'INSERT INTO channel_rule_sets (channel_id, rule_set_id) VALUES ($1, $2) ON CONFLICT DO NOTHING',
+                str(channel_id), rule_set_id
+            )
+
+    async def detach_rule_set(self, channel_id, rule_set_id):
+        async with self._acquire() as conn:
+            result = await conn.execute(
+                'DELETE FROM channel_rule_sets WHERE channel_id = $1 AND rule_set_id = $2',
+                str(channel_id), rule_set_id
+            )
+        return result != 'DELETE 0'
+
+    async def get_rule_sets(self):
+        async with self._acquire() as conn:
+            sets = await conn.fetch(f'SELECT {RULE_SET_COLUMNS} FROM rule_sets ORDER BY id')
+            words = await conn.fetch('SELECT rule_set_id, word, is_stopword FROM rule_set_words ORDER BY id')
+        return group_rule_sets(sets, words)
+
+    async def get_rule_set_attachments(self):
+        async with self._acquire() as conn:
+            rows = await conn.fetch('SELECT channel_id, rule_set_id FROM channel_rule_sets')
+        return [(row['channel_id'], row['rule_set_id']) for row in rows]
+
+    async def save_hit_counts(self, keyword_rows, channel_rows):
+        async with self._acquire() as conn:
+            async with conn.transaction():
+                if keyword_rows:
+                    rule_set_ids, keywords, hits, forwards, last_hits = zip(*keyword_rows)
+                    await conn.execute(
+                        'INSERT INTO keyword_stats (rule_set_id, keyword, hits, forwards, last_hit_at) '
+                        'SELECT * FROM unnest($1::int[], $2::text[], $3::bigint[], $4::bigint[], $5::timestamptz[]) '
+                        'ON CONFLICT (rule_set_id, keyword) DO UPDATE SET hits = keyword_stats.hits + EXCLUDED.hits, '
+                        'forwards = keyword_stats.forwards + EXCLUDED.forwards, '
+                        'last_hit_at = GREATEST(keyword_stats.last_hit_at, EXCLUDED.last_hit_at)',
+                        list(rule_set_ids), list(keywords), list(hits), list(forwards), list(last_hits)
+                    )
+                if channel_rows:
+                    channel_ids, hits, forwards, last_hits = zip(*channel_rows)
+                    await conn.execute(
+                        'INSERT INTO channel_stats (channel_id, hits, forwards, last_hit_at) '
+                        'SELECT * FROM unnest($1::text[], $2::bigint[], $3::bigint[], $4::timestamptz[]) '
+                        'ON CONFLICT (channel_id) DO UPDATE SET hits = channel_stats.hits + EXCLUDED.hits, '
+                        'forwards = channel_stats.forwards + EXCLUDED.forwards, '
+                        'last_hit_at = GREATEST(channel_stats.last_hit_at, EXCLUDED.last_hit_at)',
+                        [str(c) for c in channel_ids], list(hits), list(forwards), list(last_hits)
+                    )
+
+    async def get_keyword_stats(self):
+        async with self._acquire() as conn:
+            rows = await conn.fetch(KEYWORD_STATS_QUERY.format(true='TRUE', false='FALSE'))
+        return [dict(row) for row in rows]
+
+    async def get_channel_stats(self, limit=10):
+        async with self._acquire() as conn:
+            rows = await conn.fetch(
+                'SELECT s.channel_id, c.name, s.hits, s.forwards, s.last_hit_at FROM channel_stats s '
+                'LEFT JOIN channels c ON c.channel_id = s.channel_id ORDER BY s.hits DESC LIMIT $1',
+                limit
+            )
+        return [dict(row) for row in rows]
+
+    async def load_telethon_session(self, name):
+        async with self._acquire() as conn:
+            session = await conn.fetchrow(
+                'SELECT dc_id, server_address, port, auth_key, takeout_id FROM telethon_sessions WHERE name = $1', name
+            )
+            entities = await conn.fetch(
+                'SELECT id, hash, username, phone, name, date FROM telethon_entities WHERE session_name = $1', name
+            )
+            states = await conn.fetch(
+                'SELECT id, pts, qts, date, seq FROM telethon_update_state WHERE session_name = $1', name
+            )
+            files = await conn.fetch(
+                'SELECT md5_digest, file_size, type, id, hash FROM telethon_sent_files WHERE session_name = $1', name
+            )
+        return (tuple(session) if session else None, [tuple(r) for r in entities],
+                [tuple(r) for r in states], [tuple(r) for r in files])
+
+    async def save_telethon_session(self, name, session, entities, states, files):
+        async with self._acquire() as conn:
+            async with conn.transaction():
+                if session:
+                    await conn.execute(
+                        'INSERT INTO telethon_sessions (name, dc_id, server_address, port, auth_key, takeout_id) '
+                        'VALUES ($1, $2, $3, $4, $5, $6) ON CONFLICT (name) DO UPDATE SET dc_id = $2, '
+                        'server_address = $3, port = $4, auth_key = $5, takeout_id = $6',
+                        name, *session
+                    )
+                if entities:
+                    await conn.executemany(
+                        'INSERT INTO telethon_entities (session_name, id, hash, username, phone, name, date) '
+                        'VALUES ($1, $2, $3, $4, $5, $6, $7) ON CONFLICT (session_name, id) DO UPDATE SET '
+                        'hash = $3, username = $4, phone = $5, name = $6, date = $7',
+                        [(name, *row) for row in entities]
+                    )
+                if states:
+                    await conn.executemany(
+                        'INSERT INTO telethon_update_state (session_name, id, pts, qts, date, seq) '
+                        'VALUES ($1, $2, $3, $4, $5, $6) ON CONFLICT (session_name, id) DO UPDATE SET '
+                        'pts = $3, qts = $4, date = $5, seq = $6',
+                        [(name, *row) for row in states]
+                    )
+                if files:
+                    await conn.executemany(
+                        'INSERT INTO telethon_sent_files (session_name, md5_digest, file_size, type, id, hash) '
+                        'VALUES ($1, $2, $3, $4, $5, $6) ON CONFLICT (session_name, md5_digest, file_size, type) '
+                        'DO UPDATE SET id = $5, hash = $6',
+                        [(name, *row) for row in files]
+                    )
+
+
+def create_database():
+    """Создает хранилище, выбранное в config.DB_BACKEND."""
+    backend = config.DB_BACKEND.lower()
+    if backend == "sqlite":
+        from sqlite_database import SQLiteDatabase
+        return SQLiteDatabase(config.SQLITE_PATH)
+    if backend not in ("postgres", "postgresql"):
+        logger.warning(f"Неизвестный DB_BACKEND '{config.DB_BACKEND}', используем PostgreSQL")
+    return Database()
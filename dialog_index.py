@@ -0,0 +1,96 @@
+import asyncio
+import logging
+import os
+from datetime import datetime, timedelta, timezone
+from telethon import events, utils
+from telethon.tl.types import UpdateChannel, Channel, ChannelForbidden, PeerChannel
+
+logger = logging.getLogger(__name__)
+
+
+class DialogIndex:
+    """Локальный индекс каналов, доступных через аккаунт Telethon.
+
+    Индекс один раз заполняется полным проходом iter_dialogs, хранится в
+    таблице dialogs и затем обновляется по событиям UpdateChannel (вступление,
+    выход, переименование). Полное обновление повторяется не чаще, чем раз в
+    DIALOG_INDEX_TTL_HOURS часов, поэтому бот отвечает из базы, не тратя лимиты API.
+    """
+
+    def __init__(self, db, ttl_hours=None, batch_size=200):
+        """Инициализирует индекс.
+
+        Args:
+            db: Экземпляр базы данных
+            ttl_hours: Через сколько часов индекс считается устаревшим
+            batch_size: Количество каналов в одной пачке записи в базу
+        """
+        self.db = db
+        self.ttl = timedelta(hours=ttl_hours or float(os.getenv("DIALOG_INDEX_TTL_HOURS", "24")))
+        self.batch_size = batch_size
+        self.client = None
+        self._refresh_lock = asyncio.Lock()
+
+    @staticmethod
+    def _dialog_row(entity):
+        return utils.get_peer_id(entity), entity.title, getattr(entity, 'username', None)
+
+    def attach(self, client):
+        """Подписывается на обновления каналов клиента Telethon."""
+        if self.client is client:
+            return
+        self.client = client
+        client.add_event_handler(self._on_channel_update, events.Raw(UpdateChannel))
+        logger.info("Индекс диалогов подписан на обновления каналов")
+
+    async def _on_channel_update(self, update):
+        """Обновляет запись канала после UpdateChannel."""
+        peer = PeerChannel(update.channel_id)
+        channel_id = utils.get_peer_id(peer)
+        try:
+            entity = await self.client.get_entity(peer)
+        except Exception:
+            # Канал стал недоступен (исключили, удален или стал приватным)
+            entity = None
+        try:
+            if isinstance(entity, Channel) and not entity.left:
+                await self.db.upsert_dialogs([self._dialog_row(entity)], datetime.now(timezone.utc))
+            elif entity is None or isinstance(entity, ChannelForbidden) or entity.left:
+                await self.db.remove_dialog(channel_id)
+        except Exception as e:
+            logger.error(f"Ошибка при обновлении индекса диалогов для {channel_id}: {e}")
+
+    async def is_stale(self):
+        updated_at = await self.db.get_dialogs_updated_at()
+        return updated_at is None or datetime.now(timezone.utc) - updated_at > self.ttl
+
+    async def refresh(self):
+        """Полностью перестраивает индекс постраничным проходом по диалогам."""
+        if not self.client:
+            return 0
+        async with self._refresh_lock:
+            started_at = datetime.now(timezone.utc)
+            batch, total = [], 0
+            async for dialog in self.client.iter_dialogs():
+                if not dialog.is_channel:
+                    continue
+                batch.append(self._dialog_row(dialog.entity))
+                if len(batch) >= self.batch_size:
+                    await self.db.upsert_dialogs(batch, started_at)
+                    total += len(batch)
+                    batch = []
+            if batch:
+                await self.db.upsert_dialogs(batch, started_at)
+                total += len(batch)
+            # Каналы, которые не встретились при обходе, больше недоступны
+            await self.db.prune_dialogs(started_at)
+            logger.info(f"Индекс диалогов обновлен: {total} каналов")
+            return total
+
+    async def refresh_if_stale(self):
+        """Обновляет индекс, если он пуст или устарел."""
+        try:
+            if await self.is_stale():
+                await self.refresh()
+        except Exception as e:
+            logger.error(f"Ошибка при обновлении индекса диалогов: {e}")
@@ -0,0 +1,77 @@
+import hashlib
+
+
+def text_hash(text):
+    """64-битный хэш текста сообщения."""
+    return int.from_bytes(hashlib.blake2b((text or "").encode("utf-8"), digest_size=8).digest(), "big")
+
+
+def edit_timestamp(message):
+    """Время последнего редактирования сообщения в секундах Unix (0 — не редактировалось)."""
+    edit_date = getattr(message, "edit_date", None)
+    return int(edit_date.timestamp()) if edit_date else 0
+
+
+class EditTracker:
+    """Отметки редактирования недавних сообщений для повторной проверки правок.
+
+    Для каждого просмотренного сообщения хранится (edit_date, хэш текста,
+    маска сработавших наборов). Повторная проверка нужна, только если
+    edit_date сообщения стал больше запомненного и текст изменился, поэтому
+    уже обработанные сообщения страницы обходятся без хэширования и без
+    проверки правил. Хранится не больше limit сообщений, первыми
+    вытесняются те, что дольше всего не встречались. Обработанному сообщению
+    без отметки (перезапуск без снимка, вытеснение) парсер ставит отметку с
+    наборами, с которыми оно совпадает сейчас, как будто по ним оно уже
+    переслано: правка перешлет его только по новым наборам.
+    """
+
+    def __init__(self, limit=20000):
+        # (channel_id, message_id) -> (edit_date, хэш текста, маска наборов)
+        self.marks = {}
+        self.limit = limit
+
+    def marked(self, channel_id, message_id):
+        """True, если у сообщения есть отметка."""
+        return (str(channel_id), message_id) in self.marks
+
+    def remember(self, channel_id, message, matched):
+        """Запоминает состояние сообщения после проверки правил."""
+        key = (str(channel_id), message.message_id)
+        if self.marks.pop(key, None) is None and len(self.marks) >= self.limit:
+            self.marks.pop(next(iter(self.marks)))
+        self.marks[key] = (edit_timestamp(message), text_hash(message.text or message.caption), matched)
+
+    def edited(self, channel_id, message):
+        """Проверяет уже обработанное сообщение с отметкой на правку.
+
+        Отметка снова просмотренного сообщения переносится в конец очереди
+        вытеснения, поэтому вытесняются сообщения, которые давно не встречались.
+
+        Returns:
+            Маска наборов, сработавших до правки, если текст сообщения изменился
+            после последней проверки; иначе None (и для сообщения без отметки).
+        """
+        key = (str(channel_id), message.message_id)
+        mark = self.marks.pop(key, None)
+        if mark is None:
+            return None
+        self.marks[key] = mark
+        edited_at = edit_timestamp(message)
+        if edited_at <= mark[0]:
+            return None
+        digest = text_hash(message.text or message.caption)
+        if digest == mark[1]:
+            # Изменились только медиа или разметка
+            self.marks[key] = (edited_at, digest, mark[2])
+            return None
+        return mark[2]
+
+    def snapshot(self):
+        """Состояние для снимка теплого состояния (warm_state.py)."""
+        return [[channel_id, message_id, *mark] for (channel_id, message_id), mark in self.marks.items()]
+
+    def restore(self, data):
+        """Восстанавливает состояние из снимка."""
+        for channel_id, message_id, edited_at, digest, matched in data:
+            self.marks[(channel_id, message_id)] = (edited_at, digest, matched)
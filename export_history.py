@@ -0,0 +1,270 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Потоковая выгрузка обработанных, архивных и совпавших сообщений для анализа
+
+Пример запуска:
+    python export_history.py processed processed.jsonl.gz --since 2024-05-01
+    python export_history.py archive archive.csv.gz --channel @channel_name --channel -1001234567890
+    python export_history.py matched matched.parquet --since 2024-05-01 --until 2024-06-01
+"""
+
+import argparse
+import asyncio
+import csv
+import gzip
+import json
+import os
+import sys
+import time
+from datetime import datetime, timezone
+from dotenv import load_dotenv
+from loguru import logger
+from database import create_database
+from parser import MessageParser
+
+# Parquet — необязательный формат, нужен pyarrow
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    PARQUET_AVAILABLE = True
+except ImportError:
+    PARQUET_AVAILABLE = False
+
+# Загрузка переменных окружения
+load_dotenv()
+
+# Колонки наборов данных
+DATASETS = {
+    "processed": ("channel_id", "message_id", "processed_at"),
+    "archive": ("channel_id", "message_id", "date", "text"),
+    "matched": ("channel_id", "message_id", "date", "rule_sets", "text"),
+}
+
+FORMATS = ("jsonl", "csv", "parquet")
+
+
+def export_value(value):
+    """Приводит значение из базы к виду для файла: даты — в ISO 8601."""
+    if isinstance(value, datetime):
+        if value.tzinfo is None:
+            value = value.replace(tzinfo=timezone.utc)
+        return value.isoformat()
+    return value
+
+
+def detect_format(path):
+    """Определяет формат по расширению файла (.jsonl, .csv, .parquet, в том числе с .gz)."""
+    name = path.lower()
+    if name.endswith(".gz"):
+        name = name[:-3]
+    for fmt in FORMATS:
+        if name.endswith(f".{fmt}"):
+            return fmt
+    return None
+
+
+class JsonlWriter:
+    """JSON Lines: одна запись в строке."""
+
+    def __init__(self, f, columns):
+        self.f = f
+        self.columns = columns
+
+    def write(self, rows):
+        self.f.write("".join(
+            json.dumps(dict(zip(self.columns, row)), ensure_ascii=False) + "\n" for row in rows
+        ))
+
+    def close(self):
+        pass
+
+
+class CsvWriter:
+    """CSV с заголовком; списки записываются через запятую."""
+
+    def __init__(self, f, columns):
+        self.writer = csv.writer(f, delimiter=";")
+        self.writer.writerow(columns)
+
+    def write(self, rows):
+        self.writer.writerows(
+            [",".join(value) if isinstance(value, list) else value for value in row] for row in rows
+        )
+
+    def close(self):
+        pass
+
+
+class ParquetWriter:
+    """Parquet: каждая пачка записывается отдельной группой строк."""
+
+    def __init__(self, path, columns, compression="zstd"):
+        self.columns = columns
+        fields = []
+        for column in columns:
+            if column == "message_id":
+                fields.append(pa.field(column, pa.int64()))
+            elif column == "rule_sets":
+                fields.append(pa.field(column, pa.list_(pa.string())))
+            else:
+                fields.append(pa.field(column, pa.string()))
+        self.schema = pa.schema(fields)
+        self.writer = pq.ParquetWriter(path, self.schema, compression=compression)
+
+    def write(self, rows):
+        data = {column: [row[i] for row in rows] for i, column in enumerate(self.columns)}
+        self.writer.write_table(pa.table(data, schema=self.schema))
+
+    def close(self):
+        self.writer.close()
+
+
+class HistoryExport:
+    """Выгрузка истории с постоянным расходом памяти.
+
+    Строки читаются из базы пачками по batch_size (PostgreSQL — курсором на
+    стороне сервера в отдельном соединении, SQLite — короткими запросами по
+    ключу id) и сразу дописываются в файл, поэтому в памяти одновременно
+    находится не больше одной пачки при любом размере таблиц. Между пачками
+    выгрузка уступает цикл событий (и при необходимости делает паузу pause),
+    чтобы не задерживать работающий парсер.
+
+    Набор matched — сообщения архива, которые подходят под текущие ключевые
+    слова и наборы правил своего канала, с именами сработавших наборов.
+    """
+
+    def __init__(self, db, parser=None, batch_size=None, pause=None):
+        """Инициализирует выгрузку.
+
+        Args:
+            db: Экземпляр базы данных
+            parser: Экземпляр MessageParser (нужен для набора matched)
+            batch_size: Строк в одной пачке
+            pause: Пауза между пачками в секундах
+        """
+        self.db = db
+        self.parser = parser
+        self.batch_size = batch_size or int(os.getenv("EXPORT_BATCH_SIZE", "5000"))
+        self.pause = pause if pause is not None else float(os.getenv("EXPORT_PAUSE", "0"))
+
+    def _open(self, path, fmt, columns):
+        """Открывает файл и писатель формата; .gz включает сжатие gzip."""
+        if fmt == "parquet":
+            if not PARQUET_AVAILABLE:
+                raise RuntimeError("Для выгрузки в Parquet установите pyarrow: pip install pyarrow")
+            return None, ParquetWriter(path, columns)
+        if path.lower().endswith(".gz"):
+            f = gzip.open(path, "wt", encoding="utf-8", newline="")
+        else:
+            f = open(path, "w", encoding="utf-8", newline="")
+        return f, (JsonlWriter if fmt == "jsonl" else CsvWriter)(f, columns)
+
+    async def _rows(self, dataset, since, until, channels):
+        """Пачки строк набора данных в порядке колонок DATASETS."""
+        if dataset == "processed":
+            async for batch in self.db.iter_processed_messages(since, until, channels, self.batch_size):
+                yield [(r['channel_id'], r['message_id'], export_value(r['processed_at'])) for r in batch]
+        elif dataset == "archive":
+            async for batch in self.db.iter_archived_messages(since, until, channels, self.batch_size):
+                yield [(r['channel_id'], r['message_id'], export_value(r['date']), r['text']) for r in batch]
+        else:
+            parser = self.parser
+            rules = await parser.load_rules()
+            async for batch in self.db.iter_archived_messages(since, until, channels, self.batch_size):
+                rows = []
+                for r in batch:
+                    matched = await parser.match_rules(
+                        r['text'], parser.keywords, parser.stopwords, rules.channel_mask(r['channel_id'])
+                    )
+                    if matched:
+                        rows.append((r['channel_id'], r['message_id'], export_value(r['date']),
+                                     rules.rule_names(matched), r['text']))
+                yield rows
+
+    async def run(self, dataset, path, fmt=None, since=None, until=None, channels=None):
+        """Выгружает набор данных в файл.
+
+        Args:
+            dataset: processed, archive или matched
+            path: Путь к файлу; формат определяется по расширению, если fmt не задан
+            fmt: jsonl, csv или parquet
+            since: Начало периода (включительно) или None
+            until: Конец периода (не включительно) или None
+            channels: Список ID каналов или None — все каналы
+
+        Returns:
+            Количество выгруженных строк
+        """
+        if dataset not in DATASETS:
+            raise ValueError(f"Неизвестный набор данных: {dataset}")
+        fmt = fmt or detect_format(path) or "jsonl"
+        if dataset == "matched" and self.parser is None:
+            raise ValueError("Для набора matched нужен парсер")
+
+        started = time.perf_counter()
+        total = 0
+        f, writer = self._open(path, fmt, DATASETS[dataset])
+        try:
+            async for rows in self._rows(dataset, since, until, channels):
+                if rows:
+                    writer.write(rows)
+                    total += len(rows)
+                # Уступаем цикл событий между пачками
+                await asyncio.sleep(self.pause)
+        finally:
+            writer.close()
+            if f:
+                f.close()
+        logger.info(f"Выгружено {total} строк ({dataset}) в {path} за {time.perf_counter() - started:.1f} с")
+        return total
+
+
+def parse_date(value):
+    """Разбирает дату ГГГГ-ММ-ДД или ГГГГ-ММ-ДДTЧЧ:ММ (время в UTC, если пояс не указан)."""
+    date = datetime.fromisoformat(value)
+    return date if date.tzinfo else date.replace(tzinfo=timezone.utc)
+
+
+async def main_async(args):
+    db = create_database()
+    if not await db.connect():
+        logger.error("Не удалось подключиться к базе данных.")
+        return
+
+    try:
+        parser = MessageParser(db) if args.dataset == "matched" else None
+        export = HistoryExport(db, parser, batch_size=args.batch_size, pause=args.pause)
+        await export.run(args.dataset, args.output, args.format, args.since, args.until, args.channel)
+    except Exception as e:
+        logger.error(f"Ошибка при выгрузке: {e}")
+    finally:
+        await db.close()
+
+
+def main():
+    """Запускает скрипт."""
+    arg_parser = argparse.ArgumentParser(description="Потоковая выгрузка истории сообщений")
+    arg_parser.add_argument("dataset", choices=DATASETS, help="processed, archive или matched")
+    arg_parser.add_argument("output", help="Файл (.jsonl, .csv, .parquet; .gz — сжатие gzip)")
+    arg_parser.add_argument("--format", choices=FORMATS, default=None, help="Формат, если не определяется по расширению")
+    arg_parser.add_argument("--since", type=parse_date, default=None, help="Начало периода, ГГГГ-ММ-ДД[TЧЧ:ММ]")
+    arg_parser.add_argument("--until", type=parse_date, default=None, help="Конец периода (не включительно)")
+    arg_parser.add_argument("--channel", action="append", default=None, help="Канал (можно указать несколько раз)")
+    arg_parser.add_argument("--batch-size", type=int, default=None, help="Строк в одной пачке")
+    arg_parser.add_argument("--pause", type=float, default=None, help="Пауза между пачками, сек.")
+    args = arg_parser.parse_args()
+
+    # Проверка каждого сообщения набора matched не пишет отладочный журнал парсера
+    logger.remove()
+    logger.add(sys.stderr, level="INFO")
+
+    try:
+        asyncio.run(main_async(args))
+    except KeyboardInterrupt:
+        print("Скрипт остановлен пользователем")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,193 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Локальная замена TelegramClient для нагрузочного тестирования парсера
+
+Реализует только те методы Telethon, которые использует MessageParser:
+get_entity, get_messages, forward_messages, is_user_authorized, is_connected.
+Каналы публикуют сообщения с заданной частотой (пуассоновский поток),
+вызовы API выполняются с задержкой из логнормального распределения,
+а часть вызовов завершается FloodWaitError.
+"""
+
+import asyncio
+import random
+import time
+from datetime import datetime, timezone
+from telethon.errors import FloodWaitError
+from telethon.tl.types import Channel, ChatPhotoEmpty
+
+# Словарь для генерации текстов сообщений
+WORDS = (
+    "новости", "рынок", "курс", "рубль", "доллар", "нефть", "погода", "спорт", "футбол",
+    "выборы", "город", "транспорт", "цены", "акции", "банк", "ставка", "прогноз", "итоги",
+    "сегодня", "завтра", "неделя", "отчет", "компания", "проект", "запуск", "обзор",
+)
+
+
+class FakeMessage:
+    """Сообщение канала с атрибутами, которые читает MessageParser.convert_message."""
+
+    def __init__(self, message_id, text, date):
+        self.id = message_id
+        self.message = text
+        self.text = text
+        self.raw_text = text
+        self.date = date
+        self.caption = None
+        self.grouped_id = None
+        self.post = True
+        self.post_author = None
+        self.photo = None
+        self.video = None
+        self.document = None
+        self.audio = None
+        self.voice = None
+        self.poll = None
+
+
+class FakeChannel:
+    """Канал, публикующий сообщения со средней частотой rate сообщений в минуту."""
+
+    def __init__(self, channel_id, username, rate, keywords, keyword_rate, rng):
+        self.entity = Channel(
+            id=channel_id, title=f"Тестовый канал {channel_id}", photo=ChatPhotoEmpty(),
+            date=datetime.now(timezone.utc), access_hash=channel_id, username=username, broadcast=True
+        )
+        self.rate = rate / 60.0
+        self.keywords = keywords
+        self.keyword_rate = keyword_rate
+        self.rng = rng
+        self.messages = []
+        self.next_id = 1
+        self.next_post_at = time.time() + rng.expovariate(self.rate) if self.rate else None
+
+    def _text(self):
+        words = self.rng.choices(WORDS, k=self.rng.randint(5, 30))
+        if self.keywords and self.rng.random() < self.keyword_rate:
+            words.insert(self.rng.randrange(len(words) + 1), self.rng.choice(self.keywords).replace("+", " "))
+        return " ".join(words).capitalize()
+
+    def publish_until(self, now):
+        """Публикует сообщения, время которых наступило к моменту now."""
+        while self.next_post_at is not None and self.next_post_at <= now:
+            date = datetime.fromtimestamp(self.next_post_at, timezone.utc)
+            self.messages.append(FakeMessage(self.next_id, self._text(), date))
+            self.next_id += 1
+            self.next_post_at += self.rng.expovariate(self.rate)
+
+
+class FakeTelegramClient:
+    """Имитация TelegramClient с настраиваемыми задержками и FloodWait."""
+
+    def __init__(self, channels=100, rate=1.0, latency_ms=120.0, latency_sigma=0.5,
+                 flood_rate=0.0, flood_seconds=5, keywords=(), keyword_rate=0.05,
+                 history=20, seed=None):
+        """Инициализирует клиент.
+
+        Args:
+            channels: Количество каналов
+            rate: Средняя частота публикаций в канале, сообщений в минуту
+            latency_ms: Медиана задержки одного вызова API, мс
+            latency_sigma: Разброс логнормального распределения задержки
+            flood_rate: Доля вызовов, завершающихся FloodWaitError
+            flood_seconds: Время ожидания в FloodWaitError, сек.
+            keywords: Слова, которые вставляются в часть сообщений
+            keyword_rate: Доля сообщений с ключевым словом
+            history: Количество сообщений в каждом канале до начала теста
+            seed: Зерно генератора случайных чисел
+        """
+        self.rng = random.Random(seed)
+        self.latency = latency_ms / 1000.0
+        self.latency_sigma = latency_sigma
+        self.flood_rate = flood_rate
+        self.flood_seconds = flood_seconds
+        self.connected = True
+
+        self.channels = {}
+        self.usernames = {}
+        for i in range(channels):
+            channel_id = 1000000 + i
+            channel = FakeChannel(channel_id, f"fake_channel_{i}", rate, list(keywords), keyword_rate, self.rng)
+            for _ in range(history):
+                channel.messages.append(FakeMessage(channel.next_id, channel._text(), datetime.now(timezone.utc)))
+                channel.next_id += 1
+            self.channels[channel_id] = channel
+            self.usernames[f"@fake_channel_{i}"] = channel
+        self.target = FakeChannel(999999, "fake_target", 0, [], 0, self.rng)
+
+        # Статистика вызовов
+        self.calls = {}
+        self.flood_waits = 0
+        self.forwarded = []
+
+    def channel_ids(self):
+        """Возвращает ID каналов в формате -100..., как их хранит бот."""
+        return [f"-100{channel_id}" for channel_id in self.channels]
+
+    def target_id(self):
+        return f"-100{self.target.entity.id}"
+
+    async def _call(self, method):
+        """Имитирует сетевой вызов: задержка и случайный FloodWait."""
+        self.calls[method] = self.calls.get(method, 0) + 1
+        if self.latency:
+            await asyncio.sleep(self.rng.lognormvariate(0, self.latency_sigma) * self.latency)
+        if self.flood_rate and self.rng.random() < self.flood_rate:
+            self.flood_waits += 1
+            raise FloodWaitError(request=None, capture=self.flood_seconds)
+
+    def _channel(self, entity):
+        if isinstance(entity, Channel):
+            key = entity.id
+        elif isinstance(entity, str) and entity.startswith("@"):
+            channel = self.usernames.get(entity)
+            if channel is None:
+                raise ValueError(f'No user has "{entity[1:]}" as username')
+            return channel
+        else:
+            key = int(entity)
+            if str(key).startswith("-100"):
+                key = int(str(key)[4:])
+        if key == self.target.entity.id:
+            return self.target
+        channel = self.channels.get(key)
+        if channel is None:
+            raise ValueError(f"Could not find the input entity for {entity}")
+        return channel
+
+    def is_connected(self):
+        return self.connected
+
+    async def is_user_authorized(self):
+        return True
+
+    async def connect(self):
+        self.connected = True
+
+    async def disconnect(self):
+        self.connected = False
+
+    async def get_entity(self, entity):
+        await self._call("get_entity")
+        return self._channel(entity).entity
+
+    async def get_messages(self, entity, limit=None, ids=None):
+        await self._call("get_messages")
+        channel = self._channel(entity)
+        channel.publish_until(time.time())
+        if ids is not None:
+            index = ids - 1
+            return channel.messages[index] if 0 <= index < len(channel.messages) else None
+        # Как и Telethon, возвращаем сообщения от новых к старым
+        return list(reversed(channel.messages[-(limit or 1):]))
+
+    async def forward_messages(self, entity, messages, silent=False):
+        await self._call("forward_messages")
+        self._channel(entity)
+        now = datetime.now(timezone.utc)
+        batch = messages if isinstance(messages, list) else [messages]
+        for message in batch:
+            self.forwarded.append((message.date, now))
+        return messages
@@ -0,0 +1,55 @@
+import asyncio
+import time
+
+
+class RateLimiter:
+    """Равномерно распределяет пересылки в один чат: не больше rate в минуту.
+
+    Слот резервируется до ожидания, поэтому несколько ожидающих получают
+    последовательные слоты. rate = 0 или None — без ограничения.
+    """
+
+    __slots__ = ("rate", "interval", "next_at")
+
+    def __init__(self, rate=None):
+        self.next_at = 0.0
+        self.set_rate(rate)
+
+    def set_rate(self, rate):
+        self.rate = rate or 0
+        self.interval = 60.0 / self.rate if self.rate else 0.0
+
+    def pause(self, seconds):
+        """Откладывает следующие слоты на seconds секунд (например, после FloodWait)."""
+        self.next_at = max(self.next_at, time.monotonic() + seconds)
+
+    async def wait(self):
+        now = time.monotonic()
+        delay = self.next_at - now
+        self.next_at = max(now, self.next_at) + self.interval
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+
+class Delivery:
+    """Сообщение, которое пересылается в несколько чатов.
+
+    Сообщение получается из канала один раз и раскладывается по очередям
+    чатов; когда все чаты ответили, парсер помечает его обработанным
+    (если доставка во все чаты удалась) и закрывает трассу.
+    """
+
+    __slots__ = ("channel_id", "message_id", "trace", "message", "pending", "failed", "started")
+
+    def __init__(self, channel_id, message_id, trace, message, targets):
+        self.channel_id = channel_id
+        self.message_id = message_id
+        self.trace = trace
+        self.message = message
+        self.pending = set(targets)
+        self.failed = message is None
+        self.started = time.perf_counter()
+
+    @property
+    def key(self):
+        return (str(self.channel_id), self.message_id)
@@ -0,0 +1,81 @@
+import logging
+from datetime import datetime, timezone
+
+logger = logging.getLogger(__name__)
+
+
+class HitCounters:
+    """Счетчики совпадений и пересылок по ключевым словам и каналам.
+
+    Парсер увеличивает счетчики в памяти при совпадении (record_match) и после
+    доставки сообщения во все чаты (record_forward); в базу они прибавляются
+    одной пачкой в конце цикла (flush), поэтому совпадения не добавляют
+    запросов к базе. Сообщение, которое ждет повторной пересылки, при
+    повторной проверке второй раз не считается.
+    """
+
+    def __init__(self, pending_limit=5000):
+        """Инициализирует счетчики.
+
+        Args:
+            pending_limit: Сколько совпавших сообщений помнить до их пересылки
+        """
+        # (ID набора, ключевое слово) -> [совпадений, пересылок, время последнего совпадения]
+        self.keywords = {}
+        # ID канала -> [совпадений, пересылок, время последнего совпадения]
+        self.channels = {}
+        # (ID канала, ID сообщения) -> ключевые слова, ждущие пересылки
+        self.pending = {}
+        self.pending_limit = pending_limit
+
+    def _counters(self, channel_id, hits):
+        counters = [self.keywords.setdefault(hit, [0, 0, None]) for hit in hits]
+        counters.append(self.channels.setdefault(channel_id, [0, 0, None]))
+        return counters
+
+    def record_match(self, channel_id, message_id, hits):
+        """Учитывает совпавшее сообщение и его ключевые слова (пары (ID набора, слово))."""
+        key = (str(channel_id), message_id)
+        if key in self.pending:
+            return
+        if len(self.pending) >= self.pending_limit:
+            self.pending.pop(next(iter(self.pending)))
+        self.pending[key] = hits
+        now = datetime.now(timezone.utc)
+        for counter in self._counters(key[0], hits):
+            counter[0] += 1
+            counter[2] = now
+
+    def record_forward(self, channel_id, message_id):
+        """Учитывает пересылку сообщения, совпадение которого было учтено."""
+        key = (str(channel_id), message_id)
+        hits = self.pending.pop(key, None)
+        if hits is None:
+            return
+        for counter in self._counters(key[0], hits):
+            counter[1] += 1
+
+    def _merge(self, keywords, channels):
+        for target, source in ((self.keywords, keywords), (self.channels, channels)):
+            for key, (hits, forwards, last_hit_at) in source.items():
+                counter = target.setdefault(key, [0, 0, None])
+                counter[0] += hits
+                counter[1] += forwards
+                if last_hit_at and (counter[2] is None or last_hit_at > counter[2]):
+                    counter[2] = last_hit_at
+
+    async def flush(self, db):
+        """Прибавляет накопленные счетчики в базе и обнуляет их в памяти."""
+        if not self.keywords and not self.channels:
+            return
+        keywords, channels = self.keywords, self.channels
+        self.keywords, self.channels = {}, {}
+        try:
+            await db.save_hit_counts(
+                [(rule_set_id, keyword, *counter) for (rule_set_id, keyword), counter in keywords.items()],
+                [(channel_id, *counter) for channel_id, counter in channels.items()]
+            )
+        except Exception as e:
+            # Счетчики возвращаются и будут записаны в следующем цикле
+            logger.error(f"Ошибка при записи счетчиков совпадений: {e}")
+            self._merge(keywords, channels)
@@ -7,17 +7,32 @@ Telegram Bot для парсинга сообщений из каналов с 
 
 import os
 import sys
+import csv
+import io
 import logging
 import asyncio
+import tempfile
+import time
 from dotenv import load_dotenv
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, ReplyKeyboardMarkup, KeyboardButton
 from telegram.ext import Application, CommandHandler, MessageHandler, CallbackQueryHandler, filters, ContextTypes
-from database import Database
+from database import create_database, DEFAULT_RULE_SET_ID
 from scheduler import MessageScheduler
+from backfill import HistoryBackfill
+from check_channels import ChannelAudit, summary as audit_summary
+from add_real_channels import ChannelOnboarding, parse_channel_list, summary as onboard_summary, write_report
+from dialog_index import DialogIndex
+from warm_state import WarmStateSnapshot
+import metrics
+import tracing
+import config
+import telethon_session
+from profiling import cycle_profiler
+from loop_monitor import LoopLagMonitor
 
 # Проверяем наличие Telethon
 try:
-    from telethon import TelegramClient, errors
+    from telethon import errors
     TELETHON_AVAILABLE = True
 except ImportError:
     TELETHON_AVAILABLE = False
@@ -38,6 +53,18 @@ BOT_TOKEN = os.getenv("BOT_TOKEN")
 TARGET_CHANNEL_ID = os.getenv("TARGET_CHANNEL_ID")
 CHECK_INTERVAL = int(os.getenv("CHECK_INTERVAL", "3"))
 
+# ID пользователей Telegram с доступом к служебным командам (через запятую)
+ADMIN_IDS = {int(x) for x in os.getenv("ADMIN_IDS", "").replace(" ", "").split(",") if x}
+
+# Максимальная глубина дозагрузки истории из бота (/backfill), дней
+BACKFILL_MAX_DAYS = int(os.getenv("BACKFILL_MAX_DAYS", "30"))
+
+# Размер страниц для списков: кнопки удаления и текстовые списки
+PAGE_SIZE = int(os.getenv("PAGE_SIZE", "20"))
+TEXT_PAGE_SIZE = int(os.getenv("TEXT_PAGE_SIZE", "100"))
+# Предел длины текстовой страницы (сообщение Telegram — не больше 4096 символов)
+TEXT_PAGE_CHARS = 4000
+
 # Получаем настройки Telethon
 TELEGRAM_API_ID = os.getenv("TELEGRAM_API_ID")
 TELEGRAM_API_HASH = os.getenv("TELEGRAM_API_HASH")
@@ -47,8 +74,8 @@ if not BOT_TOKEN:
     logger.error("Не указан токен бота в переменных окружения (BOT_TOKEN)")
     sys.exit(1)
 
-# Инициализация базы данных
-db = Database()
+# Инициализация базы данных (PostgreSQL или SQLite, см. DB_BACKEND)
+db = create_database()
 
 # Глобальная переменная для планировщика
 scheduler = None
@@ -56,6 +83,22 @@ scheduler = None
 # Глобальная переменная для Telethon клиента
 telethon_client = None
 
+# Фоновые задачи команд: ссылки держатся до завершения, иначе задачу может собрать сборщик мусора
+background_tasks = set()
+
+def run_in_background(coro):
+    """Запускает корутину фоновой задачей и хранит ссылку на нее до завершения."""
+    task = asyncio.create_task(coro)
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
+    return task
+
+# Локальный индекс каналов, доступных через аккаунт Telethon
+dialog_index = DialogIndex(db)
+
+# Монитор задержек цикла событий; этап берется у парсера текущего планировщика
+loop_monitor = LoopLagMonitor(stage_provider=lambda: scheduler.parser.stage if scheduler else "idle")
+
 # Клавиатуры
 def get_main_keyboard():
     """Возвращает основную клавиатуру."""
@@ -87,9 +130,11 @@ def get_keywords_keyboard():
     """Возвращает клавиатуру для управления ключевыми словами."""
     keyboard = [
         [KeyboardButton("➕ Добавить ключевое слово")],
+        [KeyboardButton("📥 Импорт из файла"), KeyboardButton("📤 Экспорт в файл")],
         [KeyboardButton("❌ Удалить все слова ❌")],
         [KeyboardButton("🔄 Сортировать по дате 🔄")],
         [KeyboardButton("📋 Копировать все слова 📋")],
+        [KeyboardButton("📊 Статистика слов")],
         [KeyboardButton("⬅️ Назад ⬅️")]
     ]
     return ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
@@ -98,6 +143,7 @@ def get_stopwords_keyboard():
     """Возвращает клавиатуру для управления стоп-словами."""
     keyboard = [
         [KeyboardButton("➕ Добавить стоп-слово")],
+        [KeyboardButton("📥 Импорт из файла"), KeyboardButton("📤 Экспорт в файл")],
         [KeyboardButton("❌ Удалить все слова ❌")],
         [KeyboardButton("🔄 Сортировать по дате 🔄")],
         [KeyboardButton("📋 Копировать все слова 📋")],
@@ -109,12 +155,231 @@ def get_channels_keyboard():
     """Возвращает клавиатуру для управления каналами."""
     keyboard = [
         [KeyboardButton("➕ Добавить канал"), KeyboardButton("📋 Список каналов")],
-        [KeyboardButton("🔍 Показать доступные каналы")],
+        [KeyboardButton("🔍 Показать доступные каналы"), KeyboardButton("🔎 Поиск каналов")],
+        [KeyboardButton("📥 Импорт каналов"), KeyboardButton("📤 Экспорт каналов")],
         [KeyboardButton("🔐 Авторизовать Telethon")],
         [KeyboardButton("⬅️ Назад ⬅️")]
     ]
     return ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
 
+# Постраничные списки
+# Вид списка -> (заголовок, текстовый список или кнопки удаления, префикс callback удаления)
+PAGE_KINDS = {
+    "kw": ("📋 Список ключевых слов", False, "delkw"),
+    "sw": ("📋 Список стоп-слов", False, "delsw"),
+    "ch": ("Выберите канал для удаления", False, "delch"),
+    "chl": ("📋 Список отслеживаемых каналов", True, None),
+    "kwc": ("Список ключевых слов", True, None),
+    "swc": ("Список стоп-слов", True, None),
+    "dl": ("📋 Доступные каналы (✅ — уже отслеживается, ➕ — добавить)", False, "adddl"),
+}
+
+async def fetch_page(kind, after_id=None, before_id=None, search=None):
+    """Загружает страницу списка по ключу id."""
+    is_text = PAGE_KINDS[kind][1]
+    limit = TEXT_PAGE_SIZE if is_text else PAGE_SIZE
+    if kind == "dl":
+        return await db.get_dialogs_page(search, after_id, before_id, limit)
+    if kind in ("kw", "kwc"):
+        return await db.get_keywords_page(after_id, before_id, limit)
+    if kind in ("sw", "swc"):
+        return await db.get_stopwords_page(after_id, before_id, limit)
+    return await db.get_channels_page(after_id, before_id, limit)
+
+def fit_lines(lines, limit):
+    """Возвращает, сколько первых строк помещается в limit символов (не меньше одной)."""
+    total = 0
+    for count, line in enumerate(lines):
+        total += len(line) + 1
+        if total > limit:
+            return max(1, count)
+    return len(lines)
+
+def channel_label(row):
+    """Возвращает подпись канала для списков."""
+    label = f"ID: {row['channel_id']}"
+    if row['name']:
+        label += f" ({row['name']})"
+    return label
+
+async def render_page(kind, after_id=None, before_id=None, search=None):
+    """Строит текст и inline-клавиатуру страницы списка.
+    
+    Возвращает (None, None), если список пуст.
+    """
+    title, is_text, delete_prefix = PAGE_KINDS[kind]
+    rows, has_prev, has_next = await fetch_page(kind, after_id, before_id, search)
+    if not rows:
+        return None, None
+    
+    keyboard = []
+    if is_text:
+        if kind == "chl":
+            lines = [channel_label(row) for row in rows]
+        else:
+            lines = [row['word'] for row in rows]
+        header = f"{title}:\n\n"
+        limit = TEXT_PAGE_CHARS - len(header)
+        # Страница обрезается по длине, курсоры навигации берутся по показанным строкам;
+        # при переходе назад сохраняются строки, ближайшие к предыдущей странице
+        if before_id is not None:
+            keep = fit_lines(lines[::-1], limit)
+            if keep < len(rows):
+                rows, lines, has_prev = rows[-keep:], lines[-keep:], True
+        else:
+            keep = fit_lines(lines, limit)
+            if keep < len(rows):
+                rows, lines, has_next = rows[:keep], lines[:keep], True
+        text = (header + "\n".join(lines))[:TEXT_PAGE_CHARS]
+    else:
+        text = f"{title}:"
+        if search:
+            text += f"\nПоиск: {search}"
+        for row in rows:
+            if kind == "ch":
+                label = channel_label(row)
+            elif kind == "dl":
+                label = f"{'✅' if row['monitored'] else '➕'} {row['title']}"
+            else:
+                label = f"❌ {row['word']}"
+            keyboard.append([InlineKeyboardButton(label, callback_data=f"{delete_prefix}_{row['id']}")])
+    
+    navigation = []
+    if has_prev:
+        navigation.append(InlineKeyboardButton("⬅️", callback_data=f"page_{kind}_p_{rows[0]['id']}"))
+    if has_next:
+        navigation.append(InlineKeyboardButton("➡️", callback_data=f"page_{kind}_n_{rows[-1]['id']}"))
+    if navigation:
+        keyboard.append(navigation)
+    if kind == "dl":
+        keyboard.append([InlineKeyboardButton("🔄 Обновить список", callback_data="dl_refresh")])
+    
+    return text, InlineKeyboardMarkup(keyboard) if keyboard else None
+
+# Импорт и экспорт списков файлами
+EXPORT_BATCH_SIZE = 5000
+MAX_IMPORT_FILE_SIZE = 10 * 1024 * 1024
+
+def parse_import_file(data, filename):
+    """Разбирает загруженный файл слов: одно слово в строке (.txt) или первая колонка CSV."""
+    text = data.decode("utf-8-sig", errors="replace")
+    if filename and filename.lower().endswith(".csv"):
+        delimiter = ";" if text.count(";") > text.count(",") else ","
+        rows = [row for row in csv.reader(io.StringIO(text), delimiter=delimiter) if row]
+    else:
+        rows = [[line] for line in text.splitlines()]
+    
+    result = []
+    for row in rows:
+        value = row[0].strip()
+        # Пропускаем пустые строки и заголовок CSV
+        if not value or value.lower() == "word":
+            continue
+        result.append(value)
+    return result
+
+async def export_list(update: Update, kind: str) -> None:
+    """Выгружает список постранично во временный файл и отправляет его документом."""
+    if kind == "channels":
+        fetch, filename = db.get_channels_page, "channels.csv"
+    elif kind == "keywords":
+        fetch, filename = db.get_keywords_page, "keywords.txt"
+    else:
+        fetch, filename = db.get_stopwords_page, "stopwords.txt"
+    
+    with tempfile.TemporaryFile() as f:
+        if kind == "channels":
+            f.write("channel_id;name\n".encode("utf-8"))
+        after_id, total, has_next = None, 0, True
+        while has_next:
+            rows, _, has_next = await fetch(after_id=after_id, limit=EXPORT_BATCH_SIZE)
+            if not rows:
+                break
+            if kind == "channels":
+                lines = [f"{row['channel_id']};{row['name'] or ''}" for row in rows]
+            else:
+                lines = [row['word'] for row in rows]
+            f.write(("\n".join(lines) + "\n").encode("utf-8"))
+            total += len(rows)
+            after_id = rows[-1]['id']
+        
+        if not total:
+            await update.message.reply_text("📋 Список пуст, экспортировать нечего.")
+            return
+        f.seek(0)
+        await update.message.reply_document(document=f, filename=filename, caption=f"📤 Экспортировано записей: {total}")
+
+async def onboard_channels(update: Update, items) -> None:
+    """Добавляет список каналов в фоне и присылает отчет по каждому значению."""
+    if not scheduler:
+        await update.message.reply_text("⚠️ Парсер не запущен", reply_markup=get_channels_keyboard())
+        return
+    parser = scheduler.parser
+    # Без авторизованного Telethon каналы только приводятся к единому виду
+    resolve = False
+    if parser.client:
+        try:
+            resolve = await parser.client.is_user_authorized()
+        except Exception as e:
+            logger.error(f"Ошибка при проверке авторизации Telethon: {e}")
+    
+    async def run_onboarding():
+        try:
+            results = await ChannelOnboarding(parser, resolve=resolve).run(items)
+            report = io.StringIO()
+            write_report(results, report)
+            await update.message.reply_document(
+                document=report.getvalue().encode("utf-8"), filename="channels_report.csv",
+                caption=onboard_summary(results, limit=10)[:1000]
+            )
+        except Exception as e:
+            logger.error(f"Ошибка при добавлении каналов: {e}")
+            await update.message.reply_text(f"❌ Ошибка при добавлении каналов: {e}")
+    
+    run_in_background(run_onboarding())
+    note = "" if resolve else " без проверки через Telethon (клиент не авторизован)"
+    await update.message.reply_text(
+        f"⏳ Добавление {len(items)} каналов запущено в фоне{note}. Отчет придет отдельным сообщением.",
+        reply_markup=get_channels_keyboard()
+    )
+
+async def handle_document(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Импортирует ключевые слова, стоп-слова или каналы из загруженного файла."""
+    waiting_for = context.user_data.get("waiting_for")
+    if waiting_for not in ("import_keywords", "import_stopwords", "import_channels"):
+        await update.message.reply_text("Чтобы импортировать список, сначала выберите '📥 Импорт из файла' в нужном меню.")
+        return
+    context.user_data.pop("waiting_for", None)
+    
+    document = update.message.document
+    if document.file_size and document.file_size > MAX_IMPORT_FILE_SIZE:
+        await update.message.reply_text("❌ Файл слишком большой (максимум 10 МБ).")
+        return
+    
+    try:
+        file = await document.get_file()
+        data = bytes(await file.download_as_bytearray())
+        
+        if waiting_for == "import_channels":
+            items = parse_channel_list(data.decode("utf-8-sig", errors="replace"), document.file_name)
+            if not items:
+                await update.message.reply_text("📋 В файле нет каналов.", reply_markup=get_channels_keyboard())
+                return
+            await onboard_channels(update, items)
+            return
+        words = parse_import_file(data, document.file_name)
+        if waiting_for == "import_keywords":
+            count = await db.add_keywords(words) if words else 0
+            reply_markup = get_keywords_keyboard()
+        else:
+            count = await db.add_stopwords(words) if words else 0
+            reply_markup = get_stopwords_keyboard()
+        
+        await update.message.reply_text(f"✅ Импортировано записей: {count}", reply_markup=reply_markup)
+    except Exception as e:
+        logger.error(f"Ошибка при импорте файла: {e}")
+        await update.message.reply_text(f"❌ Ошибка при импорте файла: {e}")
+
 # Обработчики команд и сообщений
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Обработчик команды /start."""
@@ -131,7 +396,18 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
         "📋 Список доступных команд:\n\n"
         "/start - Начать работу с ботом\n"
         "/help - Показать эту справку\n"
-        "/status - Показать текущий статус бота\n\n"
+        "/status - Показать текущий статус бота\n"
+        "/metrics - Показать сводку метрик парсера и базы данных\n"
+        "/traces - Показать задержки этапов и самые медленные пересылки\n"
+        "/lag - Показать задержки цикла событий и блокирующий код\n"
+        "/profile [циклов] - Профилировать следующие циклы парсера (только для администраторов)\n"
+        "/backfill <канал> [дней] - Проверить историю канала по текущим ключевым словам\n"
+        "/audit [дней] - Проверить все каналы и отключить несуществующие (только для администраторов)\n"
+        "/rules - Наборы правил для отдельных каналов (/rules help — подробнее)\n"
+        "/subscribe <чат> - Получать совпадения по своим ключевым словам в свой чат\n"
+        "/my - Ключевые слова и каналы своей подписки\n"
+        "/hits [top|bottom|never] [N] - Совпадения по ключевым словам: частые, редкие и без совпадений\n"
+        "/quarantine [reset <канал>] - Каналы на карантине после ошибок\n\n"
         "Также вы можете использовать кнопки на клавиатуре для управления ботом."
     )
     await update.message.reply_text(help_text, reply_markup=get_status_keyboard(scheduler and scheduler.is_running))
@@ -139,27 +415,31 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
 async def status(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Показывает текущий статус бота."""
     try:
-        channels = await db.get_channels()
-        keywords = await db.get_keywords()
-        stopwords = await db.get_stopwords()
+        counts = await db.get_counts()
         
         # Статус парсера
         parser_status = "✅ Активен" if scheduler and scheduler.is_running else "⛔ Остановлен"
+        if scheduler and scheduler.next_run_in() is not None:
+            parser_status += f" (следующая проверка в {scheduler.next_run_at.strftime('%H:%M:%S')})"
+            if scheduler.overruns:
+                parser_status += f", перегрузок: {scheduler.overruns}"
         
         status_text = (
             "📊 Текущий статус бота:\n\n"
-            f"📢 Каналов: {len(channels)}\n"
-            f"🔑 Ключевых слов: {len(keywords)}\n"
-            f"🚫 Стоп-слов: {len(stopwords)}\n"
+            f"📢 Каналов: {counts['channels']}\n"
+            f"🔑 Ключевых слов: {counts['keywords']}\n"
+            f"🚫 Стоп-слов: {counts['stopwords']}\n"
             f"⏱ Интервал проверки: {CHECK_INTERVAL} мин.\n"
             f"📍 Целевой канал: {TARGET_CHANNEL_ID}\n"
             f"🤖 Парсер: {parser_status}\n"
         )
+        if scheduler and scheduler.parser.breaker.circuits:
+            status_text += f"🧯 Каналов на карантине: {len(scheduler.parser.breaker.quarantined())} (/quarantine)\n"
         
         account_text = f"👤 Аккаунт: {update.effective_user.id}\n"
         notification_text = f"📣 ID чата для уведомлений:\n{TARGET_CHANNEL_ID}\n"
-        keyword_count = f"🔑 Кол-во ключ-слов: {len(keywords)}\n"
-        stopword_count = f"🚫 Кол-во стоп-слов: {len(stopwords)}"
+        keyword_count = f"🔑 Кол-во ключ-слов: {counts['keywords']}\n"
+        stopword_count = f"🚫 Кол-во стоп-слов: {counts['stopwords']}"
         
         full_text = f"{status_text}\n{account_text}{notification_text}{keyword_count}{stopword_count}"
         
@@ -168,6 +448,438 @@ async def status(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         logger.error(f"Ошибка при получении статуса: {e}")
         await update.message.reply_text(f"❌ Произошла ошибка: {e}")
 
+async def metrics_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Показывает сводку метрик."""
+    await update.message.reply_text(f"📈 Метрики:\n\n{metrics.registry.summary()}")
+
+async def traces_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Показывает задержки по этапам конвейера и самые медленные пересылки."""
+    lines = tracing.tracer.stage_summary()
+    if not lines:
+        await update.message.reply_text("Трассы пока не собраны")
+        return
+    slowest = tracing.tracer.slowest(10)
+    if slowest:
+        lines.append("\n🐢 Самые медленные пересылки:")
+        lines.extend(trace.describe() for trace in slowest)
+    await update.message.reply_text("⏱ Задержки конвейера:\n\n" + "\n".join(lines))
+
+async def lag_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Показывает задержки цикла событий и последние блокировки."""
+    await update.message.reply_text(f"🐢 Цикл событий:\n\n{loop_monitor.summary()}"[:4000])
+
+async def keyword_stats_text(view=None, limit=10):
+    """Статистика ключевых слов: view — top, bottom, never или None (все разделы и каналы)."""
+    stats = await db.get_keyword_stats()
+    if not stats:
+        return "Список ключевых слов пуст."
+    
+    def label(row):
+        return row['keyword'] if row['rule_set'] is None else f"{row['keyword']} ({row['rule_set']})"
+    
+    def line(row):
+        text = f"• {label(row)}: {row['hits']} совп., переслано {row['forwards']}"
+        if row['last_hit_at']:
+            text += f", последнее {row['last_hit_at'].strftime('%Y-%m-%d')}"
+        return text
+    
+    matched = sorted((row for row in stats if row['hits']), key=lambda row: row['hits'], reverse=True)
+    never = [row for row in stats if not row['hits']]
+    lines = [f"📊 Ключевых слов: {len(stats)}, с совпадениями: {len(matched)} (на конец последнего цикла)"]
+    if view in (None, "top") and matched:
+        lines += ["", "🔝 Чаще всего:"] + [line(row) for row in matched[:limit]]
+    if view in (None, "bottom") and matched:
+        lines += ["", "🔻 Реже всего:"] + [line(row) for row in matched[::-1][:limit]]
+    if view in (None, "never"):
+        lines += ["", f"💤 Без совпадений: {len(never)}"] + [f"• {label(row)}" for row in never[:limit]]
+        if len(never) > limit:
+            lines.append(f"...и еще {len(never) - limit} (/hits never {len(never)})")
+    if view is None:
+        channels = await db.get_channel_stats(5)
+        if channels:
+            lines += ["", "📢 Каналы с наибольшим числом совпадений:"]
+            lines += [f"• {row['name'] or row['channel_id']}: {row['hits']} совп., переслано {row['forwards']}"
+                      for row in channels]
+    # Ограничение Telegram на длину сообщения — 4096 символов
+    return "\n".join(lines)[:4000]
+
+async def hits_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Показывает совпадения по ключевым словам: /hits [top|bottom|never] [N]."""
+    args = context.args or []
+    view = args[0].lower() if args else None
+    if view not in (None, "top", "bottom", "never"):
+        await update.message.reply_text("Использование: /hits [top|bottom|never] [количество]")
+        return
+    try:
+        limit = max(1, min(500, int(args[1]))) if len(args) > 1 else (10 if view is None else 30)
+    except ValueError:
+        await update.message.reply_text("❌ Количество должно быть числом")
+        return
+    await update.message.reply_text(await keyword_stats_text(view, limit))
+
+def is_admin(update: Update) -> bool:
+    """Проверяет, входит ли пользователь в ADMIN_IDS."""
+    return bool(update.effective_user) and update.effective_user.id in ADMIN_IDS
+
+async def profile_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Профилирует следующие циклы парсера: /profile [циклов]."""
+    if not is_admin(update):
+        await update.message.reply_text("⛔ Команда доступна только администраторам (ADMIN_IDS)")
+        return
+    if not scheduler or not scheduler.is_running:
+        await update.message.reply_text("⚠️ Парсер не запущен")
+        return
+    if cycle_profiler.armed:
+        await update.message.reply_text(f"⏳ Профилирование уже идет, осталось циклов: {cycle_profiler.remaining}")
+        return
+    try:
+        cycles = max(1, min(10, int(context.args[0]))) if context.args else 1
+    except ValueError:
+        await update.message.reply_text("❌ Количество циклов должно быть числом")
+        return
+    
+    chat_id = update.effective_chat.id
+    
+    async def send_summary(summary, path):
+        # Ограничение Telegram на длину сообщения — 4096 символов
+        text = f"📊 Профиль сохранен: {path}.prof\n\n{summary}"
+        await context.bot.send_message(chat_id, text[:4000])
+    
+    cycle_profiler.arm(cycles, send_summary)
+    await update.message.reply_text(f"⏳ Следующие {cycles} цикл(а) будут профилированы, результат придет в этот чат.")
+
+async def backfill_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Запускает дозагрузку истории канала: /backfill <канал> [дней]."""
+    if not is_admin(update):
+        await update.message.reply_text("⛔ Команда доступна только администраторам (ADMIN_IDS)")
+        return
+    if not context.args:
+        await update.message.reply_text("Использование: /backfill <ID или @username канала> [количество дней]")
+        return
+    if not scheduler:
+        await update.message.reply_text("⚠️ Парсер не запущен")
+        return
+    
+    channel_id = context.args[0]
+    try:
+        days = int(context.args[1]) if len(context.args) > 1 else 7
+    except ValueError:
+        await update.message.reply_text("❌ Количество дней должно быть числом")
+        return
+    if not 1 <= days <= BACKFILL_MAX_DAYS:
+        await update.message.reply_text(f"❌ Количество дней — от 1 до {BACKFILL_MAX_DAYS}")
+        return
+    
+    async def run_backfill():
+        try:
+            backfill = HistoryBackfill(scheduler.parser)
+            scanned, forwarded = await backfill.backfill_channel(channel_id, days=days)
+            await update.message.reply_text(
+                f"✅ Дозагрузка {channel_id} завершена: просмотрено {scanned}, переслано {forwarded}."
+            )
+        except Exception as e:
+            logger.error(f"Ошибка при дозагрузке канала {channel_id}: {e}")
+            await update.message.reply_text(f"❌ Ошибка при дозагрузке канала {channel_id}: {e}")
+    
+    run_in_background(run_backfill())
+    await update.message.reply_text(f"⏳ Дозагрузка истории {channel_id} за {days} дн. запущена в фоне.")
+
+async def audit_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Проверяет состояние всех каналов: /audit [дней без сообщений]."""
+    if not is_admin(update):
+        await update.message.reply_text("⛔ Команда доступна только администраторам (ADMIN_IDS)")
+        return
+    if not scheduler:
+        await update.message.reply_text("⚠️ Парсер не запущен")
+        return
+    try:
+        inactive_days = int(context.args[0]) if context.args else None
+    except ValueError:
+        await update.message.reply_text("❌ Количество дней должно быть числом")
+        return
+    
+    async def run_audit():
+        try:
+            results = await ChannelAudit(scheduler.parser, inactive_days=inactive_days).run()
+            await update.message.reply_text(audit_summary(results)[:4000])
+        except Exception as e:
+            logger.error(f"Ошибка при проверке каналов: {e}")
+            await update.message.reply_text(f"❌ Ошибка при проверке каналов: {e}")
+    
+    run_in_background(run_audit())
+    await update.message.reply_text("⏳ Проверка каналов запущена в фоне.")
+
+RULES_HELP = (
+    "🧩 Наборы правил каналов\n\n"
+    "Канал без подключенных наборов проверяется по общим ключевым и стоп-словам "
+    "(набор default). Изменения применяются со следующего цикла проверки. "
+    "Менять наборы могут только администраторы (ADMIN_IDS), подписку — ее владелец через /my.\n\n"
+    "/rules - Список наборов\n"
+    "/rules add <набор> - Создать набор\n"
+    "/rules del <набор> - Удалить набор\n"
+    "/rules show <набор> - Показать слова и каналы набора\n"
+    "/rules kw <набор> <слова через запятую> - Добавить ключевые слова\n"
+    "/rules stop <набор> <слова через запятую> - Добавить стоп-слова\n"
+    "/rules unkw <набор> <слово> - Удалить ключевое слово\n"
+    "/rules unstop <набор> <слово> - Удалить стоп-слово\n"
+    "/rules attach <набор|default> <канал> [канал ...] - Подключить набор к каналам\n"
+    "/rules detach <набор|default> <канал> [канал ...] - Отключить набор от каналов"
+)
+
+SUBSCRIPTION_HELP = (
+    "📬 Подписка\n\n"
+    "Сообщения отслеживаемых каналов, подходящие под ваши ключевые слова, "
+    "пересылаются в ваш чат. Каналы опрашиваются один раз для всех подписчиков.\n\n"
+    "/subscribe [чат|here] [пересылок в минуту] - Оформить подписку или сменить чат "
+    "(по умолчанию — этот чат; другой чат — только если вы его администратор)\n"
+    "/unsubscribe - Отменить подписку\n"
+    "/my - Показать подписку\n"
+    "/my kw <слова через запятую> - Добавить ключевые слова\n"
+    "/my stop <слова через запятую> - Добавить стоп-слова\n"
+    "/my unkw <слово> - Удалить ключевое слово\n"
+    "/my unstop <слово> - Удалить стоп-слово\n"
+    "/my attach <канал> [канал ...] - Проверять только указанные каналы\n"
+    "/my detach <канал> [канал ...] - Убрать каналы из подписки"
+)
+
+def subscription_name(user_id: int) -> str:
+    """Имя набора правил подписки пользователя."""
+    return f"user:{user_id}"
+
+async def apply_rule_action(update: Update, action: str, name: str, rule_set_id: int, rest: list) -> bool:
+    """Выполняет действие над набором правил. Возвращает False для неизвестного действия."""
+    if action == "del":
+        await db.remove_rule_set(rule_set_id)
+        await update.message.reply_text(f"✅ Набор {name} удален")
+    elif action == "show":
+        rule_set = next(r for r in await db.get_rule_sets() if r['id'] == rule_set_id)
+        channels = [c for c, r in await db.get_rule_set_attachments() if r == rule_set_id]
+        text = f"🧩 Набор {name}\n\n"
+        if rule_set['owner_id'] is not None:
+            limit = rule_set['rate_limit'] or "без ограничения"
+            text += f"📍 Чат: {rule_set['target_chat'] or TARGET_CHANNEL_ID}, пересылок в минуту: {limit}\n"
+        text += (
+            f"🔑 Ключевые слова: {', '.join(rule_set['keywords']) or '—'}\n"
+            f"🚫 Стоп-слова: {', '.join(rule_set['stopwords']) or '—'}\n"
+            f"📢 Каналы: {', '.join(channels) or ('все' if rule_set['owner_id'] is not None else '—')}"
+        )
+        await update.message.reply_text(text[:4000])
+    elif action in ("kw", "stop"):
+        words = [w.strip() for w in " ".join(rest).split(",") if w.strip()]
+        if not words:
+            await update.message.reply_text("❌ Укажите слова через запятую")
+            return True
+        count = await db.add_rule_set_words(rule_set_id, words, stop=action == "stop")
+        kind = "стоп-слов" if action == "stop" else "ключевых слов"
+        await update.message.reply_text(f"✅ В набор {name} добавлено {kind}: {count}")
+    elif action in ("unkw", "unstop"):
+        word = " ".join(rest).strip()
+        removed = await db.remove_rule_set_word(rule_set_id, word, stop=action == "unstop")
+        await update.message.reply_text(f"✅ Слово '{word}' удалено из набора {name}" if removed
+                                        else f"❌ Слова '{word}' нет в наборе {name}")
+    elif action in ("attach", "detach"):
+        if not rest:
+            await update.message.reply_text("❌ Укажите ID или @username каналов")
+            return True
+        known = {str(c['channel_id']) for c in await db.get_channels()}
+        unknown = [c for c in rest if c not in known]
+        if unknown:
+            await update.message.reply_text(f"❌ Каналы не отслеживаются: {', '.join(unknown)}")
+            return True
+        for channel_id in rest:
+            if action == "attach":
+                await db.attach_rule_set(channel_id, rule_set_id)
+            else:
+                await db.detach_rule_set(channel_id, rule_set_id)
+        verb = "подключен к" if action == "attach" else "отключен от"
+        await update.message.reply_text(f"✅ Набор {name} {verb} каналам: {len(rest)}")
+    else:
+        return False
+    return True
+
+async def quarantine_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Показывает каналы на карантине: /quarantine или /quarantine reset <канал>."""
+    if not scheduler:
+        await update.message.reply_text("⚠️ Парсер не запущен")
+        return
+    breaker = scheduler.parser.breaker
+    args = context.args or []
+    if args and args[0].lower() == "reset":
+        if not is_admin(update):
+            await update.message.reply_text("⛔ Команда доступна только администраторам (ADMIN_IDS)")
+            return
+        if len(args) < 2:
+            await update.message.reply_text("Использование: /quarantine reset <ID или @username канала>")
+            return
+        if breaker.reset(args[1]):
+            await update.message.reply_text(f"✅ Карантин канала {args[1]} снят, он будет проверен в следующем цикле.")
+        else:
+            await update.message.reply_text(f"Канал {args[1]} не на карантине.")
+        return
+    
+    quarantined = breaker.quarantined()
+    if not quarantined:
+        await update.message.reply_text("✅ Каналов на карантине нет")
+        return
+    now = time.time()
+    lines = [f"🧯 Каналов на карантине: {len(quarantined)}\n"]
+    for channel_id, circuit in quarantined:
+        lines.append(
+            f"• {channel_id}: {circuit.kind}, ошибок подряд {circuit.failures}, "
+            f"еще {(circuit.open_until - now) / 60:.0f} мин. — {circuit.last_error}"
+        )
+    if breaker.deactivate_days:
+        lines.append(f"\nКаналы с постоянной ошибкой дольше {breaker.deactivate_days:g} дн. отключаются.")
+    await update.message.reply_text("\n".join(lines)[:4000])
+
+async def rules_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Управляет наборами правил каналов: /rules <действие> <набор> [аргументы]."""
+    args = context.args or []
+    action = args[0].lower() if args else "list"
+    try:
+        if action == "list":
+            rule_sets = await db.get_rule_sets()
+            attachments = await db.get_rule_set_attachments()
+            channels_per_set = {}
+            for _, rule_set_id in attachments:
+                channels_per_set[rule_set_id] = channels_per_set.get(rule_set_id, 0) + 1
+            owned = {r['id'] for r in rule_sets if r['owner_id'] is not None}
+            attached = len({channel_id for channel_id, rule_set_id in attachments if rule_set_id not in owned})
+            lines = [
+                f"• default: общие списки, каналов без наборов: {len(await db.get_channels()) - attached}"
+                f" (+{channels_per_set.get(DEFAULT_RULE_SET_ID, 0)} подключено явно)"
+            ]
+            for rule_set in rule_sets:
+                channels = channels_per_set.get(rule_set['id'], 0)
+                if rule_set['id'] in owned:
+                    # Подписка без подключенных каналов действует на все
+                    channels = channels or "все"
+                line = (
+                    f"• {rule_set['name']}: ключевых слов {len(rule_set['keywords'])}, "
+                    f"стоп-слов {len(rule_set['stopwords'])}, каналов {channels}"
+                )
+                if rule_set['id'] in owned:
+                    line += f" → {rule_set['target_chat'] or TARGET_CHANNEL_ID}"
+                lines.append(line)
+            text = "🧩 Наборы правил:\n\n" + "\n".join(lines) + "\n\n/rules help — управление"
+            await update.message.reply_text(text[:4000])
+            return
+        if action == "help" or len(args) < 2:
+            await update.message.reply_text(RULES_HELP)
+            return
+        # Общие наборы и default действуют для всех пользователей: менять их могут
+        # только администраторы, свою подписку пользователь настраивает через /my
+        if action != "show" and not is_admin(update):
+            await update.message.reply_text(
+                "⛔ Наборы правил меняют только администраторы (ADMIN_IDS). Свою подписку настраивайте через /my"
+            )
+            return
+        
+        name = args[1]
+        if action == "add":
+            if name.lower() == "default" or name.lower().startswith("user:"):
+                await update.message.reply_text("❌ Имена default и user:... зарезервированы")
+                return
+            await db.add_rule_set(name)
+            await update.message.reply_text(f"✅ Набор {name} создан")
+            return
+        
+        if action in ("attach", "detach") and name.lower() == "default":
+            rule_set_id = DEFAULT_RULE_SET_ID
+        else:
+            rule_set = await db.get_rule_set(name)
+            if rule_set is None:
+                await update.message.reply_text(f"❌ Набор {name} не найден")
+                return
+            # Чужие подписки видят только администраторы
+            if rule_set['owner_id'] is not None and rule_set['owner_id'] != update.effective_user.id and not is_admin(update):
+                await update.message.reply_text("⛔ Это подписка другого пользователя")
+                return
+            rule_set_id = rule_set['id']
+        
+        if not await apply_rule_action(update, action, name, rule_set_id, args[2:]):
+            await update.message.reply_text(RULES_HELP)
+    except Exception as e:
+        logger.error(f"Ошибка при управлении наборами правил: {e}")
+        await update.message.reply_text(f"❌ Произошла ошибка: {e}")
+
+async def is_chat_admin(entity, user_id) -> bool:
+    """Проверяет через аккаунт парсера, что пользователь администрирует чат."""
+    try:
+        permissions = await scheduler.parser.client.get_permissions(entity, user_id)
+    except Exception as e:
+        logger.warning(f"Не удалось проверить права пользователя {user_id}: {e}")
+        return False
+    return bool(permissions and (permissions.is_admin or permissions.is_creator))
+
+async def subscribe_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Оформляет подписку пользователя: /subscribe [чат|here] [пересылок в минуту].
+    
+    По умолчанию совпадения пересылаются в текущий чат. Другой чат может
+    указать только его администратор (или пользователь из ADMIN_IDS).
+    """
+    args = context.args or []
+    own_chat = str(update.effective_chat.id)
+    target_chat = args[0] if args and args[0].lower() != "here" else own_chat
+    try:
+        rate_limit = max(0, int(args[1])) if len(args) > 1 else None
+    except ValueError:
+        await update.message.reply_text("❌ Лимит пересылок должен быть числом")
+        return
+    try:
+        user_id = update.effective_user.id
+        foreign = target_chat != own_chat and not is_admin(update)
+        if foreign and not (scheduler and scheduler.parser.client):
+            await update.message.reply_text("❌ Сейчас нельзя проверить права на чат, подпишитесь в текущий чат: /subscribe")
+            return
+        # Пересылает аккаунт Telethon, поэтому чат должен быть ему доступен
+        if scheduler and scheduler.parser.client:
+            try:
+                entity = await scheduler.parser.get_channel_entity(target_chat)
+            except Exception as e:
+                await update.message.reply_text(f"❌ Чат {target_chat} недоступен аккаунту парсера: {e}")
+                return
+            if foreign and not await is_chat_admin(entity, user_id):
+                await update.message.reply_text(f"⛔ Пересылать в {target_chat} может только его администратор")
+                return
+        await db.add_rule_set(subscription_name(user_id), owner_id=user_id, target_chat=target_chat, rate_limit=rate_limit)
+        await update.message.reply_text(
+            f"✅ Подписка оформлена, совпадения будут пересылаться в {target_chat}.\n"
+            "Добавьте ключевые слова: /my kw слово1, слово2"
+        )
+    except Exception as e:
+        logger.error(f"Ошибка при оформлении подписки: {e}")
+        await update.message.reply_text(f"❌ Произошла ошибка: {e}")
+
+async def unsubscribe_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Отменяет подписку пользователя."""
+    try:
+        rule_set = await db.get_rule_set(subscription_name(update.effective_user.id))
+        if rule_set is None:
+            await update.message.reply_text("У вас нет подписки")
+            return
+        await db.remove_rule_set(rule_set['id'])
+        await update.message.reply_text("✅ Подписка отменена")
+    except Exception as e:
+        logger.error(f"Ошибка при отмене подписки: {e}")
+        await update.message.reply_text(f"❌ Произошла ошибка: {e}")
+
+async def my_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Управляет словами и каналами подписки пользователя: /my <действие> [аргументы]."""
+    args = context.args or []
+    action = args[0].lower() if args else "show"
+    try:
+        name = subscription_name(update.effective_user.id)
+        rule_set = await db.get_rule_set(name)
+        if rule_set is None:
+            await update.message.reply_text("У вас нет подписки.\n\n" + SUBSCRIPTION_HELP)
+            return
+        if action == "del" or not await apply_rule_action(update, action, name, rule_set['id'], args[1:]):
+            await update.message.reply_text(SUBSCRIPTION_HELP)
+    except Exception as e:
+        logger.error(f"Ошибка при управлении подпиской: {e}")
+        await update.message.reply_text(f"❌ Произошла ошибка: {e}")
+
 async def handle_keyboard_button(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Обрабатывает нажатия на кнопки клавиатуры."""
     text = update.message.text
@@ -211,22 +923,18 @@ async def handle_keyboard_button(update: Update, context: ContextTypes.DEFAULT_T
             "✏️ Введите ID канала для добавления:\n\n"
             "Можно указать:\n"
             "- Числовой ID (начинается с -100...)\n"
-            "- Имя канала (например, @channel_name)\n\n"
+            "- Имя канала (например, @channel_name)\n"
+            "- Несколько каналов через пробел, запятую или с новой строки\n\n"
             "❗️ Важно: для мониторинга каналов через имя (@username) "
             "вам нужно авторизовать Telethon (если еще не сделано)"
         )
     elif text == "❌ Удалить канал":
-        channels = await db.get_channels()
-        if not channels:
+        page_text, reply_markup = await render_page("ch")
+        if not page_text:
             await update.message.reply_text("Список каналов пуст.", reply_markup=get_channels_keyboard())
             return
             
-        keyboard = []
-        for channel in channels:
-            keyboard.append([InlineKeyboardButton(f"ID: {channel['channel_id']}", callback_data=f"del_channel_{channel['channel_id']}")])
-        
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        await update.message.reply_text("Выберите канал для удаления:", reply_markup=reply_markup)
+        await update.message.reply_text(page_text, reply_markup=reply_markup)
     elif text == "📋 Список каналов":
         await list_channels(update, context)
     elif text == "❌ Удалить все слова ❌":
@@ -244,29 +952,51 @@ async def handle_keyboard_button(update: Update, context: ContextTypes.DEFAULT_T
             ]
             reply_markup = InlineKeyboardMarkup(keyboard)
             await update.message.reply_text("Вы уверены, что хотите удалить ВСЕ стоп-слова?", reply_markup=reply_markup)
+    elif text == "📥 Импорт из файла":
+        if "keyword_menu" in context.user_data:
+            context.user_data["waiting_for"] = "import_keywords"
+        elif "stopword_menu" in context.user_data:
+            context.user_data["waiting_for"] = "import_stopwords"
+        else:
+            return
+        await update.message.reply_text("Отправьте файл .txt (одно слово в строке) или .csv (слово в первой колонке).")
+    elif text == "📥 Импорт каналов":
+        context.user_data["waiting_for"] = "import_channels"
+        await update.message.reply_text("Отправьте файл .txt (один канал в строке) или .csv (channel_id;name).")
+    elif text == "📤 Экспорт в файл":
+        if "keyword_menu" in context.user_data:
+            await export_list(update, "keywords")
+        elif "stopword_menu" in context.user_data:
+            await export_list(update, "stopwords")
+    elif text == "📤 Экспорт каналов":
+        await export_list(update, "channels")
+    elif text == "📊 Статистика слов":
+        await update.message.reply_text(await keyword_stats_text(), reply_markup=get_keywords_keyboard())
     elif text == "🔄 Сортировать по дате 🔄":
         await update.message.reply_text("Сортировка по дате пока не реализована.", 
                                       reply_markup=get_status_keyboard(scheduler and scheduler.is_running))
     elif text == "📋 Копировать все слова 📋":
         if "keyword_menu" in context.user_data:
-            keywords = await db.get_keywords()
-            if not keywords:
+            page_text, reply_markup = await render_page("kwc")
+            if not page_text:
                 await update.message.reply_text("Список ключевых слов пуст.", reply_markup=get_keywords_keyboard())
                 return
                 
-            keywords_text = "\n".join(keywords)
-            await update.message.reply_text(f"Список ключевых слов:\n\n{keywords_text}", reply_markup=get_keywords_keyboard())
+            await update.message.reply_text(page_text, reply_markup=reply_markup or get_keywords_keyboard())
         elif "stopword_menu" in context.user_data:
-            stopwords = await db.get_stopwords()
-            if not stopwords:
+            page_text, reply_markup = await render_page("swc")
+            if not page_text:
                 await update.message.reply_text("Список стоп-слов пуст.", reply_markup=get_stopwords_keyboard())
                 return
                 
-            stopwords_text = "\n".join(stopwords)
-            await update.message.reply_text(f"Список стоп-слов:\n\n{stopwords_text}", reply_markup=get_stopwords_keyboard())
+            await update.message.reply_text(page_text, reply_markup=reply_markup or get_stopwords_keyboard())
     elif text == "🔍 Показать доступные каналы":
-        # Получаем список доступных каналов через Telethon
+        # Показываем список доступных каналов из локального индекса
+        context.user_data.pop("dialog_search", None)
         await get_available_channels(update, context)
+    elif text == "🔎 Поиск каналов":
+        context.user_data["waiting_for"] = "dialog_search"
+        await update.message.reply_text("Введите часть названия канала для поиска:")
     elif text == "🔐 Авторизовать Telethon":
         # Проверяем, авторизован ли уже клиент
         if await is_telethon_authorized():
@@ -291,9 +1021,12 @@ async def handle_input(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
     
     if waiting_for == "keyword":
         try:
-            await db.add_keyword(text)
+            added = await db.add_keyword(text)
             await update.message.reply_text(f"✅ Ключевое слово '{text}' добавлено.", reply_markup=get_keywords_keyboard())
             context.user_data.pop("waiting_for", None)
+            # Проверяем по архиву уже полученных сообщений только действительно новое слово
+            if added and scheduler and scheduler.parser.archive_enabled:
+                run_in_background(retro_match_keyword(update, text))
         except Exception as e:
             await update.message.reply_text(f"❌ Ошибка: {e}", reply_markup=get_keywords_keyboard())
             context.user_data.pop("waiting_for", None)
@@ -306,6 +1039,12 @@ async def handle_input(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
             await update.message.reply_text(f"❌ Ошибка: {e}", reply_markup=get_stopwords_keyboard())
             context.user_data.pop("waiting_for", None)
     elif waiting_for == "channel":
+        # Несколько каналов в одном сообщении добавляются как список
+        items = parse_channel_list(text)
+        if len(items) > 1:
+            context.user_data.pop("waiting_for", None)
+            await onboard_channels(update, items)
+            return
         try:
             # Проверяем, начинается ли ввод с '@' (имя канала)
             if text.startswith('@'):
@@ -342,11 +1081,30 @@ async def handle_input(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
         if success:
             context.user_data.pop("waiting_for", None)
             await update.message.reply_text("✅ Теперь вы можете использовать 'Показать доступные каналы'", reply_markup=get_channels_keyboard())
+    elif waiting_for == "dialog_search":
+        context.user_data.pop("waiting_for", None)
+        context.user_data["dialog_search"] = text.strip()
+        await get_available_channels(update, context)
+    elif waiting_for.startswith("import_"):
+        # Вместо файла пришел текст: отменяем импорт и обрабатываем как кнопку
+        context.user_data.pop("waiting_for", None)
+        await handle_keyboard_button(update, context)
     else:
         # Сбрасываем состояние ожидания для неизвестных состояний
         context.user_data.pop("waiting_for", None)
         await update.message.reply_text("❓ Неизвестное состояние ожидания. Пожалуйста, попробуйте снова.")
 
+async def retro_match_keyword(update: Update, keyword: str) -> None:
+    """Проверяет новое ключевое слово по архиву сообщений и сообщает результат."""
+    try:
+        found, forwarded = await scheduler.parser.retro_match(keyword)
+        if found:
+            await update.message.reply_text(
+                f"🗄 Проверка архива для '{keyword}': найдено кандидатов {found}, переслано {forwarded}."
+            )
+    except Exception as e:
+        logger.error(f"Ошибка при проверке архива для ключевого слова '{keyword}': {e}")
+
 async def handle_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Обрабатывает нажатия на inline-кнопки."""
     query = update.callback_query
@@ -354,40 +1112,62 @@ async def handle_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
     
     data = query.data
     
-    if data.startswith("del_channel_"):
-        channel_id = int(data.replace("del_channel_", ""))
+    if data.startswith("page_"):
+        # Переход по страницам: page_<вид>_<n|p>_<id>
+        _, kind, direction, row_id = data.split("_", 3)
+        row_id = int(row_id)
+        search = context.user_data.get("dialog_search") if kind == "dl" else None
+        if direction == "n":
+            page_text, reply_markup = await render_page(kind, after_id=row_id, search=search)
+        else:
+            page_text, reply_markup = await render_page(kind, before_id=row_id, search=search)
+        if page_text:
+            await query.edit_message_text(page_text, reply_markup=reply_markup)
+    elif data.startswith("adddl_"):
+        try:
+            dialog = await db.get_dialog(int(data.replace("adddl_", "")))
+            if not dialog:
+                await query.edit_message_text("❌ Канал не найден в индексе, обновите список.")
+                return
+            await db.add_channel(dialog['channel_id'], dialog['title'])
+            await query.edit_message_text(f"✅ Канал {dialog['title']} ({dialog['channel_id']}) добавлен в список мониторинга.")
+        except Exception as e:
+            await query.edit_message_text(f"❌ Ошибка при добавлении канала: {e}")
+    elif data == "dl_refresh":
         try:
-            await db.remove_channel(channel_id)
+            await query.edit_message_text("🔄 Обновляем список доступных каналов...")
+            total = await dialog_index.refresh()
+            page_text, reply_markup = await render_page("dl", search=context.user_data.get("dialog_search"))
+            await query.edit_message_text(page_text or f"❕ Каналов не найдено (всего в индексе: {total}).", reply_markup=reply_markup)
+        except Exception as e:
+            await query.edit_message_text(f"❌ Ошибка при обновлении списка каналов: {e}")
+    elif data.startswith("delch_"):
+        try:
+            channel_id = await db.remove_channel_by_id(int(data.replace("delch_", "")))
             await query.edit_message_text(f"✅ Канал {channel_id} удален из списка мониторинга.")
         except Exception as e:
             await query.edit_message_text(f"❌ Ошибка при удалении канала: {e}")
-    elif data.startswith("del_keyword_"):
-        keyword = data.replace("del_keyword_", "")
+    elif data.startswith("delkw_"):
         try:
-            await db.remove_keyword(keyword)
+            keyword = await db.remove_keyword_by_id(int(data.replace("delkw_", "")))
             await query.edit_message_text(f"✅ Ключевое слово '{keyword}' удалено.")
         except Exception as e:
             await query.edit_message_text(f"❌ Ошибка при удалении ключевого слова: {e}")
-    elif data.startswith("del_stopword_"):
-        stopword = data.replace("del_stopword_", "")
+    elif data.startswith("delsw_"):
         try:
-            await db.remove_stopword(stopword)
+            stopword = await db.remove_stopword_by_id(int(data.replace("delsw_", "")))
             await query.edit_message_text(f"✅ Стоп-слово '{stopword}' удалено.")
         except Exception as e:
             await query.edit_message_text(f"❌ Ошибка при удалении стоп-слова: {e}")
     elif data == "confirm_delete_all_keywords":
         try:
-            keywords = await db.get_keywords()
-            for keyword in keywords:
-                await db.remove_keyword(keyword)
+            await db.remove_all_keywords()
             await query.edit_message_text("✅ Все ключевые слова удалены.")
         except Exception as e:
             await query.edit_message_text(f"❌ Ошибка при удалении ключевых слов: {e}")
     elif data == "confirm_delete_all_stopwords":
         try:
-            stopwords = await db.get_stopwords()
-            for stopword in stopwords:
-                await db.remove_stopword(stopword)
+            await db.remove_all_stopwords()
             await query.edit_message_text("✅ Все стоп-слова удалены.")
         except Exception as e:
             await query.edit_message_text(f"❌ Ошибка при удалении стоп-слов: {e}")
@@ -400,18 +1180,13 @@ async def show_keywords(update: Update, context: ContextTypes.DEFAULT_TYPE) -> N
     context.user_data.pop("stopword_menu", None)
     
     try:
-        keywords = await db.get_keywords()
+        page_text, reply_markup = await render_page("kw")
         
-        if not keywords:
+        if not page_text:
             await update.message.reply_text("📋 Список ключевых слов пуст.", reply_markup=get_keywords_keyboard())
             return
         
-        keyboard = []
-        for keyword in keywords:
-            keyboard.append([InlineKeyboardButton(f"❌ {keyword}", callback_data=f"del_keyword_{keyword}")])
-        
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        await update.message.reply_text("📋 Список ключевых слов:", reply_markup=reply_markup)
+        await update.message.reply_text(page_text, reply_markup=reply_markup)
         await update.message.reply_text("Выберите действие:", reply_markup=get_keywords_keyboard())
     except Exception as e:
         logger.error(f"Ошибка при получении списка ключевых слов: {e}")
@@ -423,18 +1198,13 @@ async def show_stopwords(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
     context.user_data.pop("keyword_menu", None)
     
     try:
-        stopwords = await db.get_stopwords()
+        page_text, reply_markup = await render_page("sw")
         
-        if not stopwords:
+        if not page_text:
             await update.message.reply_text("📋 Список стоп-слов пуст.", reply_markup=get_stopwords_keyboard())
             return
         
-        keyboard = []
-        for stopword in stopwords:
-            keyboard.append([InlineKeyboardButton(f"❌ {stopword}", callback_data=f"del_stopword_{stopword}")])
-        
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        await update.message.reply_text("📋 Список стоп-слов:", reply_markup=reply_markup)
+        await update.message.reply_text(page_text, reply_markup=reply_markup)
         await update.message.reply_text("Выберите действие:", reply_markup=get_stopwords_keyboard())
     except Exception as e:
         logger.error(f"Ошибка при получении списка стоп-слов: {e}")
@@ -447,20 +1217,13 @@ async def show_channels(update: Update, context: ContextTypes.DEFAULT_TYPE) -> N
 async def list_channels(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Показывает список каналов для мониторинга."""
     try:
-        channels = await db.get_channels()
+        page_text, reply_markup = await render_page("chl")
         
-        if not channels:
+        if not page_text:
             await update.message.reply_text("📋 Список каналов пуст.", reply_markup=get_channels_keyboard())
             return
         
-        channels_text = "📋 Список отслеживаемых каналов:\n\n"
-        for i, channel in enumerate(channels, 1):
-            channels_text += f"{i}. ID: {channel['channel_id']}"
-            if channel['name']:
-                channels_text += f" ({channel['name']})"
-            channels_text += "\n"
-        
-        await update.message.reply_text(channels_text, reply_markup=get_channels_keyboard())
+        await update.message.reply_text(page_text, reply_markup=reply_markup or get_channels_keyboard())
     except Exception as e:
         logger.error(f"Ошибка при получении списка каналов: {e}")
         await update.message.reply_text(f"❌ Произошла ошибка: {e}", reply_markup=get_channels_keyboard())
@@ -513,61 +1276,15 @@ async def init_database():
             return False
             
         # Проверяем и мигрируем схему базы данных
-        await migrate_database_schema()
+        await db.migrate_schema()
             
         return True
     except Exception as e:
         logger.error(f"Ошибка при подключении к базе данных: {e}")
         return False
 
-async def migrate_database_schema():
-    """Проверяет и мигрирует схему базы данных."""
-    try:
-        async with db.pool.acquire() as conn:
-            # Проверяем текущий тип channel_id в таблице channels
-            table_info = await conn.fetch("""
-                SELECT column_name, data_type 
-                FROM information_schema.columns 
-                WHERE table_name = 'channels' AND column_name = 'channel_id'
-            """)
-            
-            if table_info and table_info[0]['data_type'] == 'bigint':
-                logger.info("Миграция схемы: изменение типа channel_id с BIGINT на TEXT")
-                
-                # Создаем временную таблицу с новой схемой
-                await conn.execute("""
-                    CREATE TABLE channels_temp (
-                        id SERIAL PRIMARY KEY,
-                        channel_id TEXT UNIQUE NOT NULL,
-                        name TEXT,
-                        is_active BOOLEAN DEFAULT TRUE
-                    )
-                """)
-                
-                # Копируем данные со преобразованием
-                await conn.execute("""
-                    INSERT INTO channels_temp (id, channel_id, name, is_active)
-                    SELECT id, CAST(channel_id AS TEXT), name, is_active FROM channels
-                """)
-                
-                # Удаляем старую таблицу и переименовываем новую
-                await conn.execute("DROP TABLE channels")
-                await conn.execute("ALTER TABLE channels_temp RENAME TO channels")
-                
-                logger.info("Миграция схемы успешно завершена")
-    except Exception as e:
-        logger.error(f"Ошибка при миграции схемы базы данных: {e}")
-        # Продолжаем работу, даже если миграция не удалась
-
 async def main_async():
     """Асинхронная функция для запуска бота."""
-    # Подключаемся к базе данных
-    if not await init_database():
-        return
-    
-    # Инициализируем Telethon клиент
-    await init_telethon()
-        
     # Создаем экземпляр приложения
     application = Application.builder().token(BOT_TOKEN).build()
 
@@ -575,15 +1292,48 @@ async def main_async():
     application.add_handler(CommandHandler("start", start))
     application.add_handler(CommandHandler("help", help_command))
     application.add_handler(CommandHandler("status", status))
+    application.add_handler(CommandHandler("backfill", backfill_command))
+    application.add_handler(CommandHandler("audit", audit_command))
+    application.add_handler(CommandHandler("metrics", metrics_command))
+    application.add_handler(CommandHandler("traces", traces_command))
+    application.add_handler(CommandHandler("profile", profile_command))
+    application.add_handler(CommandHandler("lag", lag_command))
+    application.add_handler(CommandHandler("rules", rules_command))
+    application.add_handler(CommandHandler("subscribe", subscribe_command))
+    application.add_handler(CommandHandler("unsubscribe", unsubscribe_command))
+    application.add_handler(CommandHandler("my", my_command))
+    application.add_handler(CommandHandler("hits", hits_command))
+    application.add_handler(CommandHandler("quarantine", quarantine_command))
     
     # Добавляем обработчик для кнопок клавиатуры
     application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_input))
     
+    # Добавляем обработчик для загрузки файлов (импорт списков)
+    application.add_handler(MessageHandler(filters.Document.ALL, handle_document))
+    
     # Добавляем обработчик для inline-кнопок
     application.add_handler(CallbackQueryHandler(handle_callback))
     
+    # Подключение к базе, Telethon и Bot API не зависят друг от друга,
+    # поэтому выполняются одновременно; сессия Telethon в базе
+    # (TELETHON_SESSION_STORE=database) загружается после подключения к ней
+    if config.TELETHON_SESSION_STORE.lower() == "database":
+        db_ready, _ = await asyncio.gather(init_database(), application.initialize())
+        if db_ready:
+            await init_telethon()
+    else:
+        db_ready, _, _ = await asyncio.gather(init_database(), init_telethon(), application.initialize())
+    if not db_ready:
+        await application.shutdown()
+        await telethon_session.close_clients()
+        return
+    
+    # Подключаем индекс диалогов и при необходимости обновляем его в фоне
+    if await is_telethon_authorized():
+        dialog_index.attach(telethon_client)
+        run_in_background(dialog_index.refresh_if_stale())
+    
     # Запускаем бота
-    await application.initialize()
     await application.start()
     
     # Запускаем поллинг
@@ -591,6 +1341,12 @@ async def main_async():
     
     logger.info("Бот успешно запущен!")
     
+    # Запускаем HTTP-listener метрик (METRICS_PORT=0 отключает его)
+    metrics_server = await metrics.start_metrics_server()
+    
+    # Измеряем задержки цикла событий, общего для бота, парсера и Telethon
+    loop_monitor.start()
+    
     # Запускаем парсер в автоматическом режиме
     global scheduler
     if not scheduler:
@@ -601,6 +1357,15 @@ async def main_async():
             "",
             telethon_client=telethon_client
         )
+    
+    # Восстанавливаем теплое состояние до первого цикла
+    snapshot = WarmStateSnapshot()
+    snapshot.load(scheduler.parser)
+    snapshot_task = asyncio.create_task(snapshot.run_periodic(scheduler.parser))
+    
+    # Правки сообщений в опрашиваемых каналах проверяются сразу по событиям
+    if await is_telethon_authorized():
+        scheduler.parser.attach_edit_events(telethon_client)
         
     scheduler.start()
     logger.info("Парсер запущен автоматически в боевом режиме!")
@@ -611,13 +1376,28 @@ async def main_async():
         stop_event = asyncio.Event()
         await stop_event.wait()
     finally:
+        # Останавливаем парсер до закрытия базы и записываем счетчики совпадений
+        await scheduler.shutdown()
+        # Сохраняем теплое состояние для следующего запуска
+        snapshot_task.cancel()
+        try:
+            snapshot.save(scheduler.parser)
+        except Exception as e:
+            logger.error(f"Ошибка при сохранении снимка состояния: {e}")
+        # Закрываем ленту записи сообщений (TAPE_PATH)
+        if scheduler.parser.tape:
+            scheduler.parser.tape.close()
+        loop_monitor.stop()
         # Останавливаем бота
         await application.stop()
+        # Останавливаем listener метрик
+        if metrics_server:
+            metrics_server.close()
+        # Закрываем Telethon клиент и записываем его сессию (до закрытия базы,
+        # если сессия хранится в ней)
+        await telethon_session.close_clients()
         # Закрываем соединение с базой данных
         await db.close()
-        # Закрываем Telethon клиент
-        if telethon_client:
-            await telethon_client.disconnect()
 
 def main() -> None:
     """Запускает бота."""
@@ -642,21 +1422,8 @@ async def init_telethon():
         return None
         
     try:
-        # Преобразуем API_ID в число
-        api_id = int(TELEGRAM_API_ID)
-        
-        # Создаем клиент Telethon с дополнительными параметрами
-        telethon_client = TelegramClient(
-            'telegram_parser_session', 
-            api_id, 
-            TELEGRAM_API_HASH,
-            device_model="Windows Desktop",
-            system_version="4.16.30-vxCUSTOM",
-            app_version="1.0.0"
-        )
-        
-        # Подключаемся
-        await telethon_client.connect()
+        # Общий клиент аккаунта: тот же получает парсер
+        telethon_client = await telethon_session.get_client(db=db)
         
         logger.info("Telethon клиент инициализирован")
         return telethon_client
@@ -773,7 +1540,7 @@ async def sign_in_with_2fa(update: Update, context: ContextTypes.DEFAULT_TYPE, p
         return False
 
 async def get_available_channels(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Получает список доступных каналов через Telethon."""
+    """Показывает доступные через Telethon каналы из локального индекса."""
     global telethon_client
     
     if not telethon_client:
@@ -792,36 +1559,23 @@ async def get_available_channels(update: Update, context: ContextTypes.DEFAULT_T
         return
         
     try:
-        # Получаем диалоги
-        await update.message.reply_text("🔍 Получаем список каналов, пожалуйста, подождите...")
-        
-        dialogs = await telethon_client.get_dialogs(limit=50)
+        dialog_index.attach(telethon_client)
         
-        # Выбираем только каналы
-        channels = [d for d in dialogs if d.is_channel]
+        # Индекс заполняется один раз, дальше обновляется по событиям и в фоне
+        if await db.get_dialogs_updated_at() is None:
+            await update.message.reply_text("🔍 Получаем список каналов, пожалуйста, подождите...")
+            await dialog_index.refresh()
+        elif await dialog_index.is_stale():
+            run_in_background(dialog_index.refresh_if_stale())
         
-        if not channels:
+        page_text, reply_markup = await render_page("dl", search=context.user_data.get("dialog_search"))
+        if not page_text:
             await update.message.reply_text("❕ Не найдено каналов, доступных через ваш аккаунт.")
             return
-            
-        # Отправляем список каналов
-        message = "📋 Доступные каналы через ваш аккаунт:\n\n"
-        for i, dialog in enumerate(channels, 1):
-            channel_id = dialog.id
-            name = dialog.title
-            message += f"{i}. ID: {channel_id} - {name}\n"
-            
-            # Если сообщение становится слишком длинным, отправляем его и начинаем новое
-            if len(message) > 3500:
-                await update.message.reply_text(message)
-                message = ""
-                
-        if message:
-            await update.message.reply_text(message)
-            
-        # Предлагаем добавить каналы
+        
+        await update.message.reply_text(page_text, reply_markup=reply_markup)
         await update.message.reply_text(
-            "✅ Для добавления канала выберите 'Добавить канал' и введите ID канала из списка.",
+            "✅ Нажмите на канал со значком ➕, чтобы добавить его в мониторинг.",
             reply_markup=get_channels_keyboard()
         )
         
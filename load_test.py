@@ -0,0 +1,121 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Нагрузочный тест парсера на локальной замене Telegram (fake_telegram.py)
+
+Прогоняет полный путь run → process_channel → forward_message без обращения
+к настоящему API и выводит длительность циклов, пропускную способность и
+задержку от публикации до пересылки.
+
+Пример запуска:
+    python load_test.py --channels 500 --cycles 5 --interval 10
+    python load_test.py --channels 100 --flood-rate 0.02 --flood-seconds 3
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+from loguru import logger
+from sqlite_database import SQLiteDatabase
+from parser import MessageParser
+from fake_telegram import FakeTelegramClient
+from metrics import percentile
+
+
+async def run_load_test(args):
+    db_path = args.db or os.path.join(tempfile.mkdtemp(), "load_test.db")
+    db = SQLiteDatabase(db_path)
+    if not await db.connect():
+        print("Не удалось открыть базу данных для теста")
+        return
+
+    keywords = [k.strip() for k in args.keywords.split(",") if k.strip()]
+    client = FakeTelegramClient(
+        channels=args.channels, rate=args.rate, latency_ms=args.latency_ms, latency_sigma=args.latency_sigma,
+        flood_rate=args.flood_rate, flood_seconds=args.flood_seconds, keywords=keywords,
+        keyword_rate=args.keyword_rate, seed=args.seed
+    )
+
+    try:
+        await db.add_channels([(channel_id, f"Тестовый канал {channel_id}") for channel_id in client.channel_ids()])
+        await db.add_keywords(keywords)
+        # Подписчики со своими словами и чатами: каналы опрашиваются один раз для всех
+        targets = client.channel_ids()
+        for i in range(args.subscribers):
+            rule_set_id = await db.add_rule_set(f"user:{i + 1}", owner_id=i + 1, target_chat=targets[i % len(targets)])
+            await db.add_rule_set_words(rule_set_id, [keywords[i % len(keywords)]])
+
+        parser = MessageParser(db, client.target_id(), telethon_client=client)
+        parser.max_channels_per_run = args.channels
+        parser.delay_between_channels = 0
+        parser.delay_scale = args.delay_scale
+
+        print(f"Каналов: {args.channels}, публикаций: {args.rate}/мин на канал, "
+              f"задержка API: {args.latency_ms} мс, FloodWait: {args.flood_rate:.1%}, подписчиков: {args.subscribers}")
+        print(f"{'цикл':>4} {'время, с':>9} {'каналов/с':>10} {'вызовов API':>12} {'переслано':>10}")
+
+        cycle_times = []
+        started = time.perf_counter()
+        for cycle in range(1, args.cycles + 1):
+            calls_before = sum(client.calls.values())
+            forwarded_before = len(client.forwarded)
+            cycle_started = time.perf_counter()
+            await parser.run()
+            elapsed = time.perf_counter() - cycle_started
+            cycle_times.append(elapsed)
+            print(f"{cycle:>4} {elapsed:>9.2f} {args.channels / elapsed:>10.1f} "
+                  f"{sum(client.calls.values()) - calls_before:>12} {len(client.forwarded) - forwarded_before:>10}")
+            if cycle < args.cycles and args.interval:
+                await asyncio.sleep(args.interval)
+        total = time.perf_counter() - started
+
+        latencies = [(forwarded_at - published).total_seconds() for published, forwarded_at in client.forwarded]
+        print()
+        print(f"Циклы: среднее {sum(cycle_times) / len(cycle_times):.2f} с, "
+              f"p95 {percentile(cycle_times, 0.95):.2f} с, максимум {max(cycle_times):.2f} с")
+        print(f"Пропускная способность: {sum(client.calls.values()) / total:.1f} вызовов API/с, "
+              f"{len(client.forwarded) / total:.2f} пересылок/с")
+        print(f"Вызовы API: {dict(sorted(client.calls.items()))}, FloodWait: {client.flood_waits}")
+        if latencies:
+            print(f"Публикация → пересылка ({len(latencies)}): p50 {percentile(latencies, 0.5):.1f} с, "
+                  f"p95 {percentile(latencies, 0.95):.1f} с, максимум {max(latencies):.1f} с")
+    finally:
+        await db.close()
+
+
+def main():
+    """Запускает нагрузочный тест."""
+    arg_parser = argparse.ArgumentParser(description="Нагрузочный тест парсера на локальной замене Telegram")
+    arg_parser.add_argument("--channels", type=int, default=100, help="Количество каналов")
+    arg_parser.add_argument("--cycles", type=int, default=3, help="Количество циклов проверки")
+    arg_parser.add_argument("--interval", type=float, default=5.0, help="Пауза между циклами, сек.")
+    arg_parser.add_argument("--rate", type=float, default=2.0, help="Публикаций в минуту на канал")
+    arg_parser.add_argument("--latency-ms", type=float, default=50.0, help="Медиана задержки вызова API, мс")
+    arg_parser.add_argument("--latency-sigma", type=float, default=0.5, help="Разброс задержки (логнормальное распределение)")
+    arg_parser.add_argument("--flood-rate", type=float, default=0.0, help="Доля вызовов с FloodWaitError")
+    arg_parser.add_argument("--flood-seconds", type=int, default=2, help="Длительность FloodWait, сек.")
+    arg_parser.add_argument("--keywords", default="сша,санкции+экспорт", help="Ключевые слова через запятую")
+    arg_parser.add_argument("--keyword-rate", type=float, default=0.05, help="Доля сообщений с ключевым словом")
+    arg_parser.add_argument("--subscribers", type=int, default=0, help="Количество подписчиков со своими чатами")
+    arg_parser.add_argument("--delay-scale", type=float, default=0.0, help="Множитель защитных задержек парсера")
+    arg_parser.add_argument("--db", default=None, help="Файл SQLite (по умолчанию временный)")
+    arg_parser.add_argument("--seed", type=int, default=None, help="Зерно генератора случайных чисел")
+    arg_parser.add_argument("--log-level", default="WARNING", help="Уровень логов парсера")
+    args = arg_parser.parse_args()
+
+    # Подробные логи парсера искажают замер, оставляем только предупреждения
+    logger.remove()
+    logger.add(sys.stderr, level=args.log_level)
+
+    try:
+        asyncio.run(run_load_test(args))
+    except KeyboardInterrupt:
+        print("Тест остановлен пользователем")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,141 @@
+import asyncio
+import logging
+import os
+import sys
+import threading
+import time
+import traceback
+from collections import deque
+from datetime import datetime
+import metrics
+
+logger = logging.getLogger(__name__)
+
+LOOP_LAG_SECONDS = metrics.registry.histogram(
+    "event_loop_lag_seconds", "Задержка планирования цикла событий",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+)
+LOOP_STALLS = metrics.registry.counter("event_loop_stalls_total", "Блокировки цикла событий дольше порога", ("stage",))
+
+
+class Stall:
+    """Блокировка цикла событий: длительность, этап парсера и стек блокирующего кода."""
+
+    __slots__ = ("at", "lag", "stage", "stack")
+
+    def __init__(self, at, lag, stage, stack):
+        self.at = at
+        self.lag = lag
+        self.stage = stage
+        self.stack = stack
+
+    def describe(self, frames=4):
+        """Короткое описание с несколькими верхними кадрами стека."""
+        lines = [f"{self.at.strftime('%H:%M:%S')} {self.lag * 1000:.0f} мс, этап: {self.stage}"]
+        for frame in self.stack[-frames:]:
+            lines.append(f"  {os.path.basename(frame.filename)}:{frame.lineno} {frame.name}")
+        return "\n".join(lines)
+
+
+class LoopLagMonitor:
+    """Измеряет задержку планирования asyncio и находит блокирующий код.
+
+    Задача в цикле событий каждые interval секунд засыпает и измеряет, на
+    сколько позже заказанного она проснулась, — это задержка планирования,
+    она попадает в гистограмму event_loop_lag_seconds. Отдельный поток-сторож
+    следит за отметкой последнего пробуждения: если цикл не отвечает дольше
+    threshold, сторож снимает стек потока цикла (то есть код, который его
+    сейчас блокирует) и текущий этап парсера. Когда цикл освобождается,
+    блокировка записывается с фактической длительностью.
+    """
+
+    def __init__(self, threshold=None, interval=None, stage_provider=None, keep=50):
+        """Инициализирует монитор.
+
+        Args:
+            threshold: Порог блокировки в секундах
+            interval: Период измерения в секундах
+            stage_provider: Функция, возвращающая текущий этап парсера
+            keep: Сколько последних блокировок хранить
+        """
+        self.threshold = float(threshold if threshold is not None else os.getenv("LOOP_LAG_THRESHOLD", "0.25"))
+        self.interval = float(interval if interval is not None else os.getenv("LOOP_LAG_INTERVAL", "0.1"))
+        self.stage_provider = stage_provider
+        self.stalls = deque(maxlen=keep)
+        self._heartbeat = time.monotonic()
+        self._captured = None
+        self._task = None
+        self._watchdog = None
+        self._stopped = threading.Event()
+        self._loop_thread_id = None
+
+    def _stage(self):
+        try:
+            return self.stage_provider() if self.stage_provider else "неизвестно"
+        except Exception:
+            return "неизвестно"
+
+    def start(self):
+        """Запускает измерение в текущем цикле событий и поток-сторож."""
+        if self._task:
+            return
+        self._loop_thread_id = threading.get_ident()
+        self._heartbeat = time.monotonic()
+        self._stopped.clear()
+        self._task = asyncio.get_running_loop().create_task(self._run())
+        self._watchdog = threading.Thread(target=self._watch, name="loop-lag-watchdog", daemon=True)
+        self._watchdog.start()
+        logger.info(f"Монитор задержек цикла событий запущен (порог {self.threshold * 1000:.0f} мс)")
+
+    def stop(self):
+        self._stopped.set()
+        if self._task:
+            self._task.cancel()
+            self._task = None
+
+    async def _run(self):
+        while True:
+            expected = time.monotonic() + self.interval
+            await asyncio.sleep(self.interval)
+            now = time.monotonic()
+            self._heartbeat = now
+            lag = max(0.0, now - expected)
+            LOOP_LAG_SECONDS.observe(lag)
+
+            if lag >= self.threshold:
+                captured, self._captured = self._captured, None
+                stage, stack = captured if captured else (self._stage(), [])
+                stall = Stall(datetime.now(), lag, stage, stack)
+                self.stalls.append(stall)
+                LOOP_STALLS.inc(stage=stage.split(" ")[0])
+                logger.warning(f"Цикл событий был заблокирован: {stall.describe(frames=8)}")
+            else:
+                self._captured = None
+
+    def _watch(self):
+        """Поток-сторож: снимает стек цикла событий, пока тот заблокирован."""
+        check = max(0.01, self.threshold / 2)
+        while not self._stopped.wait(check):
+            heartbeat = self._heartbeat
+            if self._captured is not None or time.monotonic() - heartbeat < self.threshold + self.interval:
+                continue
+            frame = sys._current_frames().get(self._loop_thread_id)
+            if frame is None or self._heartbeat != heartbeat:
+                continue
+            self._captured = (self._stage(), traceback.extract_stack(frame))
+
+    def summary(self, limit=5):
+        """Сводка для бота: квантили задержки и последние блокировки."""
+        count, total = LOOP_LAG_SECONDS.total()
+        if not count:
+            return "Задержки цикла событий пока не измерены"
+        lines = [
+            f"Задержка планирования: avg={total / count * 1000:.1f} мс, "
+            f"p95≤{LOOP_LAG_SECONDS.quantile(0.95) * 1000:.0f} мс, "
+            f"p99≤{LOOP_LAG_SECONDS.quantile(0.99) * 1000:.0f} мс, n={count}",
+            f"Блокировок дольше {self.threshold * 1000:.0f} мс: {len(self.stalls)}",
+        ]
+        for stall in list(self.stalls)[-limit:]:
+            lines.append("")
+            lines.append(stall.describe())
+        return "\n".join(lines)
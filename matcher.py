@@ -0,0 +1,331 @@
+import re
+from functools import lru_cache
+
+# Слова (в том числе с дефисом/апострофом и хэштеги) и отдельные эмодзи
+TOKEN_RE = re.compile(
+    r"#?\w+(?:['’\-]\w+)*"
+    r"|[\U0001F000-\U0001FAFF\u2600-\u27BF\u2B00-\u2BFF]"
+)
+
+
+def normalize(text):
+    """Приводит текст к виду для сравнения: регистр и ё → е."""
+    return text.casefold().replace("ё", "е")
+
+
+def tokenize(text):
+    """Разбивает текст на токены один раз.
+
+    Returns:
+        Кортеж (список токенов по порядку, множество токенов для поиска).
+        Хэштег #слово попадает в множество и как «#слово», и как «слово»,
+        слово с дефисом — целиком и по частям; в списке для n-грамм
+        хранится одна форма на позицию.
+    """
+    tokens = []
+    lookup = set()
+    for raw in TOKEN_RE.findall(normalize(text)):
+        if raw.startswith("#"):
+            lookup.add(raw)
+            raw = raw[1:]
+        tokens.append(raw)
+        lookup.add(raw)
+        if "-" in raw or "'" in raw or "’" in raw:
+            lookup.update(part for part in re.split(r"['’\-]", raw) if part)
+    return tokens, lookup
+
+
+@lru_cache(maxsize=32)
+def _text_tokens(text):
+    """Токены текста для term_in_text: подряд проверяется много слов по одному сообщению."""
+    return tokenize(text)
+
+
+def term_in_text(term, text):
+    """Проверяет один термин поиском подстроки (MATCH_ENGINE=substring).
+
+    Явные формы значат то же, что в MatchIndex: "слово" (или "фраза в кавычках") —
+    целое слово или слова подряд, слово* — слово, начинающееся с «слово».
+    Термин без них ищется как подстрока текста в нижнем регистре.
+    """
+    term = term.strip().lower()
+    if len(term) >= 2 and term[0] == term[-1] == '"':
+        tokens, lookup = _text_tokens(text)
+        inner = normalize(term[1:-1].strip())
+        words, _ = tokenize(inner)
+        if not words:
+            return False
+        if len(words) == 1:
+            return ("#" + words[0] if inner.startswith("#") else words[0]) in lookup
+        return any(tuple(tokens[i:i + len(words)]) == tuple(words) for i in range(len(tokens) - len(words) + 1))
+    if term.endswith("*") and len(term) > 1:
+        prefix = normalize(term[:-1])
+        return any(token.startswith(prefix) for token in _text_tokens(text)[1])
+    return term in text
+
+
+class MatchIndex:
+    """Скомпилированный набор ключевых и стоп-слов с поиском по токенам.
+
+    Каждый уникальный термин получает бит. Текст токенизируется один раз,
+    термины находятся поиском в словарях (слова, префиксы, n-граммы фраз),
+    поэтому стоимость проверки зависит от длины сообщения, а не от числа
+    ключевых слов. Синтаксис выражения:
+
+        сша          — целое слово (хэштег #сша тоже подходит)
+        "сша"        — то же, явная форма
+        нефт*        — слово, начинающееся с «нефт»
+        белый дом    — фраза: слова подряд
+        продам+айфон — все части в любом месте сообщения
+
+    Каждое выражение относится к набору правил, заданному битовой маской
+    mask; match() возвращает маски наборов, у которых сработали ключевые
+    и стоп-слова.
+    """
+
+    def __init__(self):
+        self.words = {}
+        self.prefixes = {}
+        self.prefix_lengths = set()
+        self.phrases = {}
+        self.phrase_lengths = set()
+        self._next_bit = 1
+        # Выражения из одного термина: бит термина -> маска наборов
+        self._single = ({}, {})
+        # Составные выражения: бит первого термина -> [(биты всех терминов, маска наборов)]
+        self._compound = ({}, {})
+        # Ключевые слова для счетчиков совпадений: бит первого термина -> [(выражение, биты терминов, маска)]
+        self._keywords = {}
+        self.size = 0
+
+    def _term_bit(self, term):
+        """Возвращает бит термина, регистрируя его при первом использовании."""
+        term = term.strip()
+        if len(term) >= 2 and term[0] == term[-1] == '"':
+            term = term[1:-1].strip()
+        if term.endswith("*") and len(term) > 1:
+            table, key = self.prefixes, term[:-1]
+            self.prefix_lengths.add(len(key))
+        else:
+            tokens, _ = tokenize(term)
+            if not tokens:
+                return 0
+            if len(tokens) > 1:
+                table, key = self.phrases, tuple(tokens)
+                self.phrase_lengths.add(len(key))
+            elif term.startswith("#"):
+                table, key = self.words, "#" + tokens[0]
+            else:
+                table, key = self.words, tokens[0]
+        bit = table.get(key)
+        if bit is None:
+            bit = table[key] = self._next_bit
+            self._next_bit <<= 1
+        return bit
+
+    def add(self, expression, mask=1, stop=False):
+        """Добавляет ключевое (stop=False) или стоп-слово для наборов mask."""
+        bits = [self._term_bit(normalize(part)) for part in expression.split("+")]
+        bits = [bit for bit in bits if bit]
+        if not bits:
+            return
+        kind = 1 if stop else 0
+        self.size += 1
+        required = 0
+        for bit in bits:
+            required |= bit
+        if len(bits) == 1:
+            single = self._single[kind]
+            single[bits[0]] = single.get(bits[0], 0) | mask
+        else:
+            self._compound[kind].setdefault(bits[0], []).append((required, mask))
+        if not stop:
+            self._keywords.setdefault(bits[0], []).append((expression, required, mask))
+
+    def _found_terms(self, text):
+        tokens, lookup = tokenize(text)
+        found = []
+        words = self.words
+        for token in lookup:
+            bit = words.get(token)
+            if bit:
+                found.append(bit)
+        if self.prefix_lengths:
+            prefixes = self.prefixes
+            for token in lookup:
+                for length in self.prefix_lengths:
+                    if len(token) >= length:
+                        bit = prefixes.get(token[:length])
+                        if bit:
+                            found.append(bit)
+        if self.phrase_lengths:
+            phrases = self.phrases
+            for length in self.phrase_lengths:
+                for i in range(len(tokens) - length + 1):
+                    bit = phrases.get(tuple(tokens[i:i + length]))
+                    if bit:
+                        found.append(bit)
+        return found
+
+    def match(self, text):
+        """Проверяет текст.
+
+        Returns:
+            Кортеж (маска наборов с ключевыми словами, маска наборов со стоп-словами)
+        """
+        found = self._found_terms(text)
+        if not found:
+            return 0, 0
+        present = 0
+        for bit in found:
+            present |= bit
+        result = [0, 0]
+        for kind in (0, 1):
+            single, compound = self._single[kind], self._compound[kind]
+            mask = 0
+            for bit in set(found):
+                mask |= single.get(bit, 0)
+                for required, rules in compound.get(bit, ()):
+                    if required & present == required:
+                        mask |= rules
+            result[kind] = mask
+        return result[0], result[1]
+
+    def found_keywords(self, text, mask=1):
+        """Ключевые слова наборов mask, найденные в тексте (стоп-слова не учитываются).
+
+        Returns:
+            Список пар (выражение в исходном виде, маска его набора)
+        """
+        found = self._found_terms(text)
+        present = 0
+        for bit in found:
+            present |= bit
+        result = []
+        for bit in set(found):
+            for expression, required, rules in self._keywords.get(bit, ()):
+                if rules & mask and required & present == required:
+                    result.append((expression, rules))
+        return result
+
+    def matches(self, text, mask=1):
+        """True, если для наборов mask есть ключевое слово и нет стоп-слова."""
+        keyword_mask, stop_mask = self.match(text)
+        return bool(keyword_mask & ~stop_mask & mask)
+
+
+def compile_rules(keywords, stopwords, mask=1):
+    """Компилирует списки ключевых и стоп-слов одного набора правил."""
+    index = MatchIndex()
+    for keyword in keywords:
+        index.add(keyword, mask)
+    for stopword in stopwords:
+        index.add(stopword, mask, stop=True)
+    return index
+
+
+# Бит набора правил по умолчанию (глобальные таблицы keywords и stopwords)
+DEFAULT_RULES = 1
+
+
+class RuleTable:
+    """Наборы правил каналов, скомпилированные в таблицу диспетчеризации.
+
+    Все наборы компилируются в один MatchIndex, каждый со своим битом
+    (бит 0 — набор по умолчанию), поэтому сообщение проверяется за один
+    проход при любом числе наборов. Канал применяет к результату маску
+    подключенных к нему наборов; канал без подключений использует набор
+    по умолчанию.
+
+    Набор с владельцем (owner_id) — подписка пользователя: она действует
+    на все каналы, если не подключена к отдельным, и пересылает совпадения
+    в свой чат (target_chat) со своим лимитом (rate_limit). Остальные
+    наборы пересылают в общий целевой канал.
+    """
+
+    def __init__(self, rule_sets=(), attachments=(), keywords=None, stopwords=None):
+        """Компилирует наборы.
+
+        Args:
+            rule_sets: Наборы правил (словари id, name, keywords, stopwords и,
+                для подписок, owner_id, target_chat, rate_limit)
+            attachments: Пары (channel_id, rule_set_id); rule_set_id = 0 — набор по умолчанию
+            keywords: Ключевые слова набора по умолчанию; None — набор по умолчанию
+                проверяется вне таблицы (MATCH_ENGINE=substring)
+            stopwords: Стоп-слова набора по умолчанию
+        """
+        self.index = MatchIndex()
+        self.names = {DEFAULT_RULES: "default"}
+        self.includes_default = keywords is not None
+        if self.includes_default:
+            for keyword in keywords:
+                self.index.add(keyword, DEFAULT_RULES)
+            for stopword in stopwords or ():
+                self.index.add(stopword, DEFAULT_RULES, stop=True)
+
+        bits = {0: DEFAULT_RULES}
+        self.rule_set_ids = {DEFAULT_RULES: 0}
+        subscriptions = 0
+        # Бит набора -> (чат для пересылки или None для общего канала, лимит в минуту)
+        self.targets = {DEFAULT_RULES: (None, None)}
+        for position, rule_set in enumerate(rule_sets, 1):
+            bit = 1 << position
+            bits[rule_set["id"]] = bit
+            self.rule_set_ids[bit] = rule_set["id"]
+            self.names[bit] = rule_set["name"]
+            self.targets[bit] = (rule_set.get("target_chat"), rule_set.get("rate_limit"))
+            if rule_set.get("owner_id") is not None:
+                subscriptions |= bit
+            for keyword in rule_set["keywords"]:
+                self.index.add(keyword, bit)
+            for stopword in rule_set["stopwords"]:
+                self.index.add(stopword, bit, stop=True)
+
+        # Наборы каналов и подписки учитываются раздельно: подписка,
+        # подключенная к каналу, не отключает у него набор по умолчанию
+        self.channel_masks = {}
+        self.subscription_masks = {}
+        attached = 0
+        for channel_id, rule_set_id in attachments:
+            bit = bits.get(rule_set_id)
+            if bit:
+                masks = self.subscription_masks if bit & subscriptions else self.channel_masks
+                key = str(channel_id)
+                masks[key] = masks.get(key, 0) | bit
+                attached |= bit
+        # Подписки без подключений действуют на все каналы
+        self.global_mask = subscriptions & ~attached
+
+    def channel_mask(self, channel_id):
+        """Маска наборов, подключенных к каналу."""
+        key = str(channel_id)
+        return self.channel_masks.get(key, DEFAULT_RULES) | self.subscription_masks.get(key, 0) | self.global_mask
+
+    def match(self, text, mask):
+        """Возвращает маску наборов из mask, у которых сработало ключевое слово и нет стоп-слова."""
+        keyword_mask, stop_mask = self.index.match(text)
+        return keyword_mask & ~stop_mask & mask
+
+    def keyword_hits(self, text, mask):
+        """Ключевые слова наборов mask, найденные в тексте: пары (ID набора, выражение)."""
+        return [(self.rule_set_ids[rules], expression) for expression, rules in self.index.found_keywords(text, mask)]
+
+    def rule_names(self, mask):
+        """Имена наборов, входящих в маску."""
+        return [name for bit, name in self.names.items() if bit & mask]
+
+    def deliveries(self, mask):
+        """Цели пересылки для сработавших наборов.
+
+        Returns:
+            Словарь {чат или None (общий канал): лимит в минуту или None};
+            если в один чат пересылают несколько наборов, берется меньший лимит.
+        """
+        result = {}
+        for bit, (target, rate_limit) in self.targets.items():
+            if not bit & mask:
+                continue
+            if target in result and result[target] and (not rate_limit or result[target] < rate_limit):
+                continue
+            result[target] = rate_limit
+        return result
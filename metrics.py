@@ -0,0 +1,286 @@
+import asyncio
+import bisect
+import logging
+import os
+import time
+
+logger = logging.getLogger(__name__)
+
+# Границы корзин гистограмм по умолчанию (секунды)
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(names, values, extra=None):
+    pairs = list(zip(names, values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{n}="{_escape(v)}"' for n, v in pairs) + "}"
+
+
+def percentile(values, q):
+    """Возвращает q-квантиль списка значений (ближайший ранг) для отчетов скриптов."""
+    if not values:
+        return 0.0
+    values = sorted(values)
+    index = min(len(values) - 1, max(0, int(round(q * (len(values) - 1)))))
+    return values[index]
+
+
+class Metric:
+    """Базовый класс метрики с набором меток."""
+
+    kind = "untyped"
+
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help = help_text
+        self.label_names = tuple(labels)
+        self.values = {}
+
+    def _key(self, labels):
+        return tuple(labels.get(n, "") for n in self.label_names)
+
+    def header(self):
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(Metric):
+    """Монотонно растущий счетчик."""
+
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        self.values[key] = self.values.get(key, 0) + amount
+
+    def render(self):
+        lines = self.header()
+        for key, value in self.values.items():
+            lines.append(f"{self.name}{_format_labels(self.label_names, key)} {value}")
+        return lines
+
+    def total(self):
+        return sum(self.values.values())
+
+
+class Gauge(Metric):
+    """Значение, которое может как расти, так и уменьшаться."""
+
+    kind = "gauge"
+
+    def set(self, value, **labels):
+        self.values[self._key(labels)] = value
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        self.values[key] = self.values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def render(self):
+        return Counter.render(self)
+
+    def total(self):
+        return sum(self.values.values())
+
+
+class Histogram(Metric):
+    """Гистограмма с фиксированными корзинами; хранит количество и сумму наблюдений."""
+
+    kind = "histogram"
+
+    def __init__(self, name, help_text, labels=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help_text, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        state = self.values.get(key)
+        if state is None:
+            # [счетчики по корзинам + корзина +Inf, сумма, количество]
+            state = self.values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+        state[0][bisect.bisect_left(self.buckets, value)] += 1
+        state[1] += value
+        state[2] += 1
+
+    def time(self, **labels):
+        """Контекстный менеджер для измерения длительности блока."""
+        return _Timer(self, labels)
+
+    def render(self):
+        lines = self.header()
+        for key, (counts, total, count) in self.values.items():
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += bucket_count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                lines.append(f"{self.name}_bucket{_format_labels(self.label_names, key, ('le', le))} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.label_names, key)} {total}")
+            lines.append(f"{self.name}_count{_format_labels(self.label_names, key)} {count}")
+        return lines
+
+    def quantile(self, q, key=None):
+        """Оценивает квантиль по корзинам (верхняя граница корзины)."""
+        states = [self.values[key]] if key is not None else list(self.values.values())
+        counts = [0] * (len(self.buckets) + 1)
+        for state in states:
+            counts = [a + b for a, b in zip(counts, state[0])]
+        total = sum(counts)
+        if not total:
+            return None
+        threshold, cumulative = q * total, 0
+        for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+            cumulative += bucket_count
+            if cumulative >= threshold:
+                return bound
+        return float("inf")
+
+    def total(self):
+        count = sum(state[2] for state in self.values.values())
+        total = sum(state[1] for state in self.values.values())
+        return count, total
+
+
+class _Timer:
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.start, **self.labels)
+        return False
+
+
+class MetricsRegistry:
+    """Реестр метрик процесса."""
+
+    def __init__(self):
+        self.metrics = {}
+
+    def _register(self, metric):
+        existing = self.metrics.get(metric.name)
+        if existing is not None:
+            return existing
+        self.metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, help_text, labels=()):
+        return self._register(Counter(name, help_text, labels))
+
+    def gauge(self, name, help_text, labels=()):
+        return self._register(Gauge(name, help_text, labels))
+
+    def histogram(self, name, help_text, labels=(), buckets=DEFAULT_BUCKETS):
+        return self._register(Histogram(name, help_text, labels, buckets))
+
+    def render(self):
+        """Возвращает все метрики в текстовом формате Prometheus."""
+        lines = []
+        for metric in self.metrics.values():
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+    def summary(self):
+        """Краткая сводка для бота: суммы по всем меткам."""
+        lines = []
+        for metric in self.metrics.values():
+            if isinstance(metric, Histogram):
+                count, total = metric.total()
+                if not count:
+                    continue
+                p95 = metric.quantile(0.95)
+                lines.append(f"{metric.name}: n={count}, avg={total / count:.3f}s, p95≤{p95}s")
+            else:
+                if not metric.values:
+                    continue
+                line = f"{metric.name}: {metric.total():g}"
+                # Для меток с небольшим числом значений показываем разбивку
+                if metric.label_names and 1 < len(metric.values) <= 5:
+                    parts = ", ".join(f"{'/'.join(map(str, key))}={value:g}" for key, value in metric.values.items())
+                    line += f" ({parts})"
+                lines.append(line)
+        return "\n".join(lines) if lines else "Метрики пока не собраны"
+
+
+# Глобальный реестр процесса
+registry = MetricsRegistry()
+
+# Парсер
+CYCLE_SECONDS = registry.histogram("parser_cycle_seconds", "Длительность цикла проверки каналов")
+CYCLE_CHANNELS = registry.gauge("parser_cycle_channels", "Количество каналов в последнем цикле")
+FETCH_SECONDS = registry.histogram("parser_fetch_seconds", "Время получения сообщений канала", ("channel",))
+FETCHED_MESSAGES = registry.counter("parser_fetched_messages_total", "Получено сообщений", ("channel",))
+MATCHED_MESSAGES = registry.counter("parser_matched_messages_total", "Сообщений с совпадениями", ("channel",))
+RULE_SET_MATCHES = registry.counter("parser_rule_set_matches_total", "Совпадения по наборам правил", ("rule_set",))
+EDITED_REMATCHES = registry.counter("parser_edited_rematches_total", "Повторные проверки отредактированных сообщений", ("result",))
+FORWARDS = registry.counter("forwarder_forwards_total", "Попытки пересылки", ("result",))
+FLOOD_WAIT_SECONDS = registry.counter("telegram_flood_wait_seconds_total", "Суммарное ожидание FloodWait, сек.")
+CHANNEL_ERRORS = registry.counter("parser_channel_errors_total", "Ошибки обработки каналов", ("channel",))
+FORWARD_QUEUE_SIZE = registry.gauge("forwarder_queue_size", "Сообщений в очереди на пересылку")
+FORWARD_TARGET_QUEUE_SIZE = registry.gauge("forwarder_target_queue_size", "Сообщений в очереди пересылки в чат", ("target",))
+CHANNELS_QUARANTINED = registry.gauge("parser_channels_quarantined", "Каналов на карантине после ошибок")
+CHANNEL_AUDIT_STATUS = registry.gauge("channel_audit_channels", "Каналы по результату последней проверки", ("status",))
+
+# Планировщик
+SCHEDULER_CYCLES = registry.counter("scheduler_cycles_total", "Запуски цикла проверки", ("result",))
+SCHEDULER_LAST_RUN = registry.gauge("scheduler_last_run_timestamp", "Время начала последнего цикла (unix)")
+SCHEDULER_NEXT_RUN = registry.gauge("scheduler_next_run_timestamp", "Запланированное время следующего цикла (unix)")
+SCHEDULER_OVERRUNS = registry.counter("scheduler_overruns_total", "Циклы, не уложившиеся в интервал")
+SCHEDULER_SKIPPED_TICKS = registry.counter("scheduler_skipped_ticks_total", "Пропущенные из-за перегрузки запуски")
+
+# База данных
+DB_POOL_WAIT_SECONDS = registry.histogram(
+    "db_pool_wait_seconds", "Ожидание соединения из пула", buckets=(0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0)
+)
+DB_QUERY_SECONDS = registry.histogram(
+    "db_query_seconds", "Время выполнения операций с базой", ("backend",),
+    buckets=(0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0)
+)
+
+
+async def _handle_request(reader, writer):
+    try:
+        request_line = await asyncio.wait_for(reader.readline(), timeout=5)
+        # Дочитываем заголовки запроса
+        while True:
+            line = await asyncio.wait_for(reader.readline(), timeout=5)
+            if not line or line in (b"\r\n", b"\n"):
+                break
+        parts = request_line.decode("latin-1").split()
+        if len(parts) >= 2 and parts[1].split("?")[0] == "/metrics":
+            body = registry.render().encode("utf-8")
+            status = "200 OK"
+            content_type = "text/plain; version=0.0.4; charset=utf-8"
+        else:
+            body, status, content_type = b"Not Found\n", "404 Not Found", "text/plain"
+        writer.write(
+            f"HTTP/1.1 {status}\r\nContent-Type: {content_type}\r\nContent-Length: {len(body)}\r\n"
+            f"Connection: close\r\n\r\n".encode("latin-1") + body
+        )
+        await writer.drain()
+    except Exception as e:
+        logger.debug(f"Ошибка при обработке запроса метрик: {e}")
+    finally:
+        writer.close()
+
+
+async def start_metrics_server(host=None, port=None):
+    """Запускает HTTP-listener с метриками на /metrics. Порт 0 отключает его."""
+    host = host or os.getenv("METRICS_HOST", "127.0.0.1")
+    port = int(port if port is not None else os.getenv("METRICS_PORT", "0"))
+    if not port:
+        return None
+    server = await asyncio.start_server(_handle_request, host, port)
+    logger.info(f"Метрики доступны на http://{host}:{port}/metrics")
+    return server
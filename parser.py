@@ -1,17 +1,27 @@
 import asyncio
-from datetime import datetime, timedelta
+from collections import deque
+from datetime import datetime, timedelta, timezone
 from loguru import logger
 from telegram import Bot
-from telegram.error import TelegramError, BadRequest, Forbidden
+from telegram.error import TelegramError, BadRequest
 from telegram.constants import ParseMode
-from database import Database
+from database import Database, DEFAULT_RULE_SET_ID
 import telethon
-from telethon import TelegramClient
 from telethon.errors import FloodWaitError
 import os
+import config
 import re
 import random
 import time
+import metrics
+import tracing
+import telethon_session
+from tape import TapeWriter, TAPE_FLUSH_PAGES
+from hit_counters import HitCounters
+from edit_tracker import EditTracker
+from circuit_breaker import CircuitBreaker, classify_error
+from matcher import compile_rules, term_in_text, RuleTable, DEFAULT_RULES
+from fanout import RateLimiter, Delivery
 
 # Устанавливаем уровень логирования на DEBUG
 logger.remove()
@@ -40,7 +50,7 @@ class MessageParser:
         self.api_id = os.getenv("TELEGRAM_API_ID")
         self.api_hash = os.getenv("TELEGRAM_API_HASH")
         self.phone = os.getenv("TELEGRAM_PHONE")
-        self.telethon_session_name = 'telegram_parser_session'
+        self.telethon_session_name = config.TELETHON_SESSION_NAME
         self.client = telethon_client  # Используем переданный клиент, если он есть
         
         # Проверяем наличие параметров для Telethon
@@ -54,8 +64,88 @@ class MessageParser:
         self.delay_between_channels = float(os.getenv("DELAY_BETWEEN_CHANNELS", "1.0"))  # Задержка между каналами (секунды)
         self.max_messages_per_channel = int(os.getenv("MAX_MESSAGES_PER_CHANNEL", "20"))
         self.jitter = float(os.getenv("JITTER", "0.2"))  # Случайное отклонение для задержек (±20%)
+        self.delay_scale = float(os.getenv("DELAY_SCALE", "1.0"))  # Множитель всех задержек (0 — без задержек, для нагрузочных тестов)
         self.last_channel_request_time = 0  # Время последнего запроса к каналу
         
+        # Локальный архив сообщений для повторной проверки новых ключевых слов
+        self.archive_enabled = os.getenv("ARCHIVE_ENABLED", "false").lower() in ("1", "true", "yes")
+        self.archive_retention_days = int(os.getenv("ARCHIVE_RETENTION_DAYS", "7"))
+        self.archive_lookback_hours = int(os.getenv("ARCHIVE_LOOKBACK_HOURS", "48"))
+        self.retro_match_limit = int(os.getenv("RETRO_MATCH_LIMIT", "200"))
+        
+        # Признак выполняющегося цикла проверки (фоновые задачи уступают ему приоритет)
+        self.cycle_in_progress = False
+        # Текущий этап работы парсера (для монитора задержек цикла событий)
+        self.stage = "idle"
+        
+        # Движок сопоставления: substring (поиск подстрок) или token (целые слова, см. matcher.py)
+        self.match_engine = os.getenv("MATCH_ENGINE", "substring").lower()
+        self._matcher = None
+        self._matcher_lists = (None, None)
+        self._matcher_key = None
+        
+        # Правила текущего цикла: глобальные списки слов и наборы правил каналов,
+        # скомпилированные в одну таблицу (см. load_rules)
+        self.keywords = []
+        self.stopwords = []
+        self.rules = None
+        self._rules_key = None
+        
+        # Длительности получения последней страницы по каналам (для трассировки)
+        self.fetch_spans = {}
+        
+        # Очередь отложенных пересылок (включается планировщиком для конвейерной работы)
+        # и ключи сообщений, которые уже ждут в ней пересылки
+        self.forward_queue = None
+        self.pending_forwards = set()
+        
+        # Пересылка в несколько чатов (подписки, см. fanout.py): у каждого чата своя
+        # очередь, обработчик и лимит в минуту, а сами пересылки аккаунта идут по одной.
+        # delivered — чаты, куда уже переслано еще не завершенное сообщение
+        self.forward_rate_limit = int(os.getenv("FORWARD_RATE_LIMIT", "0"))
+        self.target_limiters = {}
+        self.target_queues = {}
+        self._target_workers = {}
+        self._deliveries = {}
+        self.delivered = {}
+        self._forward_lock = asyncio.Lock()
+        
+        # Общий лимит запросов к API для массовых операций вне цикла проверки
+        # (проверка и добавление каналов, см. call_limited)
+        self.bulk_limiter = RateLimiter(int(os.getenv("BULK_API_RATE", "60")))
+        
+        # Ограничение числа каналов в цикле, которое планировщик снижает при перегрузке
+        self.channel_budget = None
+        self.last_cycle_channels = 0
+        
+        # Теплое состояние, которое сохраняется в снимок (см. warm_state.py):
+        # разрешенные сущности каналов, последние просмотренные ID сообщений
+        # и окно недавно обработанных сообщений для проверки дубликатов без базы
+        self.entity_cache = {}
+        self.watermarks = {}
+        self.dedup_window = deque(maxlen=int(os.getenv("DEDUP_WINDOW", "5000")))
+        self.dedup_keys = set()
+        
+        # Счетчики совпадений и пересылок по ключевым словам и каналам,
+        # записываются в базу одной пачкой в конце цикла (см. hit_counters.py)
+        self.hit_counters = HitCounters(self.dedup_window.maxlen)
+        
+        # Отметки редактирования недавних сообщений: отредактированное сообщение
+        # проверяется повторно и пересылается, только если стало совпадать
+        # с новыми наборами (см. edit_tracker.py)
+        self.edits = EditTracker(int(os.getenv("EDIT_WINDOW", "20000")))
+        # ID канала Telegram (get_peer_id) -> ID канала в базе, для событий правки
+        self.peer_channels = {}
+        self.edit_client = None
+        
+        # Карантин каналов, получение сообщений из которых не удается (см. circuit_breaker.py)
+        self.breaker = CircuitBreaker()
+        
+        # Запись полученных страниц в ленту для воспроизведения (см. tape.py, replay_tape.py);
+        # файл открывается при первой записи
+        self.tape_path = os.getenv("TAPE_PATH")
+        self.tape = None
+        
     def normalize_channel_id(self, channel_id):
         """Преобразует ID канала в правильный формат для API"""
         # Если это уже строка и начинается с @, это уже имя канала
@@ -104,24 +194,10 @@ class MessageParser:
             return False
             
         try:
-            # Преобразуем API ID в число
-            api_id = int(self.api_id)
-            
-            # Используем device_info для имитации реального устройства
-            device_model = "Windows Desktop"
-            system_version = "4.16.30-vxCUSTOM"
-            app_version = "1.0.0"
-            
-            # Создаем клиент только если он еще не был создан
+            # Общий клиент аккаунта (см. telethon_session.get_client)
             if not self.client:
-                self.client = TelegramClient(
-                    self.telethon_session_name, 
-                    api_id, 
-                    self.api_hash,
-                    device_model=device_model,
-                    system_version=system_version,
-                    app_version=app_version
-                )
+                self.client = await telethon_session.get_client(db=self.db, session_name=self.telethon_session_name)
+            elif not self.client.is_connected():
                 await self.client.connect()
             
             # Проверяем авторизацию
@@ -138,131 +214,450 @@ class MessageParser:
             logger.error(f"Ошибка при инициализации Telethon клиента: {e}")
             return False
     
+    async def get_channel_entity(self, channel_id):
+        """Получает сущность канала Telethon в зависимости от типа ID.
+        
+        Разрешенные сущности кэшируются, повторные запросы не обращаются к API.
+        """
+        key = str(channel_id)
+        entity = self.entity_cache.get(key)
+        if entity is not None:
+            return entity
+        
+        if isinstance(channel_id, str) and channel_id.startswith('@'):
+            # Если это имя канала, используем как есть
+            entity = await self.client.get_entity(channel_id)
+        else:
+            try:
+                # Иначе пробуем как числовой ID
+                entity = await self.client.get_entity(int(channel_id))
+            except ValueError:
+                # Если не удалось преобразовать в число, используем как строку
+                entity = await self.client.get_entity(channel_id)
+        self.entity_cache[key] = entity
+        return entity
+    
+    def remember_processed(self, channel_id, message_id):
+        """Добавляет сообщение в окно недавно обработанных."""
+        key = (str(channel_id), message_id)
+        if key in self.dedup_keys:
+            return
+        if len(self.dedup_window) == self.dedup_window.maxlen:
+            self.dedup_keys.discard(self.dedup_window[0])
+        self.dedup_window.append(key)
+        self.dedup_keys.add(key)
+    
     async def add_delay(self, base_delay=1.0):
         """Добавляет случайную задержку для имитации человеческого поведения"""
         # Вычисляем случайную задержку с отклонением ±jitter%
         jitter_factor = 1 + random.uniform(-self.jitter, self.jitter)
-        delay = base_delay * jitter_factor
+        delay = base_delay * jitter_factor * self.delay_scale
         
         # Добавляем задержку
         await asyncio.sleep(delay)
         return delay
     
-    async def check_keywords_in_message(self, message_text, keywords, stopwords):
-        """Проверяет наличие ключевых слов в сообщении и отсутствие стоп-слов"""
+    async def call_limited(self, request, limiter=None):
+        """Выполняет запрос к API через общий лимит, повторяя его после FloodWait.
+        
+        Args:
+            request: Функция без аргументов, возвращающая корутину запроса
+            limiter: RateLimiter; по умолчанию общий bulk_limiter
+        """
+        limiter = limiter or self.bulk_limiter
+        while True:
+            await limiter.wait()
+            try:
+                return await request()
+            except FloodWaitError as e:
+                # Пауза распространяется на все запросы, идущие через этот лимит
+                logger.warning(f"Превышен лимит запросов к API. Ожидаем {e.seconds} секунд")
+                metrics.FLOOD_WAIT_SECONDS.inc(e.seconds)
+                limiter.pause(e.seconds)
+    
+    def get_matcher(self, keywords, stopwords):
+        """Возвращает скомпилированный индекс для списков слов, перекомпилируя его при изменении."""
+        # Внутри одного канала списки те же объекты: проверка по идентичности, без сравнения
+        if self._matcher_lists[0] is not keywords or self._matcher_lists[1] is not stopwords:
+            key = (tuple(keywords), tuple(stopwords))
+            if key != self._matcher_key:
+                self._matcher = compile_rules(keywords, stopwords)
+                self._matcher_key = key
+            self._matcher_lists = (keywords, stopwords)
+        return self._matcher
+    
+    def message_match_text(self, message_text):
+        """Возвращает текст сообщения для проверки в нижнем регистре или None, если проверять нечего."""
         if not message_text:
             logger.debug("Пустой текст сообщения, пропускаем проверку")
-            return False
+            return None
             
         # Если сообщение содержит только тип медиа в квадратных скобках (например, [фото]),
         # то пропускаем проверку на ключевые слова
         if re.match(r'^\[\w+\]$', message_text):
             logger.debug(f"Пропускаем проверку ключевых слов для медиа без текста: {message_text}")
-            return False
+            return None
         
         # Если сообщение содержит медиа и текст, удаляем префикс типа медиа для проверки
         if re.match(r'^\[\w+\]\s+.+', message_text):
             # Извлекаем только текстовую часть для проверки ключевых слов
             clean_text = re.sub(r'^\[\w+\]\s+', '', message_text)
             logger.debug(f"Проверяем только текстовую часть сообщения: {clean_text}")
-            message_lower = clean_text.lower()
-        else:
-            message_lower = message_text.lower()
+            return clean_text.lower()
+        return message_text.lower()
+    
+    async def load_rules(self):
+        """Загружает ключевые слова и наборы правил каналов для цикла проверки.
+        
+        Таблица правил перекомпилируется, только если правила изменились.
+        При MATCH_ENGINE=token набор по умолчанию компилируется в ту же
+        таблицу, при поиске подстрок он проверяется check_keywords_in_message.
+        """
+        keywords = await self.db.get_keywords()
+        stopwords = await self.db.get_stopwords()
+        rule_sets = await self.db.get_rule_sets()
+        attachments = await self.db.get_rule_set_attachments()
+        
+        key = (
+            self.match_engine, tuple(keywords), tuple(stopwords),
+            tuple((r['id'], r['name'], tuple(r['keywords']), tuple(r['stopwords'])) for r in rule_sets),
+            tuple(sorted((str(c), r) for c, r in attachments)),
+        )
+        if key != self._rules_key:
+            if self.match_engine == "token":
+                self.rules = RuleTable(rule_sets, attachments, keywords, stopwords)
+            else:
+                self.rules = RuleTable(rule_sets, attachments)
+            self._rules_key = key
+            logger.info(f"Правила скомпилированы: наборов {len(rule_sets)}, каналов с наборами {len(self.rules.channel_masks)}")
+        self.keywords, self.stopwords = keywords, stopwords
+        return self.rules
+    
+    async def match_rules(self, message_text, keywords, stopwords, channel_mask=DEFAULT_RULES):
+        """Возвращает маску наборов правил канала, сработавших для сообщения.
+        
+        Наборы из таблицы правил проверяются за один проход по тексту.
+        Набор по умолчанию, если он не скомпилирован в таблицу, проверяется
+        по спискам keywords и stopwords.
+        """
+        rules = self.rules
+        matched = 0
+        if rules is None or not rules.includes_default:
+            if channel_mask & DEFAULT_RULES and await self.check_keywords_in_message(message_text, keywords, stopwords):
+                matched |= DEFAULT_RULES
+            channel_mask &= ~DEFAULT_RULES
+        if channel_mask and rules is not None:
+            message_lower = self.message_match_text(message_text)
+            if message_lower:
+                matched |= rules.match(message_lower, channel_mask)
+        return matched
+    
+    async def check_keywords_in_message(self, message_text, keywords, stopwords):
+        """Проверяет наличие ключевых слов в сообщении и отсутствие стоп-слов"""
+        message_lower = self.message_match_text(message_text)
+        if not message_lower:
+            return False
         
         logger.debug(f"Текст для проверки (в нижнем регистре): {message_lower[:100]}...")
-        logger.debug(f"Ключевые слова для проверки: {keywords}")
+        
+        if self.match_engine == "token":
+            # Текст разбирается на токены один раз, слова ищутся в скомпилированном индексе
+            return self.get_matcher(keywords, stopwords).matches(message_lower)
         
         # Проверка на стоп-слова
         for stopword in stopwords:
-            if stopword.lower() in message_lower:
+            if self.keyword_in_text(stopword, message_lower):
                 logger.debug(f"Найдено стоп-слово: {stopword}")
                 return False
         
         # Проверка на ключевые слова
         for keyword in keywords:
-            # Проверяем составные ключевые слова (с символом +)
-            if "+" in keyword:
-                parts = keyword.lower().split("+")
-                all_parts_found = True
-                for part in parts:
-                    if part.strip() not in message_lower:
-                        all_parts_found = False
-                        break
-                if all_parts_found:
-                    logger.debug(f"Найдено составное ключевое слово: {keyword}")
-                    return True
-            elif keyword.lower() in message_lower:
+            if self.keyword_in_text(keyword, message_lower):
                 logger.debug(f"Найдено ключевое слово: {keyword}")
                 return True
         
         logger.debug("Ключевые слова не найдены")
         return False
     
-    async def forward_message(self, from_chat_id, message_id):
-        """Пересылает сообщение в целевой канал с подписью используя только Telethon"""
-        try:
-            if not self.target_channel_id:
-                logger.error("Не указан целевой канал для пересылки сообщений")
+    def default_matcher(self, keywords, stopwords):
+        """Компилирует списки слов в функцию проверки текста в нижнем регистре.
+        
+        Для проверки многих сообщений одними списками без повторной
+        компиляции (check_keywords_in_message держит только один индекс).
+        """
+        if self.match_engine == "token":
+            return compile_rules(keywords, stopwords).matches
+        def matches(message_lower):
+            if any(self.keyword_in_text(stopword, message_lower) for stopword in stopwords):
                 return False
-                
-            logger.info(f"Пересылаем сообщение {message_id} из канала {from_chat_id} в канал {self.target_channel_id}")
+            return any(self.keyword_in_text(keyword, message_lower) for keyword in keywords)
+        return matches
+    
+    @staticmethod
+    def keyword_in_text(keyword, message_lower):
+        """Проверяет ключевое или стоп-слово поиском подстрок; у составного (с +) все части в любом месте.
+        
+        Части в кавычках и с * проверяются как целые слова и начала слов (см. matcher.term_in_text).
+        """
+        return all(term_in_text(part, message_lower) for part in keyword.split("+"))
+    
+    def keyword_hits(self, message_text, matched, keywords, stopwords):
+        """Ключевые слова сработавших наборов matched, найденные в сообщении.
+        
+        Вызывается только для совпавших сообщений, для счетчиков совпадений.
+        
+        Returns:
+            Список пар (ID набора, ключевое слово); DEFAULT_RULE_SET_ID — набор по умолчанию
+        """
+        message_lower = self.message_match_text(message_text)
+        if not message_lower:
+            return []
+        rules = self.rules
+        hits = []
+        if matched & DEFAULT_RULES and (rules is None or not rules.includes_default):
+            if self.match_engine == "token":
+                found = self.get_matcher(keywords, stopwords).found_keywords(message_lower)
+                hits += [(DEFAULT_RULE_SET_ID, keyword) for keyword, _ in found]
+            else:
+                hits += [(DEFAULT_RULE_SET_ID, keyword) for keyword in keywords
+                         if self.keyword_in_text(keyword, message_lower)]
+            matched &= ~DEFAULT_RULES
+        if matched and rules is not None:
+            hits += rules.keyword_hits(message_lower, matched)
+        return hits
+    
+    def delivery_targets(self, matched):
+        """Чаты для пересылки сообщения, совпавшего с наборами matched.
+        
+        Returns:
+            Словарь {чат: лимит пересылок в минуту}; наборы без своего чата
+            пересылают в целевой канал.
+        """
+        deliveries = self.rules.deliveries(matched) if self.rules else {None: None}
+        targets = {}
+        for target, rate_limit in deliveries.items():
+            target = target or self.target_channel_id
+            if not target:
+                continue
+            rate_limit = rate_limit or self.forward_rate_limit
+            if targets.get(target) and (not rate_limit or targets[target] <= rate_limit):
+                continue
+            targets[target] = rate_limit
+        return targets
+    
+    def target_limiter(self, target, rate_limit):
+        """Возвращает ограничитель частоты пересылок в чат target."""
+        limiter = self.target_limiters.get(target)
+        if limiter is None:
+            limiter = self.target_limiters[target] = RateLimiter(rate_limit)
+        elif limiter.rate != (rate_limit or 0):
+            limiter.set_rate(rate_limit)
+        return limiter
+    
+    async def fetch_source_message(self, from_chat_id, message_id):
+        """Получает сообщение для пересылки. Возвращает None, если клиент не готов или сообщения нет."""
+        # Проверяем, что Telethon клиент готов к работе
+        if not self.client or not self.client.is_connected() or not await self.client.is_user_authorized():
+            logger.error("Telethon клиент не инициализирован или не авторизован")
+            return None
+        
+        source_entity = await self.get_channel_entity(from_chat_id)
+        message = await self.client.get_messages(source_entity, ids=message_id)
+        if not message:
+            logger.error(f"Сообщение {message_id} не найдено в канале {from_chat_id}")
+            return None
+        return message
+    
+    async def forward_to(self, message, from_chat_id, message_id, target):
+        """Пересылает полученное сообщение в один чат. Возвращает True при успехе."""
+        logger.info(f"Пересылаем сообщение {message_id} из канала {from_chat_id} в канал {target}")
+        try:
+            target_entity = await self.get_channel_entity(target)
             
-            # Проверяем, что Telethon клиент готов к работе
-            if not self.client or not self.client.is_connected() or not await self.client.is_user_authorized():
-                logger.error("Telethon клиент не инициализирован или не авторизован")
-                return False
+            # Пересылаем сообщение
+            forwarded = await self.client.forward_messages(
+                entity=target_entity,
+                messages=message,
+                silent=False
+            )
             
+            if forwarded:
+                logger.info(f"Сообщение {message_id} из канала {from_chat_id} успешно переслано в {target}")
+                metrics.FORWARDS.inc(result="ok")
+                return True
+            logger.error(f"Не удалось переслать сообщение через Telethon")
+            metrics.FORWARDS.inc(result="failed")
+            return False
+            
+        except FloodWaitError as e:
+            logger.error(f"Превышен лимит запросов при пересылке сообщения: ожидание {e.seconds} секунд")
+            metrics.FLOOD_WAIT_SECONDS.inc(e.seconds)
+            metrics.FORWARDS.inc(result="flood_wait")
+            return False
+        except Exception as e:
+            logger.error(f"Ошибка при пересылке сообщения в {target} через Telethon: {e}")
+            metrics.FORWARDS.inc(result="error")
+            return False
+    
+    def mark_delivered(self, from_chat_id, message_id, target):
+        """Запоминает чат, куда сообщение уже переслано, чтобы при повторе не отправить его туда снова."""
+        key = (str(from_chat_id), message_id)
+        if key not in self.delivered and len(self.delivered) >= self.dedup_window.maxlen:
+            self.delivered.pop(next(iter(self.delivered)))
+        self.delivered.setdefault(key, set()).add(target)
+    
+    async def complete_message(self, from_chat_id, message_id):
+        """Помечает сообщение обработанным после доставки во все чаты."""
+        self.delivered.pop((str(from_chat_id), message_id), None)
+        self.hit_counters.record_forward(from_chat_id, message_id)
+        await self.db.mark_message_processed(from_chat_id, message_id)
+        self.remember_processed(from_chat_id, message_id)
+        if self.archive_enabled:
+            # Пересланное сообщение не пересылается снова при проверке архива (retro_match)
             try:
-                # Получаем сущности каналов
-                source_entity = None
-                target_entity = None
-                
-                # Получаем сущность исходного канала
-                if isinstance(from_chat_id, str) and from_chat_id.startswith('@'):
-                    source_entity = await self.client.get_entity(from_chat_id)
-                else:
-                    try:
-                        source_entity = await self.client.get_entity(int(from_chat_id))
-                    except ValueError:
-                        source_entity = await self.client.get_entity(from_chat_id)
-                
-                # Получаем сущность целевого канала
-                target_entity = await self.client.get_entity(int(self.target_channel_id))
-                
-                logger.info(f"Получены сущности каналов: источник={source_entity.id}, цель={target_entity.id}")
-                
-                # Получаем сообщение
-                message = await self.client.get_messages(source_entity, ids=message_id)
-                if not message:
-                    logger.error(f"Сообщение {message_id} не найдено в канале {from_chat_id}")
-                    return False
-                
-                # Пересылаем сообщение
-                forwarded = await self.client.forward_messages(
-                    entity=target_entity,
-                    messages=message,
-                    silent=False
-                )
-                
-                if forwarded:
-                    # Убираем отправку подписи, так как она не нужна
-                    
-                    # Отмечаем сообщение как обработанное
-                    await self.db.mark_message_processed(from_chat_id, message_id)
-                    
-                    logger.info(f"Сообщение {message_id} из канала {from_chat_id} успешно переслано через Telethon")
-                    return True
-                else:
-                    logger.error(f"Не удалось переслать сообщение через Telethon")
-                    return False
-                    
+                await self.db.mark_archive_forwarded(from_chat_id, message_id)
             except Exception as e:
-                logger.error(f"Ошибка при пересылке сообщения через Telethon: {e}")
-                return False
-                
+                logger.error(f"Ошибка при отметке пересылки сообщения {message_id} канала {from_chat_id} в архиве: {e}")
+    
+    async def forward_message(self, from_chat_id, message_id, targets=None):
+        """Пересылает сообщение в чаты targets ({чат: лимит в минуту}, по умолчанию — целевой канал).
+        
+        Сообщение получается из канала один раз. Обработанным оно помечается
+        только после доставки во все чаты; при повторной попытке чаты, куда
+        оно уже переслано, пропускаются. Возвращает True, если доставлено во все.
+        """
+        if targets is None:
+            targets = {self.target_channel_id: self.forward_rate_limit} if self.target_channel_id else {}
+        if not targets:
+            logger.error("Не указан целевой канал для пересылки сообщений")
+            return False
+        
+        key = (str(from_chat_id), message_id)
+        remaining = [target for target in targets if target not in self.delivered.get(key, ())]
+        try:
+            if remaining:
+                message = await self.fetch_source_message(from_chat_id, message_id)
+                if message is None:
+                    return False
+            for i, target in enumerate(remaining):
+                if i:
+                    await self.add_delay(1.0)
+                await self.target_limiter(target, targets[target]).wait()
+                if await self.forward_to(message, from_chat_id, message_id, target):
+                    self.mark_delivered(from_chat_id, message_id, target)
         except Exception as e:
             logger.error(f"Непредвиденная ошибка при пересылке сообщения: {e}")
             return False
+        
+        if any(target not in self.delivered.get(key, ()) for target in targets):
+            return False
+        await self.complete_message(from_chat_id, message_id)
+        return True
+    
+    def convert_message(self, msg):
+        """Конвертирует сообщение Telethon в формат, схожий с python-telegram-bot"""
+        # Выводим сырое сообщение для отладки
+        logger.debug(f"Обрабатываем сообщение ID: {msg.id}")
+        
+        # Выводим все атрибуты сообщения
+        logger.debug(f"Все атрибуты сообщения: {dir(msg)}")
+        
+        # Выводим все важные атрибуты и их значения
+        for attr in ['message', 'text', 'raw_text', 'caption', 'grouped_id', 'post', 'post_author']:
+            if hasattr(msg, attr):
+                value = getattr(msg, attr)
+                logger.debug(f"Атрибут {attr}: {value}")
+        
+        # Проверяем наличие текста или медиа с подписью
+        text = None
+        
+        # Проверяем основной текст сообщения (в разных атрибутах)
+        if hasattr(msg, 'message') and msg.message:
+            text = msg.message
+            logger.debug(f"Найден текст сообщения (message): {text[:100]}...")
+        elif hasattr(msg, 'text') and msg.text:
+            text = msg.text
+            logger.debug(f"Найден текст сообщения (text): {text[:100]}...")
+        
+        # Проверяем наличие подписи к медиа
+        caption = None
+        if hasattr(msg, 'caption') and msg.caption:
+            caption = msg.caption
+            logger.debug(f"Найдена подпись к медиа: {caption[:100]}...")
+        
+        # Проверяем наличие raw_text (иногда текст может быть там)
+        if not text and hasattr(msg, 'raw_text') and msg.raw_text:
+            text = msg.raw_text
+            logger.debug(f"Найден текст в raw_text: {text[:100]}...")
+        
+        # Определяем тип сообщения для отладки
+        msg_type = "неизвестно"
+        has_media = False
+        
+        if hasattr(msg, 'photo') and msg.photo:
+            msg_type = "фото"
+            has_media = True
+            logger.debug("Сообщение содержит фото")
+        elif hasattr(msg, 'video') and msg.video:
+            msg_type = "видео"
+            has_media = True
+        elif hasattr(msg, 'document') and msg.document:
+            msg_type = "документ"
+            has_media = True
+        elif hasattr(msg, 'audio') and msg.audio:
+            msg_type = "аудио"
+            has_media = True
+        elif hasattr(msg, 'voice') and msg.voice:
+            msg_type = "голосовое"
+            has_media = True
+        elif hasattr(msg, 'poll') and msg.poll:
+            msg_type = "опрос"
+            has_media = True
+        elif text:
+            msg_type = "текст"
+        
+        # Для отладки выводим подробную информацию о сообщении
+        logger.debug(f"Сообщение {msg.id}: тип={msg_type}, текст={bool(text)}, подпись={bool(caption)}")
+        
+        # Проверяем, есть ли текст для проверки ключевых слов
+        message_text = text or caption or ""
+        
+        # Если сообщение содержит только медиа без текста, добавляем метку типа
+        if not message_text and has_media:
+            message_text = f"[{msg_type}]"
+        
+        # Если сообщение содержит медиа и текст, добавляем информацию о типе медиа к тексту
+        if has_media and message_text and not message_text.startswith(f"[{msg_type}]"):
+            message_text = f"[{msg_type}] {message_text}"
+        
+        # Создаем простой объект для совместимости
+        message_obj = type('obj', (object,), {
+            'message_id': msg.id,
+            'date': msg.date,
+            'text': message_text,
+            'caption': caption,
+            'type': msg_type,
+            'has_media': has_media,
+            'edit_date': getattr(msg, 'edit_date', None)
+        })
+        return message_obj
+    
+    async def record_tape(self, channel_id, messages, fetched_at):
+        """Дописывает полученную страницу сообщений в ленту TAPE_PATH.
+        
+        Страницы копятся в буфере ленты и записываются в отдельном потоке
+        в конце цикла или по заполнении буфера.
+        """
+        if self.tape is None:
+            try:
+                self.tape = TapeWriter(self.tape_path)
+            except Exception as e:
+                logger.error(f"Не удалось открыть ленту {self.tape_path}, запись отключена: {e}")
+                self.tape_path = None
+                return
+        self.tape.record(channel_id, messages, fetched_at)
+        if len(self.tape.buffer) >= TAPE_FLUSH_PAGES:
+            await self.tape.flush()
     
     async def get_recent_messages_telethon(self, channel_id, limit=20):
         """Получает последние сообщения из канала через Telethon с защитой от блокировки"""
@@ -290,28 +685,24 @@ class MessageParser:
             # Получаем сущность канала в зависимости от типа ID
             try:
                 logger.info(f"Получаем сущность канала {channel_id} через Telethon")
-                
-                if isinstance(channel_id, str) and channel_id.startswith('@'):
-                    # Если это имя канала, используем как есть
-                    entity = await self.client.get_entity(channel_id)
-                else:
-                    # Иначе пробуем как числовой ID
-                    try:
-                        entity = await self.client.get_entity(int(channel_id))
-                    except ValueError:
-                        # Если не удалось преобразовать в число, используем как строку
-                        entity = await self.client.get_entity(channel_id)
+                fetch_started_at = datetime.now(timezone.utc)
+                fetch_started = time.perf_counter()
+                entity = await self.get_channel_entity(channel_id)
+                entity_seconds = time.perf_counter() - fetch_started
                 
                 logger.info(f"Успешно получена сущность канала: {entity.title} (ID: {entity.id})")
+                self.peer_channels[telethon.utils.get_peer_id(entity)] = str(channel_id)
                 
                 # Добавляем небольшую задержку перед получением сообщений
                 await self.add_delay(0.5)
+                messages_started = time.perf_counter()
                 
                 try:
                     # Получаем сообщения с обработкой FloodWaitError
                     logger.info(f"Запрашиваем {limit} сообщений из канала {entity.title}")
                     messages = await self.client.get_messages(entity, limit=limit)
                     
+                    self.breaker.record_success(channel_id)
                     if not messages:
                         logger.warning(f"Канал {entity.title} не содержит сообщений или у вас нет доступа к истории")
                         return []
@@ -322,6 +713,7 @@ class MessageParser:
                     # Если получили ошибку о превышении лимита запросов, ждем указанное время
                     wait_time = e.seconds
                     logger.warning(f"Превышен лимит запросов к API. Ожидаем {wait_time} секунд")
+                    metrics.FLOOD_WAIT_SECONDS.inc(wait_time)
                     await asyncio.sleep(wait_time)
                     # Повторяем запрос с меньшим лимитом
                     logger.info(f"Повторный запрос с уменьшенным лимитом ({min(5, limit)} сообщений)")
@@ -329,93 +721,18 @@ class MessageParser:
                 
                 # Обновляем время последнего запроса
                 self.last_channel_request_time = time.time()
+                fetch_finished = time.perf_counter()
+                metrics.FETCH_SECONDS.observe(fetch_finished - fetch_started, channel=str(channel_id))
+                # Этапы, общие для всех сообщений страницы, для трассировки
+                self.fetch_spans[str(channel_id)] = tracing.tracer.fetch_spans(
+                    fetch_started_at, entity_seconds, fetch_finished - messages_started
+                )
                 
                 # Конвертируем сообщения Telethon в формат, схожий с python-telegram-bot
-                result = []
-                for msg in messages:
-                    # Выводим сырое сообщение для отладки
-                    logger.debug(f"Обрабатываем сообщение ID: {msg.id}")
-                    
-                    # Выводим все атрибуты сообщения
-                    logger.debug(f"Все атрибуты сообщения: {dir(msg)}")
-                    
-                    # Выводим все важные атрибуты и их значения
-                    for attr in ['message', 'text', 'raw_text', 'caption', 'grouped_id', 'post', 'post_author']:
-                        if hasattr(msg, attr):
-                            value = getattr(msg, attr)
-                            logger.debug(f"Атрибут {attr}: {value}")
-                    
-                    # Проверяем наличие текста или медиа с подписью
-                    text = None
-                    
-                    # Проверяем основной текст сообщения (в разных атрибутах)
-                    if hasattr(msg, 'message') and msg.message:
-                        text = msg.message
-                        logger.debug(f"Найден текст сообщения (message): {text[:100]}...")
-                    elif hasattr(msg, 'text') and msg.text:
-                        text = msg.text
-                        logger.debug(f"Найден текст сообщения (text): {text[:100]}...")
-                    
-                    # Проверяем наличие подписи к медиа
-                    caption = None
-                    if hasattr(msg, 'caption') and msg.caption:
-                        caption = msg.caption
-                        logger.debug(f"Найдена подпись к медиа: {caption[:100]}...")
-                    
-                    # Проверяем наличие raw_text (иногда текст может быть там)
-                    if not text and hasattr(msg, 'raw_text') and msg.raw_text:
-                        text = msg.raw_text
-                        logger.debug(f"Найден текст в raw_text: {text[:100]}...")
-                    
-                    # Определяем тип сообщения для отладки
-                    msg_type = "неизвестно"
-                    has_media = False
-                    
-                    if hasattr(msg, 'photo') and msg.photo:
-                        msg_type = "фото"
-                        has_media = True
-                        logger.debug("Сообщение содержит фото")
-                    elif hasattr(msg, 'video') and msg.video:
-                        msg_type = "видео"
-                        has_media = True
-                    elif hasattr(msg, 'document') and msg.document:
-                        msg_type = "документ"
-                        has_media = True
-                    elif hasattr(msg, 'audio') and msg.audio:
-                        msg_type = "аудио"
-                        has_media = True
-                    elif hasattr(msg, 'voice') and msg.voice:
-                        msg_type = "голосовое"
-                        has_media = True
-                    elif hasattr(msg, 'poll') and msg.poll:
-                        msg_type = "опрос"
-                        has_media = True
-                    elif text:
-                        msg_type = "текст"
-                    
-                    # Для отладки выводим подробную информацию о сообщении
-                    logger.debug(f"Сообщение {msg.id}: тип={msg_type}, текст={bool(text)}, подпись={bool(caption)}")
-                    
-                    # Проверяем, есть ли текст для проверки ключевых слов
-                    message_text = text or caption or ""
-                    
-                    # Если сообщение содержит только медиа без текста, добавляем метку типа
-                    if not message_text and has_media:
-                        message_text = f"[{msg_type}]"
-                    
-                    # Если сообщение содержит медиа и текст, добавляем информацию о типе медиа к тексту
-                    if has_media and message_text and not message_text.startswith(f"[{msg_type}]"):
-                        message_text = f"[{msg_type}] {message_text}"
-                    
-                    # Создаем простой объект для совместимости
-                    message_obj = type('obj', (object,), {
-                        'message_id': msg.id,
-                        'text': message_text,
-                        'caption': caption,
-                        'type': msg_type,
-                        'has_media': has_media
-                    })
-                    result.append(message_obj)
+                self.stage = f"convert {channel_id}"
+                result = [self.convert_message(msg) for msg in messages]
+                if self.tape_path:
+                    await self.record_tape(channel_id, result, fetch_started_at)
                 
                 # Выводим статистику по типам сообщений
                 text_count = sum(1 for m in result if m.type == 'текст')
@@ -431,13 +748,34 @@ class MessageParser:
                 # Обработка ошибки превышения лимита запросов
                 wait_time = e.seconds
                 logger.warning(f"Превышен лимит запросов к API. Ожидаем {wait_time} секунд")
+                metrics.FLOOD_WAIT_SECONDS.inc(wait_time)
                 await asyncio.sleep(wait_time)
                 return []
                 
         except Exception as e:
             logger.error(f"Ошибка при получении сообщений через Telethon: {e}")
+            await self.record_channel_failure(channel_id, e)
             return []
     
+    async def record_channel_failure(self, channel_id, error):
+        """Учитывает ошибку получения сообщений канала в автомате карантина.
+        
+        Кэш сущности сбрасывается (канал мог быть переименован), а канал
+        с постоянной ошибкой дольше CIRCUIT_DEACTIVATE_DAYS отключается.
+        """
+        kind = classify_error(error)
+        self.entity_cache.pop(str(channel_id), None)
+        circuit = self.breaker.record_failure(channel_id, kind, error)
+        if self.breaker.should_deactivate(circuit):
+            days = (time.time() - circuit.first_failure_at) / 86400
+            logger.warning(f"Канал {channel_id} недоступен {days:.0f} дн. ({kind}), отключаем его")
+            try:
+                await self.db.save_channel_audit([(channel_id, kind, None, None, False)])
+                self.breaker.reset(channel_id)
+            except Exception as e:
+                logger.error(f"Ошибка при отключении канала {channel_id}: {e}")
+        metrics.CHANNELS_QUARANTINED.set(len(self.breaker.quarantined()))
+    
     async def get_recent_messages(self, channel_id, limit=100):
         """Получает последние сообщения из канала, используя только Telethon"""
         try:
@@ -459,85 +797,353 @@ class MessageParser:
             logger.error(f"Ошибка при получении сообщений из канала {channel_id}: {e}")
             return []
     
+    async def archive_messages(self, channel_id, messages):
+        """Сохраняет сообщения в локальный архив, если он включен"""
+        if not self.archive_enabled:
+            return
+        try:
+            await self.db.archive_messages(channel_id, messages)
+        except Exception as e:
+            logger.error(f"Ошибка при сохранении сообщений канала {channel_id} в архив: {e}")
+    
+    async def process_messages(self, channel_id, messages, keywords, stopwords, trace=True, defer=False):
+        """Проверяет сообщения канала на совпадения и пересылает найденные.
+        
+        Сообщения проверяются в переданном порядке по наборам правил,
+        подключенным к каналу. Уже обработанные
+        пропускаются, несовпавшие помечаются обработанными. Обработанное сообщение,
+        отредактированное после прошлой проверки (edit_date и текст изменились),
+        проверяется снова и пересылается только по наборам, с которыми до правки
+        не совпадало. Возвращает количество пересланных сообщений.
+        При trace=True по каждому новому сообщению собирается трасса этапов.
+        При defer=True и включенной очереди пересылок найденные сообщения ставятся
+        в очередь (drain_forwards), а возвращается количество поставленных.
+        """
+        fetch_spans = self.fetch_spans.get(str(channel_id)) if trace else None
+        defer = defer and self.forward_queue is not None
+        channel_mask = self.rules.channel_mask(channel_id) if self.rules else DEFAULT_RULES
+        count_matched = 0
+        for message in messages:
+            key = (str(channel_id), message.message_id)
+            if key in self.pending_forwards:
+                # Сообщение уже ждет пересылки с прошлого цикла
+                continue
+            message_trace = tracing.tracer.start(channel_id, message, fetch_spans)
+            
+            # Проверяем, не обрабатывали ли мы уже это сообщение
+            with message_trace.span("dedup"):
+                is_processed = key in self.dedup_keys
+                if not is_processed:
+                    is_processed = await self.db.is_message_processed(channel_id, message.message_id)
+                    if is_processed:
+                        self.remember_processed(channel_id, message.message_id)
+            previous = None
+            if is_processed:
+                if not self.edits.marked(channel_id, message.message_id):
+                    # Отметки нет (перезапуск без снимка, вытеснение): совпадающие сейчас
+                    # наборы считаются уже пересланными, чтобы правка не переслала их снова
+                    matched = await self.match_rules(message.text or message.caption or "", keywords, stopwords, channel_mask)
+                    self.edits.remember(channel_id, message, matched)
+                    continue
+                # Обработанное сообщение проверяется повторно, только если его
+                # отредактировали после прошлой проверки
+                previous = self.edits.edited(channel_id, message)
+                if previous is None:
+                    continue
+            
+            # Проверяем наличие ключевых слов и отсутствие стоп-слов
+            message_text = message.text or message.caption or ""
+            logger.debug(f"Проверяем сообщение {message.message_id}: '{message_text[:100]}...'")
+            
+            # Проверяем напрямую наличие слова "США" в тексте
+            if 'сша' in message_text.lower():
+                logger.debug("Слово 'США' найдено в тексте напрямую!")
+            
+            self.stage = f"match {channel_id}"
+            with message_trace.span("match"):
+                matched = await self.match_rules(message_text, keywords, stopwords, channel_mask)
+            
+            seen = matched
+            if previous is not None:
+                # Пересылаются только наборы, с которыми сообщение не совпадало до правки;
+                # отметка правки обновляется после пересылки, чтобы неудачная повторилась
+                seen = matched | previous
+                matched &= ~previous
+                metrics.EDITED_REMATCHES.inc(result="matched" if matched else "unmatched")
+                if not matched:
+                    self.edits.remember(channel_id, message, seen)
+                    continue
+                logger.info(f"Сообщение {message.message_id} канала {channel_id} после правки совпало с новыми наборами")
+            
+            success = False
+            if matched:
+                targets = self.delivery_targets(matched)
+                if previous:
+                    # Чаты, куда сообщение уже переслано до правки, пропускаются
+                    forwarded = self.delivery_targets(previous)
+                    targets = {target: rate for target, rate in targets.items() if target not in forwarded}
+                    if not targets:
+                        self.edits.remember(channel_id, message, seen)
+                        continue
+                rule_names = self.rules.rule_names(matched) if self.rules else ["default"]
+                logger.info(f"Найдено совпадение в сообщении {message.message_id} канала {channel_id} "
+                            f"(наборы: {', '.join(rule_names)})")
+                metrics.MATCHED_MESSAGES.inc(channel=str(channel_id))
+                for rule_name in rule_names:
+                    metrics.RULE_SET_MATCHES.inc(rule_set=rule_name)
+                self.hit_counters.record_match(
+                    channel_id, message.message_id, self.keyword_hits(message_text, matched, keywords, stopwords)
+                )
+                if defer:
+                    self.edits.remember(channel_id, message, seen)
+                    self.pending_forwards.add(key)
+                    self.forward_queue.put_nowait((channel_id, message.message_id, message_trace if trace else None, targets))
+                    metrics.FORWARD_QUEUE_SIZE.set(self.forward_queue.qsize())
+                    count_matched += 1
+                    continue
+                self.stage = f"forward {channel_id}"
+                with message_trace.span("forward"):
+                    success = await self.forward_message(channel_id, message.message_id, targets)
+                if success:
+                    self.edits.remember(channel_id, message, seen)
+                    count_matched += 1
+                    # Добавляем задержку между пересылками сообщений
+                    await self.add_delay(1.0)
+            else:
+                logger.debug(f"Совпадений не найдено в сообщении {message.message_id}")
+                self.edits.remember(channel_id, message, 0)
+                # Отмечаем сообщение как обработанное, даже если оно не соответствует условиям
+                await self.db.mark_message_processed(channel_id, message.message_id)
+                self.remember_processed(channel_id, message.message_id)
+            
+            if trace:
+                tracing.tracer.finish(message_trace, forwarded=success)
+        
+        if messages:
+            newest = max(message.message_id for message in messages)
+            if newest > self.watermarks.get(str(channel_id), 0):
+                self.watermarks[str(channel_id)] = newest
+        
+        return count_matched
+    
+    def attach_edit_events(self, client):
+        """Подписывается на правки сообщений в каналах клиента Telethon.
+        
+        Правка сообщения канала, который парсер уже опрашивал, проверяется
+        сразу, не дожидаясь следующего цикла; правки остальных каналов
+        пропускаются.
+        """
+        if self.edit_client is client:
+            return
+        self.edit_client = client
+        client.add_event_handler(self._on_message_edited, telethon.events.MessageEdited())
+        logger.info("Парсер подписан на правки сообщений в каналах")
+    
+    async def _on_message_edited(self, event):
+        """Проверяет отредактированное сообщение канала (событие MessageEdited)."""
+        channel_id = self.peer_channels.get(event.chat_id)
+        if channel_id is None:
+            return
+        try:
+            message = self.convert_message(event.message)
+            await self.archive_messages(channel_id, [message])
+            if self.rules is None:
+                await self.load_rules()
+            await self.process_messages(channel_id, [message], self.keywords, self.stopwords, trace=False, defer=True)
+        except Exception as e:
+            logger.error(f"Ошибка при проверке правки сообщения {event.message.id} канала {channel_id}: {e}")
+    
     async def process_channel(self, channel):
         """Обрабатывает последние сообщения из канала"""
         channel_id = channel['channel_id']
         
         try:
-            # Проверяем, первый ли это запуск для данного канала
-            async with self.db.pool.acquire() as conn:
-                first_run = await conn.fetchval(
-                    'SELECT NOT EXISTS(SELECT 1 FROM processed_messages WHERE channel_id = $1)',
-                    str(channel_id)
-                )
-                
-                # Получаем ID последнего обработанного сообщения
-                last_message_id = await conn.fetchval(
-                    'SELECT message_id FROM processed_messages WHERE channel_id = $1 ORDER BY message_id DESC LIMIT 1',
-                    str(channel_id)
-                )
+            # Проверяем, первый ли это запуск для данного канала,
+            # и получаем ID последнего обработанного сообщения
+            # Канал с известной отметкой уже проверялся, запрос к базе не нужен
+            if str(channel_id) in self.watermarks:
+                first_run, last_message_id = False, self.watermarks[str(channel_id)]
+            else:
+                first_run, last_message_id = await self.db.get_channel_state(channel_id)
             
             # При первом запуске получаем только 2 последних сообщения
             # При последующих запусках получаем больше сообщений для проверки новых
             limit = 5 if first_run else min(20, self.max_messages_per_channel)
             
             # Получаем последние сообщения из канала
+            self.stage = f"fetch {channel_id}"
             messages = await self.get_recent_messages(channel_id, limit=limit)
             
             if not messages:
                 logger.info(f"Нет доступных сообщений в канале {channel_id}")
                 return 0
+            metrics.FETCHED_MESSAGES.inc(len(messages), channel=str(channel_id))
             
-            keywords = await self.db.get_keywords()
-            stopwords = await self.db.get_stopwords()
+            # Сохраняем тексты в архив до проверки, чтобы новые ключевые слова
+            # можно было проверить без повторного запроса истории
+            self.stage = f"archive {channel_id}"
+            await self.archive_messages(channel_id, messages)
+            
+            # Правила загружаются один раз за цикл (run), а не для каждого канала
+            if self.rules is None:
+                await self.load_rules()
+            keywords, stopwords = self.keywords, self.stopwords
             
             logger.info(f"Проверяем {len(messages)} сообщений из канала {channel_id} на наличие {len(keywords)} ключевых слов")
             logger.info(f"Первый запуск для канала: {first_run}, лимит сообщений: {limit}")
             
             # Обрабатываем сообщения в обратном порядке (от старых к новым)
-            count_matched = 0
-            for message in reversed(messages):
-                # Проверяем, не обрабатывали ли мы уже это сообщение
-                is_processed = await self.db.is_message_processed(channel_id, message.message_id)
-                if is_processed:
-                    continue
-                
-                # Проверяем наличие ключевых слов и отсутствие стоп-слов
-                message_text = message.text or message.caption or ""
-                logger.debug(f"Проверяем сообщение {message.message_id}: '{message_text[:100]}...'")
-                logger.debug(f"Доступные ключевые слова: {keywords}")
-                
-                # Проверяем напрямую наличие слова "США" в тексте
-                if 'сша' in message_text.lower():
-                    logger.debug("Слово 'США' найдено в тексте напрямую!")
-                
-                matched = await self.check_keywords_in_message(message_text, keywords, stopwords)
-                
-                if matched:
-                    logger.info(f"Найдено совпадение в сообщении {message.message_id} канала {channel_id}")
-                    success = await self.forward_message(channel_id, message.message_id)
-                    if success:
-                        count_matched += 1
-                        # Добавляем задержку между пересылками сообщений
-                        await self.add_delay(1.0)
-                else:
-                    logger.debug(f"Совпадений не найдено в сообщении {message.message_id}")
-                    # Отмечаем сообщение как обработанное, даже если оно не соответствует условиям
-                    await self.db.mark_message_processed(channel_id, message.message_id)
+            count_matched = await self.process_messages(channel_id, list(reversed(messages)), keywords, stopwords, defer=True)
             
             logger.info(f"Обработка канала {channel_id} завершена. Найдено и переслано {count_matched} сообщений")
             return count_matched
             
-        except Forbidden:
-            logger.error(f"Бот не имеет доступа к каналу {channel_id}, удаляем канал из списка")
-            await self.db.remove_channel(channel_id)
-            return 0
         except Exception as e:
+            # Ошибки доступа к каналу учитывает автомат карантина (record_channel_failure)
             logger.error(f"Ошибка при обработке канала {channel_id}: {e}")
+            metrics.CHANNEL_ERRORS.inc(channel=str(channel_id))
             return 0
     
+    async def drain_forwards(self):
+        """Пересылает сообщения из очереди отложенных пересылок.
+        
+        Работает как фоновая задача планировщика, пока следующий цикл уже
+        получает сообщения каналов. Каждое сообщение получается из канала
+        один раз и раскладывается по очередям чатов: у каждого чата свой
+        обработчик и лимит, поэтому медленный чат не задерживает остальные.
+        Сообщение помечается обработанным только
+        после успешной пересылки во все чаты, поэтому при остановке очередь не теряется:
+        неотправленные сообщения будут найдены повторно.
+        """
+        try:
+            while True:
+                channel_id, message_id, message_trace, targets = await self.forward_queue.get()
+                try:
+                    await self._dispatch(channel_id, message_id, message_trace, targets)
+                except Exception as e:
+                    logger.error(f"Ошибка при пересылке сообщения {message_id} из очереди: {e}")
+                    self.pending_forwards.discard((str(channel_id), message_id))
+                finally:
+                    self.forward_queue.task_done()
+                    metrics.FORWARD_QUEUE_SIZE.set(self.forward_queue.qsize())
+        finally:
+            for task in self._target_workers.values():
+                task.cancel()
+            self._target_workers.clear()
+            self.target_queues.clear()
+            # Сообщения из очередей чатов будут найдены повторно в следующих циклах
+            for key in self._deliveries:
+                self.pending_forwards.discard(key)
+            self._deliveries.clear()
+    
+    async def _dispatch(self, channel_id, message_id, message_trace, targets):
+        """Раскладывает сообщение из общей очереди по очередям чатов."""
+        key = (str(channel_id), message_id)
+        if not targets:
+            logger.error("Не указан целевой канал для пересылки сообщений")
+        remaining = {t: rate for t, rate in targets.items() if t not in self.delivered.get(key, ())}
+        message = await self.fetch_source_message(channel_id, message_id) if remaining else None
+        delivery = Delivery(channel_id, message_id, message_trace, message, remaining)
+        if message is None:
+            # Получить сообщение не удалось, нет чатов или оно уже доставлено во все
+            delivery.pending.clear()
+            delivery.failed = bool(remaining) or not targets
+            await self._finish_delivery(delivery)
+            return
+        
+        self._deliveries[key] = delivery
+        for target, rate_limit in remaining.items():
+            self.target_limiter(target, rate_limit)
+            queue = self.target_queues.get(target)
+            if queue is None:
+                queue = self.target_queues[target] = asyncio.Queue()
+                self._target_workers[target] = asyncio.create_task(self._drain_target(target, queue))
+            queue.put_nowait(delivery)
+            metrics.FORWARD_TARGET_QUEUE_SIZE.set(queue.qsize(), target=str(target))
+    
+    async def _drain_target(self, target, queue):
+        """Обработчик очереди одного чата."""
+        while True:
+            delivery = await queue.get()
+            success = False
+            try:
+                await self.target_limiters[target].wait()
+                # Пересылки выполняются одним аккаунтом, поэтому идут по одной с защитной задержкой
+                async with self._forward_lock:
+                    success = await self.forward_to(delivery.message, delivery.channel_id, delivery.message_id, target)
+                    if success:
+                        self.mark_delivered(delivery.channel_id, delivery.message_id, target)
+                        await self.add_delay(1.0)
+            except Exception as e:
+                logger.error(f"Ошибка при пересылке сообщения {delivery.message_id} в {target}: {e}")
+            finally:
+                queue.task_done()
+                metrics.FORWARD_TARGET_QUEUE_SIZE.set(queue.qsize(), target=str(target))
+                delivery.pending.discard(target)
+                delivery.failed = delivery.failed or not success
+                if not delivery.pending:
+                    await self._finish_delivery(delivery)
+    
+    async def _finish_delivery(self, delivery):
+        """Завершает сообщение, когда ответили все его чаты."""
+        key = delivery.key
+        self._deliveries.pop(key, None)
+        try:
+            if not delivery.failed:
+                await self.complete_message(delivery.channel_id, delivery.message_id)
+            if delivery.trace is not None:
+                delivery.trace.stages["forward"] = time.perf_counter() - delivery.started
+                tracing.tracer.finish(delivery.trace, forwarded=not delivery.failed)
+        finally:
+            self.pending_forwards.discard(key)
+    
+    async def retro_match(self, keyword, hours=None):
+        """Проверяет ключевое слово по локальному архиву и пересылает найденные сообщения.
+        
+        Кандидаты отбираются одним запросом к полнотекстовому индексу архива
+        среди еще не пересланных сообщений, затем проверяются набором по
+        умолчанию (слово компилируется один раз) с учетом наборов, подключенных
+        к каналу. Сообщения, которые совпадают и с другими ключевыми словами,
+        уже обработаны обычным циклом и пропускаются.
+        
+        Returns:
+            Кортеж (количество кандидатов, количество пересланных сообщений)
+        """
+        if not self.archive_enabled:
+            return 0, 0
+        
+        since = datetime.now(timezone.utc) - timedelta(hours=hours or self.archive_lookback_hours)
+        candidates = await self.db.search_archive(keyword, since, limit=self.retro_match_limit)
+        if not candidates:
+            logger.info(f"В архиве нет сообщений для ключевого слова '{keyword}'")
+            return 0, 0
+        
+        rules = await self.load_rules()
+        matches_keyword = self.default_matcher([keyword], self.stopwords)
+        other_keywords = [k for k in self.keywords if k != keyword]
+        matches_other = self.default_matcher(other_keywords, self.stopwords) if other_keywords else None
+        targets = self.delivery_targets(DEFAULT_RULES)
+        
+        forwarded = 0
+        for row in candidates:
+            if rules is not None and not rules.channel_mask(row['channel_id']) & DEFAULT_RULES:
+                continue
+            message_lower = self.message_match_text(row['text'])
+            if not message_lower or not matches_keyword(message_lower):
+                continue
+            if matches_other and matches_other(message_lower):
+                continue
+            if await self.forward_message(row['channel_id'], row['message_id'], targets):
+                forwarded += 1
+                await self.add_delay(1.0)
+        
+        logger.info(f"Проверка архива для '{keyword}': кандидатов {len(candidates)}, переслано {forwarded}")
+        return len(candidates), forwarded
+    
     async def run(self):
         """Запускает процесс парсинга каналов один раз"""
+        self.cycle_in_progress = True
+        cycle_started = time.perf_counter()
         try:
             # Инициализируем Telethon клиент
             if not self.client:
@@ -546,14 +1152,24 @@ class MessageParser:
                     logger.error("Не удалось инициализировать Telethon клиент. Парсинг невозможен.")
                     return
                 
-            # Получаем список активных каналов
-            channels = await self.db.get_channels()
+            # Получаем список активных каналов и правила на этот цикл
+            channels = list(await self.db.get_channels())
+            await self.load_rules()
+            total_processed = 0
             
             if not channels:
                 logger.warning("Нет активных каналов для мониторинга")
             else:
                 logger.info(f"Начинаем проверку {len(channels)} каналов")
                 
+                # Каналы на карантине не тратят лимиты API до окончания карантина
+                now = time.time()
+                allowed = [channel for channel in channels if self.breaker.allow(channel['channel_id'], now)]
+                if len(allowed) < len(channels):
+                    logger.info(f"Пропускаем {len(channels) - len(allowed)} каналов на карантине")
+                    channels = allowed
+                metrics.CHANNELS_QUARANTINED.set(len(self.breaker.quarantined(now)))
+                
                 # Ограничиваем количество каналов для проверки
                 if len(channels) > self.max_channels_per_run:
                     logger.warning(f"Слишком много каналов ({len(channels)}). Ограничиваем до {self.max_channels_per_run} для защиты от блокировки.")
@@ -561,8 +1177,16 @@ class MessageParser:
                     random.shuffle(channels)
                     channels = channels[:self.max_channels_per_run]
                 
+                # Планировщик сократил цикл, чтобы он укладывался в интервал
+                if self.channel_budget and len(channels) > self.channel_budget:
+                    logger.warning(f"Цикл сокращен до {self.channel_budget} из {len(channels)} каналов")
+                    random.shuffle(channels)
+                    channels = channels[:self.channel_budget]
+                
+                metrics.CYCLE_CHANNELS.set(len(channels))
+                self.last_cycle_channels = len(channels)
+                
                 # Обрабатываем каждый канал с задержкой между запросами
-                total_processed = 0
                 for i, channel in enumerate(channels):
                     processed = await self.process_channel(channel)
                     if processed:
@@ -573,9 +1197,22 @@ class MessageParser:
                         delay = await self.add_delay(self.delay_between_channels)
                         logger.debug(f"Задержка {delay:.2f} сек перед следующим каналом")
             
-            # Возвращаем время следующей проверки
-            logger.info(f"Проверка завершена. Обработано {total_processed} сообщений. Следующая проверка через {self.check_interval} минут")
+            # Удаляем из архива устаревшие сообщения
+            if self.archive_enabled:
+                await self.db.prune_archive(self.archive_retention_days)
+            
+            # Сбрасываем отложенные записи хранилища и счетчики совпадений
+            await self.hit_counters.flush(self.db)
+            await self.db.flush()
+            if self.tape:
+                await self.tape.flush()
+            
+            logger.info(f"Проверка завершена. Найдено {total_processed} сообщений для пересылки")
             
         except Exception as e:
             logger.error(f"Ошибка в цикле проверки: {e}")
-            raise 
\ No newline at end of file
+            raise
+        finally:
+            self.cycle_in_progress = False
+            self.stage = "idle"
+            metrics.CYCLE_SECONDS.observe(time.perf_counter() - cycle_started) 
\ No newline at end of file
@@ -0,0 +1,173 @@
+import asyncio
+import cProfile
+import io
+import logging
+import os
+import pstats
+import time
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+
+def _await_chain(coro):
+    """Возвращает цепочку корутин, которые сейчас ожидает coro (от внешней к внутренней)."""
+    chain = []
+    while coro is not None:
+        code = getattr(coro, "cr_code", None) or getattr(coro, "gi_code", None)
+        if code is None:
+            # Дошли до Future или другого ожидаемого объекта
+            chain.append(type(coro).__name__)
+            break
+        chain.append(f"{code.co_qualname} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+        coro = getattr(coro, "cr_await", None) or getattr(coro, "gi_yieldfrom", None)
+    return chain
+
+
+class AwaitSampler:
+    """Сэмплирует цепочку ожидания задачи и копит время ожидания по корутинам.
+
+    Каждые interval секунд снимается цепочка cr_await задачи: время
+    начисляется всем корутинам цепочки (inclusive) и самой внутренней (self).
+    Пока цикл событий заблокирован синхронным кодом, сэмплер не выполняется —
+    это время видно в CPU-профиле.
+    """
+
+    def __init__(self, interval=0.01):
+        self.interval = interval
+        self.inclusive = {}
+        self.own = {}
+        self.samples = 0
+        self._task = None
+
+    def start(self, target):
+        self._task = asyncio.create_task(self._run(target))
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self, target):
+        last = time.perf_counter()
+        while not target.done():
+            await asyncio.sleep(self.interval)
+            now = time.perf_counter()
+            elapsed, last = now - last, now
+            chain = _await_chain(target.get_coro())
+            if not chain:
+                continue
+            self.samples += 1
+            for name in set(chain):
+                self.inclusive[name] = self.inclusive.get(name, 0.0) + elapsed
+            self.own[chain[-1]] = self.own.get(chain[-1], 0.0) + elapsed
+
+    def report(self, limit=15):
+        lines = [f"{'inclusive, s':>12} {'self, s':>9}  корутина"]
+        for name, seconds in sorted(self.inclusive.items(), key=lambda item: item[1], reverse=True)[:limit]:
+            lines.append(f"{seconds:>12.2f} {self.own.get(name, 0.0):>9.2f}  {name}")
+        return "\n".join(lines)
+
+
+class CycleProfiler:
+    """Профилирование нескольких следующих циклов парсера по запросу.
+
+    Пока профилирование не запрошено, планировщик вызывает parser.run()
+    напрямую и профилировщик не добавляет накладных расходов. После arm(n)
+    следующие n циклов выполняются под cProfile и AwaitSampler, затем
+    результаты сохраняются в PROFILE_DIR и передаются в on_done.
+    """
+
+    def __init__(self, directory=None):
+        self.directory = directory or os.getenv("PROFILE_DIR", "profiles")
+        self.remaining = 0
+        self.on_done = None
+        self._profile = None
+        self._sampler = None
+        self._cycles = 0
+        self._wall = 0.0
+
+    @property
+    def armed(self):
+        return self.remaining > 0
+
+    def arm(self, cycles, on_done=None):
+        """Включает профилирование следующих cycles циклов."""
+        self.remaining = cycles
+        self.on_done = on_done
+        self._profile = cProfile.Profile()
+        self._sampler = AwaitSampler()
+        self._cycles = 0
+        self._wall = 0.0
+        logger.info(f"Профилирование следующих {cycles} циклов включено")
+
+    async def profile(self, coro_func):
+        """Выполняет один цикл под профилировщиком."""
+        task = asyncio.create_task(coro_func())
+        self._sampler.start(task)
+        started = time.perf_counter()
+        self._profile.enable()
+        try:
+            return await task
+        finally:
+            self._profile.disable()
+            if not task.done():
+                task.cancel()
+            self._wall += time.perf_counter() - started
+            await self._sampler.stop()
+            self._cycles += 1
+            self.remaining -= 1
+            if not self.remaining:
+                await self._finish()
+
+    async def _finish(self):
+        os.makedirs(self.directory, exist_ok=True)
+        base = os.path.join(self.directory, f"cycle_{datetime.now().strftime('%Y%m%d_%H%M%S')}")
+        self._profile.dump_stats(f"{base}.prof")
+
+        stream = io.StringIO()
+        stats = pstats.Stats(self._profile, stream=stream)
+        stats.sort_stats("cumulative").print_stats(25)
+        with open(f"{base}_await.txt", "w", encoding="utf-8") as f:
+            f.write(f"Циклов: {self._cycles}, общее время: {self._wall:.2f} с, сэмплов: {self._sampler.samples}\n\n")
+            f.write(self._sampler.report(limit=50))
+            f.write("\n\nCPU (cProfile, по cumulative):\n")
+            f.write(stream.getvalue())
+
+        summary = self.summary(stats)
+        logger.info(f"Профиль циклов сохранен в {base}.prof и {base}_await.txt")
+        on_done, self.on_done = self.on_done, None
+        self._profile = None
+        if on_done:
+            try:
+                await on_done(summary, base)
+            except Exception as e:
+                logger.error(f"Ошибка при отправке результатов профилирования: {e}")
+
+    def summary(self, stats, limit=10):
+        """Краткая сводка: самые затратные функции по CPU и корутины по ожиданию."""
+        lines = [f"Циклов: {self._cycles}, время: {self._wall:.1f} с", "", "CPU (cumulative):"]
+        # stats.stats: {(файл, строка, функция): (cc, nc, tt, ct, callers)}
+        top = sorted(stats.stats.items(), key=lambda item: item[1][3], reverse=True)
+        shown = 0
+        for (filename, line, function), (_, calls, _, cumulative, _) in top:
+            # Служебные функции цикла событий (select — это простой, а не работа) не показываем
+            if function.startswith("<") or filename.startswith("<") or "profiling.py" in filename or os.sep + "asyncio" + os.sep in filename \
+                    or filename.endswith("selectors.py"):
+                continue
+            lines.append(f"{cumulative:.2f} с  {function} ({os.path.basename(filename)}:{line}), вызовов {calls}")
+            shown += 1
+            if shown >= limit:
+                break
+        lines += ["", "Ожидание (inclusive / self):"]
+        for name, seconds in sorted(self._sampler.inclusive.items(), key=lambda item: item[1], reverse=True)[:limit]:
+            lines.append(f"{seconds:.2f} / {self._sampler.own.get(name, 0.0):.2f} с  {name}")
+        return "\n".join(lines)
+
+
+# Глобальный профилировщик циклов процесса
+cycle_profiler = CycleProfiler()
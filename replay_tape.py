@@ -0,0 +1,228 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Воспроизведение ленты сообщений (TAPE_PATH) через проверку дубликатов и правил
+
+Лента записывается парсером при заданной переменной TAPE_PATH (см. tape.py).
+Скрипт прогоняет ее через process_messages без обращения к Telegram: пересылка
+заменена записью в отчет, отметки об обработке пишутся во временную базу SQLite.
+Выводит пропускную способность и сообщения, которые совпали бы с правилами.
+
+Пример запуска:
+    python replay_tape.py tape.jsonl.gz
+    python replay_tape.py tape.jsonl.gz --keywords "сша,санкции+экспорт" --stopwords реклама --report matches.csv
+    python replay_tape.py tape.jsonl.gz --speed 1
+"""
+
+import argparse
+import asyncio
+import csv
+import os
+import sys
+import tempfile
+import time
+from collections import Counter
+from dotenv import load_dotenv
+from loguru import logger
+from database import create_database, DEFAULT_RULE_SET_ID
+from sqlite_database import SQLiteDatabase
+from parser import MessageParser
+from metrics import percentile
+from tape import read_tape
+from matcher import DEFAULT_RULES
+
+# Загрузка переменных окружения
+load_dotenv()
+
+
+class ReplayParser(MessageParser):
+    """Парсер без пересылки: совпавшие сообщения записываются в matches."""
+
+    def __init__(self, db):
+        super().__init__(db, "replay")
+        self.delay_scale = 0
+        self.matches = []
+        self.page = {}
+        self._last_matched = 0
+
+    async def match_rules(self, message_text, keywords, stopwords, channel_mask=DEFAULT_RULES):
+        self._last_matched = await super().match_rules(message_text, keywords, stopwords, channel_mask)
+        return self._last_matched
+
+    async def forward_message(self, from_chat_id, message_id, targets=None):
+        message = self.page.get(message_id)
+        rule_names = self.rules.rule_names(self._last_matched) if self.rules else ["default"]
+        self.matches.append((str(from_chat_id), message_id, message.date if message else None,
+                             rule_names, message.text if message else ""))
+        await self.complete_message(from_chat_id, message_id)
+        return True
+
+
+async def copy_rules(source, target):
+    """Копирует ключевые слова, стоп-слова и наборы правил с подключениями в другую базу."""
+    await target.add_keywords(await source.get_keywords())
+    await target.add_stopwords(await source.get_stopwords())
+    ids = {DEFAULT_RULE_SET_ID: DEFAULT_RULE_SET_ID}
+    for rule_set in await source.get_rule_sets():
+        rule_set_id = await target.add_rule_set(
+            rule_set['name'], rule_set['owner_id'], rule_set['target_chat'], rule_set['rate_limit']
+        )
+        await target.add_rule_set_words(rule_set_id, rule_set['keywords'])
+        await target.add_rule_set_words(rule_set_id, rule_set['stopwords'], stop=True)
+        ids[rule_set['id']] = rule_set_id
+    for channel_id, rule_set_id in await source.get_rule_set_attachments():
+        if rule_set_id in ids:
+            await target.attach_rule_set(channel_id, ids[rule_set_id])
+
+
+class TapeReplay:
+    """Прогон ленты через проверку дубликатов и правил парсера.
+
+    Страницы подаются в process_messages в порядке записи, как в process_channel
+    (от старых сообщений к новым). При speed=0 лента воспроизводится с полной
+    скоростью, при speed=1 — в реальном времени по отметкам получения страниц,
+    при speed=10 — в десять раз быстрее.
+    """
+
+    def __init__(self, parser, speed=0.0):
+        """Инициализирует воспроизведение.
+
+        Args:
+            parser: Экземпляр ReplayParser
+            speed: Множитель скорости воспроизведения (0 — без пауз)
+        """
+        self.parser = parser
+        self.speed = speed
+
+    async def run(self, pages):
+        """Воспроизводит страницы ленты.
+
+        Returns:
+            Словарь со статистикой прогона
+        """
+        parser = self.parser
+        await parser.load_rules()
+        keywords, stopwords = parser.keywords, parser.stopwords
+        page_times = []
+        messages_total = 0
+        first_fetched = None
+        started = time.perf_counter()
+        for fetched_at, channel_id, messages in pages:
+            if self.speed:
+                if first_fetched is None:
+                    first_fetched = fetched_at
+                delay = (fetched_at - first_fetched).total_seconds() / self.speed - (time.perf_counter() - started)
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            parser.page = {message.message_id: message for message in messages}
+            page_started = time.perf_counter()
+            await parser.process_messages(channel_id, list(reversed(messages)), keywords, stopwords, trace=False)
+            page_times.append(time.perf_counter() - page_started)
+            messages_total += len(messages)
+        await parser.db.flush()
+        elapsed = time.perf_counter() - started
+        return {
+            "pages": len(page_times),
+            "messages": messages_total,
+            "matched": len(parser.matches),
+            "seconds": elapsed,
+            "processing_seconds": sum(page_times),
+            "page_p50": percentile(page_times, 0.5),
+            "page_p95": percentile(page_times, 0.95),
+            "page_max": max(page_times, default=0.0),
+        }
+
+
+def write_report(matches, path):
+    """Записывает совпадения в CSV (разделитель ;)."""
+    with open(path, "w", encoding="utf-8", newline="") as f:
+        writer = csv.writer(f, delimiter=";")
+        writer.writerow(("channel_id", "message_id", "date", "rule_sets", "text"))
+        for channel_id, message_id, date, rule_names, text in matches:
+            writer.writerow((channel_id, message_id, date.isoformat() if date else "", ",".join(rule_names), text))
+
+
+def split_words(value):
+    return [word.strip() for word in value.split(",") if word.strip()] if value else []
+
+
+async def main_async(args):
+    db = SQLiteDatabase(os.path.join(tempfile.mkdtemp(), "replay.db"))
+    if not await db.connect():
+        print("Не удалось открыть базу данных для воспроизведения")
+        return
+
+    try:
+        keywords = split_words(args.keywords)
+        if args.keywords_file:
+            with open(args.keywords_file, encoding="utf-8") as f:
+                keywords += [line.strip() for line in f if line.strip()]
+        if keywords:
+            # Кандидат: только набор по умолчанию из переданных слов
+            await db.add_keywords(keywords)
+            await db.add_stopwords(split_words(args.stopwords))
+        else:
+            # Текущие правила из рабочей базы
+            source = create_database()
+            if not await source.connect():
+                print("Не удалось подключиться к базе данных с правилами")
+                return
+            try:
+                await copy_rules(source, db)
+            finally:
+                await source.close()
+
+        parser = ReplayParser(db)
+        stats = await TapeReplay(parser, speed=args.speed).run(read_tape(args.tape))
+
+        print(f"Страниц: {stats['pages']}, сообщений: {stats['messages']}, совпало: {stats['matched']}")
+        print(f"Время: {stats['seconds']:.2f} с, проверка: {stats['processing_seconds']:.2f} с, "
+              f"{stats['messages'] / stats['processing_seconds'] if stats['processing_seconds'] else 0:.0f} сообщений/с")
+        print(f"Страница: p50 {stats['page_p50'] * 1000:.2f} мс, p95 {stats['page_p95'] * 1000:.2f} мс, "
+              f"максимум {stats['page_max'] * 1000:.2f} мс")
+        if parser.matches:
+            rule_counts = Counter(name for match in parser.matches for name in match[3])
+            channel_counts = Counter(match[0] for match in parser.matches)
+            print("Наборы: " + ", ".join(f"{name} {count}" for name, count in rule_counts.most_common()))
+            print("Каналы: " + ", ".join(f"{channel} {count}" for channel, count in channel_counts.most_common(10)))
+            keyword_counts = sorted(parser.hit_counters.keywords.items(), key=lambda item: item[1][0], reverse=True)
+            print("Ключевые слова: " + ", ".join(f"{keyword} {counter[0]}" for (_, keyword), counter in keyword_counts[:10]))
+        if args.report:
+            write_report(parser.matches, args.report)
+            print(f"Совпадения записаны в {args.report}")
+        elif parser.matches:
+            print()
+            for channel_id, message_id, date, rule_names, text in parser.matches[:args.limit]:
+                print(f"{channel_id}/{message_id} [{', '.join(rule_names)}]: {text[:100]}")
+            if len(parser.matches) > args.limit:
+                print(f"...и еще {len(parser.matches) - args.limit} (полный список: --report)")
+    finally:
+        await db.close()
+
+
+def main():
+    """Запускает скрипт."""
+    arg_parser = argparse.ArgumentParser(description="Воспроизведение ленты сообщений через правила парсера")
+    arg_parser.add_argument("tape", help="Файл ленты (TAPE_PATH)")
+    arg_parser.add_argument("--keywords", default=None, help="Ключевые слова кандидата через запятую")
+    arg_parser.add_argument("--keywords-file", default=None, help="Файл с ключевыми словами кандидата, по слову в строке")
+    arg_parser.add_argument("--stopwords", default=None, help="Стоп-слова кандидата через запятую")
+    arg_parser.add_argument("--speed", type=float, default=0.0, help="Скорость: 0 — максимальная, 1 — реальное время")
+    arg_parser.add_argument("--report", default=None, help="CSV-файл со всеми совпадениями")
+    arg_parser.add_argument("--limit", type=int, default=30, help="Сколько совпадений вывести без --report")
+    arg_parser.add_argument("--log-level", default="WARNING", help="Уровень логов парсера")
+    args = arg_parser.parse_args()
+
+    # Подробные логи парсера искажают замер, оставляем только предупреждения
+    logger.remove()
+    logger.add(sys.stderr, level=args.log_level)
+
+    try:
+        asyncio.run(main_async(args))
+    except KeyboardInterrupt:
+        print("Скрипт остановлен пользователем")
+
+
+if __name__ == "__main__":
+    main()
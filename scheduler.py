@@ -1,17 +1,31 @@
 import asyncio
 import logging
-from datetime import datetime
+import os
+import time
+from datetime import datetime, timedelta
 from telegram import Bot
 from telegram.error import TelegramError, BadRequest, Forbidden
 from database import Database
 from parser import MessageParser
+import metrics
+from profiling import cycle_profiler
 
 logger = logging.getLogger(__name__)
 
 class MessageScheduler:
-    """Планировщик для периодического запуска парсера сообщений."""
+    """Планировщик для периодического запуска парсера сообщений.
     
-    def __init__(self, db, target_channel_id, check_interval=3, signature="", telethon_client=None):
+    Циклы запускаются с фиксированной частотой по монотонным дедлайнам
+    (старт + k * интервал), поэтому период не растет вместе с длительностью
+    цикла. Пересылки выполняются фоновой задачей из очереди парсера, и
+    следующий цикл начинает получать сообщения, пока предыдущий дописывает
+    пересылки. Если цикл не уложился в интервал, пропущенные запуски не
+    накапливаются: следующий цикл стартует в ближайший дедлайн, а при политике
+    shrink число каналов в цикле уменьшается.
+    """
+    
+    def __init__(self, db, target_channel_id, check_interval=3, signature="", telethon_client=None,
+                 overrun_policy=None):
         """Инициализирует планировщик.
         
         Args:
@@ -20,6 +34,7 @@ class MessageScheduler:
             check_interval: Интервал проверки в минутах
             signature: Подпись для пересылаемых сообщений
             telethon_client: Экземпляр клиента Telethon (опционально)
+            overrun_policy: Реакция на перегрузку: skip (пропуск запусков) или shrink (сокращение цикла)
         """
         self.db = db
         self.target_channel_id = target_channel_id
@@ -28,6 +43,20 @@ class MessageScheduler:
         self.is_running = False
         self.parser = MessageParser(db, target_channel_id, check_interval, signature, telethon_client=telethon_client)
         self._task = None
+        self._drain_task = None
+        
+        # Период и дедлайн следующего запуска по монотонным часам
+        self.period = check_interval * 60
+        self.overrun_policy = (overrun_policy or os.getenv("SCHEDULER_OVERRUN_POLICY", "skip")).lower()
+        self.overruns = 0
+        self.next_run_at = None
+        self._deadline = None
+        
+    def next_run_in(self):
+        """Возвращает число секунд до следующего запуска или None."""
+        if self._deadline is None or not self.is_running:
+            return None
+        return max(0.0, self._deadline - time.monotonic())
         
     def start(self):
         """Запускает планировщик."""
@@ -38,6 +67,9 @@ class MessageScheduler:
         self.is_running = True
         # Создаем задачу с использованием базового цикла событий
         loop = asyncio.get_event_loop()
+        if self.parser.forward_queue is None:
+            self.parser.forward_queue = asyncio.Queue()
+        self._drain_task = loop.create_task(self.parser.drain_forwards())
         self._task = loop.create_task(self._run())
         logger.info("Планировщик запущен")
         
@@ -50,24 +82,95 @@ class MessageScheduler:
         self.is_running = False
         if self._task:
             self._task.cancel()
+        if self._drain_task:
+            self._drain_task.cancel()
+        self.next_run_at = None
         logger.info("Планировщик остановлен")
+    
+    async def shutdown(self):
+        """Останавливает планировщик, дожидается его задач и записывает накопленное в базу.
+        
+        Вызывается перед закрытием базы: счетчики совпадений текущего цикла
+        и пересылок из очереди иначе теряются при перезапуске.
+        """
+        if self.is_running:
+            self.stop()
+        tasks = [task for task in (self._task, self._drain_task) if task]
+        if tasks:
+            await asyncio.gather(*tasks, return_exceptions=True)
+        self._task = self._drain_task = None
+        try:
+            await self.parser.hit_counters.flush(self.db)
+            await self.db.flush()
+        except Exception as e:
+            logger.error(f"Ошибка при записи состояния парсера при остановке: {e}")
+        
+    def _schedule(self, deadline):
+        """Запоминает дедлайн следующего запуска."""
+        self._deadline = deadline
+        delay = max(0.0, deadline - time.monotonic())
+        self.next_run_at = datetime.now() + timedelta(seconds=delay)
+        metrics.SCHEDULER_NEXT_RUN.set(time.time() + delay)
+        
+    def _next_deadline(self, deadline, duration):
+        """Вычисляет следующий дедлайн и обрабатывает перегрузку.
+        
+        Args:
+            deadline: Дедлайн только что завершенного цикла
+            duration: Длительность цикла в секундах
+        """
+        next_deadline = deadline + self.period
+        now = time.monotonic()
+        
+        if now > next_deadline:
+            # Цикл не уложился в интервал: пропускаем просроченные запуски
+            missed = int((now - next_deadline) // self.period) + 1
+            next_deadline += missed * self.period
+            self.overruns += 1
+            metrics.SCHEDULER_OVERRUNS.inc()
+            metrics.SCHEDULER_SKIPPED_TICKS.inc(missed)
+            logger.warning(f"Цикл занял {duration:.0f} сек. при интервале {self.period:.0f} сек., пропущено запусков: {missed}")
+            
+            if self.overrun_policy == "shrink" and self.parser.last_cycle_channels:
+                # Оставляем столько каналов, сколько успевает обработаться за 80% интервала
+                budget = max(1, int(self.parser.last_cycle_channels * self.period * 0.8 / duration))
+                if budget < self.parser.last_cycle_channels:
+                    self.parser.channel_budget = budget
+                    logger.warning(f"Число каналов в цикле сокращено до {budget}")
+        elif self.parser.channel_budget and duration < self.period * 0.5:
+            # Нагрузка спала: постепенно возвращаем каналы в цикл
+            budget = self.parser.channel_budget + max(1, self.parser.channel_budget // 4)
+            self.parser.channel_budget = None if budget >= self.parser.max_channels_per_run else budget
+        
+        return next_deadline
         
     async def _run(self):
-        """Запускает периодическую проверку каналов."""
+        """Запускает проверку каналов с фиксированной частотой."""
         try:
+            deadline = time.monotonic()
             while self.is_running:
+                self._schedule(deadline)
+                delay = deadline - time.monotonic()
+                if delay > 0:
+                    logger.info(f"Следующая проверка в {self.next_run_at.strftime('%H:%M:%S')}")
+                    await asyncio.sleep(delay)
+                
+                started = time.monotonic()
                 try:
                     # Запускаем парсер
                     logger.info(f"Запуск проверки каналов в {datetime.now().strftime('%H:%M:%S')}")
-                    await self.parser.run()
-                    
-                    # Ждем указанный интервал перед следующей проверкой
-                    logger.info(f"Следующая проверка через {self.check_interval} минут")
-                    await asyncio.sleep(self.check_interval * 60)
+                    metrics.SCHEDULER_LAST_RUN.set(time.time())
+                    if cycle_profiler.armed:
+                        await cycle_profiler.profile(self.parser.run)
+                    else:
+                        await self.parser.run()
+                    metrics.SCHEDULER_CYCLES.inc(result="ok")
                 except Exception as e:
+                    # Ошибка не сдвигает расписание: следующий цикл стартует в свой дедлайн
                     logger.error(f"Ошибка при выполнении планировщика: {e}")
-                    # Короткая пауза перед повторной попыткой в случае ошибки
-                    await asyncio.sleep(60)
+                    metrics.SCHEDULER_CYCLES.inc(result="error")
+                
+                deadline = self._next_deadline(deadline, time.monotonic() - started)
         except asyncio.CancelledError:
             logger.info("Задача планировщика отменена")
-            raise 
\ No newline at end of file
+            raise
@@ -0,0 +1,742 @@
+import asyncio
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from loguru import logger
+import config
+import metrics
+from database import (
+    BaseDatabase, archive_terms, archive_date, keyset_page, like_pattern, group_rule_sets, RULE_SET_COLUMNS, KEYWORD_STATS_QUERY,
+)
+
+
+class SQLiteDatabase(BaseDatabase):
+    """Встроенное хранилище на SQLite для однонодовых установок.
+
+    Все обращения к соединению выполняются в одном выделенном потоке, поэтому
+    event loop не блокируется, а соединение не разделяется между потоками.
+    База работает в режиме WAL, отметки об обработанных сообщениях
+    накапливаются в памяти и записываются одной транзакцией (executemany).
+    """
+
+    def __init__(self, path=None, batch_size=None):
+        self.path = path or config.SQLITE_PATH
+        self.batch_size = batch_size or config.SQLITE_BATCH_SIZE
+        self.conn = None
+        self._executor = None
+        # Отложенные отметки об обработке: {(channel_id, message_id), ...}
+        self._pending_processed = set()
+
+    async def _run(self, func, *args):
+        """Выполняет func в потоке, владеющем соединением."""
+        loop = asyncio.get_running_loop()
+        started = time.perf_counter()
+        try:
+            return await loop.run_in_executor(self._executor, func, *args)
+        finally:
+            metrics.DB_QUERY_SECONDS.observe(time.perf_counter() - started, backend="sqlite")
+
+    async def _execute(self, sql, params=()):
+        def run():
+            with self.conn:
+                return self.conn.execute(sql, params).rowcount
+        return await self._run(run)
+
+    async def _executemany(self, sql, rows):
+        def run():
+            with self.conn:
+                self.conn.executemany(sql, rows)
+        await self._run(run)
+
+    async def _fetch(self, sql, params=()):
+        return await self._run(lambda: self.conn.execute(sql, params).fetchall())
+
+    async def _fetchval(self, sql, params=()):
+        def run():
+            row = self.conn.execute(sql, params).fetchone()
+            return row[0] if row else None
+        return await self._run(run)
+
+    def _open(self):
+        # cached_statements: подготовленные выражения переиспользуются между вызовами
+        conn = sqlite3.connect(self.path, cached_statements=256)
+        conn.row_factory = sqlite3.Row
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.execute('PRAGMA foreign_keys=ON')
+        conn.execute('PRAGMA temp_store=MEMORY')
+
+        with conn:
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS channels (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    channel_id TEXT UNIQUE NOT NULL,
+                    name TEXT,
+                    is_active INTEGER DEFAULT 1
+                )
+            ''')
+            # Результат последней проверки канала (check_channels.py)
+            columns = {row['name'] for row in conn.execute('PRAGMA table_info(channels)')}
+            for column in ('status', 'last_post_at', 'checked_at'):
+                if column not in columns:
+                    conn.execute(f'ALTER TABLE channels ADD COLUMN {column} TEXT')
+
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS keywords (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    word TEXT UNIQUE NOT NULL,
+                    is_active INTEGER DEFAULT 1
+                )
+            ''')
+
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS stopwords (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    word TEXT UNIQUE NOT NULL,
+                    is_active INTEGER DEFAULT 1
+                )
+            ''')
+
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS processed_messages (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    channel_id TEXT NOT NULL,
+                    message_id INTEGER NOT NULL,
+                    processed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    UNIQUE(channel_id, message_id)
+                )
+            ''')
+
+            # Архив текстов сообщений и его полнотекстовый индекс FTS5,
+            # синхронизируемый триггерами
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS message_archive (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    channel_id TEXT NOT NULL,
+                    message_id INTEGER NOT NULL,
+                    text TEXT NOT NULL,
+                    date TEXT NOT NULL,
+                    UNIQUE(channel_id, message_id)
+                )
+            ''')
+            # Отметка пересылки: такое сообщение не пересылается повторно при проверке архива
+            columns = {row['name'] for row in conn.execute('PRAGMA table_info(message_archive)')}
+            if 'forwarded' not in columns:
+                conn.execute('ALTER TABLE message_archive ADD COLUMN forwarded INTEGER NOT NULL DEFAULT 0')
+            conn.execute('CREATE INDEX IF NOT EXISTS message_archive_date_idx ON message_archive (date)')
+            conn.execute('''
+                CREATE VIRTUAL TABLE IF NOT EXISTS message_archive_fts USING fts5(
+                    text, content='message_archive', content_rowid='id',
+                    tokenize='unicode61 remove_diacritics 2'
+                )
+            ''')
+            conn.execute('''
+                CREATE TRIGGER IF NOT EXISTS message_archive_ai AFTER INSERT ON message_archive BEGIN
+                    INSERT INTO message_archive_fts (rowid, text) VALUES (new.id, new.text);
+                END
+            ''')
+            conn.execute('''
+                CREATE TRIGGER IF NOT EXISTS message_archive_ad AFTER DELETE ON message_archive BEGIN
+                    INSERT INTO message_archive_fts (message_archive_fts, rowid, text) VALUES ('delete', old.id, old.text);
+                END
+            ''')
+            conn.execute('''
+                CREATE TRIGGER IF NOT EXISTS message_archive_au AFTER UPDATE ON message_archive BEGIN
+                    INSERT INTO message_archive_fts (message_archive_fts, rowid, text) VALUES ('delete', old.id, old.text);
+                    INSERT INTO message_archive_fts (rowid, text) VALUES (new.id, new.text);
+                END
+            ''')
+
+            # Индекс каналов, доступных через аккаунт Telethon
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS dialogs (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    channel_id TEXT UNIQUE NOT NULL,
+                    title TEXT,
+                    title_lower TEXT,
+                    username TEXT,
+                    updated_at TEXT NOT NULL
+                )
+            ''')
+
+            # Контрольные точки дозагрузки истории каналов
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS backfill_state (
+                    channel_id TEXT PRIMARY KEY,
+                    offset_id INTEGER NOT NULL DEFAULT 0,
+                    scanned INTEGER NOT NULL DEFAULT 0,
+                    done INTEGER DEFAULT 0,
+                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            ''')
+
+            # Наборы правил каналов (rule_set_id = 0 — набор по умолчанию);
+            # набор с владельцем — подписка пользователя со своим чатом и лимитом
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS rule_sets (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    name TEXT UNIQUE NOT NULL,
+                    owner_id INTEGER,
+                    target_chat TEXT,
+                    rate_limit INTEGER
+                )
+            ''')
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS rule_set_words (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    rule_set_id INTEGER NOT NULL REFERENCES rule_sets (id) ON DELETE CASCADE,
+                    word TEXT NOT NULL,
+                    is_stopword INTEGER NOT NULL DEFAULT 0,
+                    UNIQUE (rule_set_id, is_stopword, word)
+                )
+            ''')
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS channel_rule_sets (
+                    channel_id TEXT NOT NULL,
+                    rule_set_id INTEGER NOT NULL,
+                    PRIMARY KEY (channel_id, rule_set_id)
+                )
+            ''')
+
+            # Счетчики совпадений по ключевым словам (rule_set_id = 0 — набор по умолчанию) и каналам
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS keyword_stats (
+                    rule_set_id INTEGER NOT NULL,
+                    keyword TEXT NOT NULL,
+                    hits INTEGER NOT NULL DEFAULT 0,
+                    forwards INTEGER NOT NULL DEFAULT 0,
+                    last_hit_at TEXT,
+                    PRIMARY KEY (rule_set_id, keyword)
+                )
+            ''')
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS channel_stats (
+                    channel_id TEXT PRIMARY KEY,
+                    hits INTEGER NOT NULL DEFAULT 0,
+                    forwards INTEGER NOT NULL DEFAULT 0,
+                    last_hit_at TEXT
+                )
+            ''')
+
+            # Сессии Telethon (TELETHON_SESSION_STORE=database), по таблицам SQLiteSession
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS telethon_sessions (
+                    name TEXT PRIMARY KEY,
+                    dc_id INTEGER,
+                    server_address TEXT,
+                    port INTEGER,
+                    auth_key BLOB,
+                    takeout_id INTEGER
+                )
+            ''')
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS telethon_entities (
+                    session_name TEXT NOT NULL,
+                    id INTEGER NOT NULL,
+                    hash INTEGER NOT NULL,
+                    username TEXT,
+                    phone TEXT,
+                    name TEXT,
+                    date INTEGER,
+                    PRIMARY KEY (session_name, id)
+                )
+            ''')
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS telethon_update_state (
+                    session_name TEXT NOT NULL,
+                    id INTEGER NOT NULL,
+                    pts INTEGER,
+                    qts INTEGER,
+                    date INTEGER,
+                    seq INTEGER,
+                    PRIMARY KEY (session_name, id)
+                )
+            ''')
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS telethon_sent_files (
+                    session_name TEXT NOT NULL,
+                    md5_digest BLOB NOT NULL,
+                    file_size INTEGER NOT NULL,
+                    type INTEGER NOT NULL,
+                    id INTEGER,
+                    hash INTEGER,
+                    PRIMARY KEY (session_name, md5_digest, file_size, type)
+                )
+            ''')
+        return conn
+
+    async def connect(self):
+        try:
+            self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="sqlite")
+            self.conn = await self._run(self._open)
+            logger.info(f"База данных SQLite {self.path} успешно подключена и инициализирована")
+            return True
+        except Exception as e:
+            logger.error(f"Ошибка подключения к базе данных SQLite: {e}")
+            return False
+
+    async def close(self):
+        if self.conn:
+            await self.flush()
+            await self._run(self.conn.close)
+            self.conn = None
+        if self._executor:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+
+    async def flush(self):
+        if not self._pending_processed or not self.conn:
+            return
+        rows = list(self._pending_processed)
+        self._pending_processed.clear()
+        try:
+            await self._executemany(
+                'INSERT OR IGNORE INTO processed_messages (channel_id, message_id) VALUES (?, ?)',
+                rows
+            )
+            logger.debug(f"Записано {len(rows)} отметок об обработке сообщений")
+        except Exception as e:
+            # Возвращаем записи в буфер, чтобы не потерять их
+            self._pending_processed.update(rows)
+            logger.error(f"Ошибка при пакетной записи обработанных сообщений: {e}")
+
+    async def add_channel(self, channel_id, name=None):
+        await self._execute(
+            'INSERT INTO channels (channel_id, name) VALUES (?, ?) ON CONFLICT (channel_id) DO UPDATE SET name = excluded.name, is_active = 1',
+            (str(channel_id), name)
+        )
+
+    async def remove_channel(self, channel_id):
+        await self._execute('DELETE FROM channels WHERE channel_id = ?', (str(channel_id),))
+
+    async def get_channels(self):
+        return await self._fetch('SELECT * FROM channels WHERE is_active = 1')
+
+    async def save_channel_audit(self, results):
+        checked_at = datetime.now(timezone.utc).isoformat()
+        await self._executemany(
+            'UPDATE channels SET status = ?, name = COALESCE(?, name), last_post_at = ?, '
+            'is_active = ?, checked_at = ? WHERE channel_id = ?',
+            [(s, n, archive_date(d).isoformat() if d else None, int(a), checked_at, str(c))
+             for c, s, n, d, a in results]
+        )
+
+    async def add_keyword(self, word):
+        return await self._execute(
+            'INSERT INTO keywords (word) VALUES (?) ON CONFLICT (word) DO UPDATE SET is_active = 1 '
+            'WHERE is_active IS NOT 1',
+            (word,)
+        ) > 0
+
+    async def remove_keyword(self, word):
+        await self._execute('DELETE FROM keywords WHERE word = ?', (word,))
+
+    async def get_keywords(self):
+        rows = await self._fetch('SELECT word FROM keywords WHERE is_active = 1')
+        return [k['word'] for k in rows]
+
+    async def add_stopword(self, word):
+        await self._execute(
+            'INSERT INTO stopwords (word) VALUES (?) ON CONFLICT (word) DO UPDATE SET is_active = 1',
+            (word,)
+        )
+
+    async def remove_stopword(self, word):
+        await self._execute('DELETE FROM stopwords WHERE word = ?', (word,))
+
+    async def get_stopwords(self):
+        rows = await self._fetch('SELECT word FROM stopwords WHERE is_active = 1')
+        return [s['word'] for s in rows]
+
+    async def mark_message_processed(self, channel_id, message_id):
+        # Запись откладывается до flush(), который вызывается в конце цикла
+        # или при заполнении буфера
+        self._pending_processed.add((str(channel_id), int(message_id)))
+        if len(self._pending_processed) >= self.batch_size:
+            await self.flush()
+
+    async def is_message_processed(self, channel_id, message_id):
+        key = (str(channel_id), int(message_id))
+        if key in self._pending_processed:
+            return True
+        try:
+            result = await self._fetchval(
+                'SELECT EXISTS(SELECT 1 FROM processed_messages WHERE channel_id = ? AND message_id = ?)',
+                key
+            )
+            return bool(result)
+        except Exception as e:
+            logger.error(f"Ошибка при проверке статуса обработки сообщения: {e}")
+            return False
+
+    async def get_channel_state(self, channel_id):
+        channel_id = str(channel_id)
+        last_message_id = await self._fetchval(
+            'SELECT MAX(message_id) FROM processed_messages WHERE channel_id = ?',
+            (channel_id,)
+        )
+        pending = [m for c, m in self._pending_processed if c == channel_id]
+        if pending:
+            last_message_id = max(pending + ([last_message_id] if last_message_id is not None else []))
+        return last_message_id is None, last_message_id
+
+    async def archive_messages(self, channel_id, messages):
+        rows = [
+            (str(channel_id), m.message_id, m.text, archive_date(getattr(m, 'date', None)).isoformat())
+            for m in messages if m.text
+        ]
+        if not rows:
+            return
+        await self._executemany(
+            'INSERT INTO message_archive (channel_id, message_id, text, date) VALUES (?, ?, ?, ?) '
+            'ON CONFLICT (channel_id, message_id) DO UPDATE SET text = excluded.text '
+            'WHERE text != excluded.text',
+            rows
+        )
+
+    async def mark_archive_forwarded(self, channel_id, message_id):
+        await self._execute(
+            'UPDATE message_archive SET forwarded = 1 WHERE channel_id = ? AND message_id = ?',
+            (str(channel_id), int(message_id))
+        )
+
+    async def search_archive(self, keyword, since, limit=1000):
+        terms = archive_terms(keyword)
+        if not terms:
+            return []
+        # Префиксный поиск ("слово"*) приближает семантику поиска подстроки
+        query = ' AND '.join(f'"{t}"*' for t in terms)
+        return await self._fetch(
+            'SELECT a.channel_id, a.message_id, a.text, a.date FROM message_archive_fts f '
+            'JOIN message_archive a ON a.id = f.rowid '
+            'WHERE message_archive_fts MATCH ? AND a.date >= ? AND a.forwarded = 0 ORDER BY a.date LIMIT ?',
+            (query, archive_date(since).isoformat(), limit)
+        )
+
+    async def _stream(self, table, columns, time_column, since, until, channels, batch_size):
+        """Читает таблицу пачками по ключу id.
+
+        Каждая пачка — отдельный короткий запрос, поэтому запись парсера
+        выполняется между пачками, а не ждет конца выгрузки.
+        """
+        conditions, params = [], []
+        for op, value in (('>=', since), ('<', until)):
+            if value is not None:
+                conditions.append(f'{time_column} {op} ?')
+                params.append(value)
+        if channels:
+            conditions.append(f'channel_id IN ({", ".join("?" * len(channels))})')
+            params.extend(str(c) for c in channels)
+        where = ''.join(f' AND {c}' for c in conditions)
+        last_id = 0
+        while True:
+            rows = await self._fetch(
+                f'SELECT id, {columns} FROM {table} WHERE id > ?{where} ORDER BY id LIMIT ?',
+                (last_id, *params, batch_size)
+            )
+            if not rows:
+                break
+            last_id = rows[-1]['id']
+            yield rows
+
+    async def iter_processed_messages(self, since=None, until=None, channels=None, batch_size=5000):
+        # Отложенные отметки тоже попадают в выгрузку
+        await self.flush()
+        # processed_at заполняется CURRENT_TIMESTAMP: 'ГГГГ-ММ-ДД ЧЧ:ММ:СС' в UTC
+        since, until = (archive_date(v).strftime('%Y-%m-%d %H:%M:%S') if v else None for v in (since, until))
+        async for rows in self._stream('processed_messages', 'channel_id, message_id, processed_at', 'processed_at',
+                                       since, until, channels, batch_size):
+            yield [
+                {**dict(r), 'processed_at': datetime.fromisoformat(r['processed_at']).replace(tzinfo=timezone.utc)}
+                for r in rows
+            ]
+
+    def iter_archived_messages(self, since=None, until=None, channels=None, batch_size=5000):
+        since, until = (archive_date(v).isoformat() if v else None for v in (since, until))
+        return self._stream('message_archive', 'channel_id, message_id, date, text', 'date',
+                            since, until, channels, batch_size)
+
+    async def prune_archive(self, days):
+        cutoff = datetime.now(timezone.utc) - timedelta(days=days)
+        await self._execute('DELETE FROM message_archive WHERE date < ?', (cutoff.isoformat(),))
+
+    async def add_channels(self, channels):
+        rows = list({str(c[0]): (str(c[0]), c[1]) for c in channels}.values())
+        await self._executemany(
+            'INSERT INTO channels (channel_id, name) VALUES (?, ?) '
+            'ON CONFLICT (channel_id) DO UPDATE SET name = COALESCE(excluded.name, channels.name), is_active = 1',
+            rows
+        )
+        return len(rows)
+
+    async def _add_words(self, table, words):
+        rows = [(w,) for w in dict.fromkeys(words)]
+        await self._executemany(
+            f'INSERT INTO {table} (word) VALUES (?) ON CONFLICT (word) DO UPDATE SET is_active = 1',
+            rows
+        )
+        return len(rows)
+
+    async def add_keywords(self, words):
+        return await self._add_words('keywords', words)
+
+    async def add_stopwords(self, words):
+        return await self._add_words('stopwords', words)
+
+    async def remove_all_keywords(self):
+        await self._execute('DELETE FROM keywords')
+
+    async def remove_all_stopwords(self):
+        await self._execute('DELETE FROM stopwords')
+
+    async def get_counts(self):
+        rows = await self._fetch('''
+            SELECT
+                (SELECT COUNT(*) FROM channels WHERE is_active = 1) AS channels,
+                (SELECT COUNT(*) FROM keywords WHERE is_active = 1) AS keywords,
+                (SELECT COUNT(*) FROM stopwords WHERE is_active = 1) AS stopwords
+        ''')
+        return dict(rows[0])
+
+    async def _page(self, table, columns, after_id, before_id, limit):
+        # Имена таблиц и колонок задаются только в коде, не пользователем
+        if before_id is not None:
+            sql = f'SELECT {columns} FROM {table} WHERE is_active = 1 AND id < ? ORDER BY id DESC LIMIT ?'
+            params = (before_id, limit + 1)
+        else:
+            sql = f'SELECT {columns} FROM {table} WHERE is_active = 1 AND id > ? ORDER BY id LIMIT ?'
+            params = (after_id or 0, limit + 1)
+        rows = await self._fetch(sql, params)
+        return keyset_page(rows, limit, after_id, before_id)
+
+    async def get_channels_page(self, after_id=None, before_id=None, limit=20):
+        return await self._page('channels', 'id, channel_id, name', after_id, before_id, limit)
+
+    async def get_keywords_page(self, after_id=None, before_id=None, limit=20):
+        return await self._page('keywords', 'id, word', after_id, before_id, limit)
+
+    async def get_stopwords_page(self, after_id=None, before_id=None, limit=20):
+        return await self._page('stopwords', 'id, word', after_id, before_id, limit)
+
+    async def _delete_returning(self, sql, row_id):
+        def run():
+            with self.conn:
+                row = self.conn.execute(sql, (row_id,)).fetchone()
+            return row[0] if row else None
+        return await self._run(run)
+
+    async def remove_channel_by_id(self, row_id):
+        return await self._delete_returning('DELETE FROM channels WHERE id = ? RETURNING channel_id', row_id)
+
+    async def remove_keyword_by_id(self, row_id):
+        return await self._delete_returning('DELETE FROM keywords WHERE id = ? RETURNING word', row_id)
+
+    async def remove_stopword_by_id(self, row_id):
+        return await self._delete_returning('DELETE FROM stopwords WHERE id = ? RETURNING word', row_id)
+
+    async def upsert_dialogs(self, dialogs, seen_at):
+        seen_at = archive_date(seen_at).isoformat()
+        rows = [(str(c), t, (t or '').lower(), u, seen_at) for c, t, u in dialogs]
+        if not rows:
+            return
+        await self._executemany(
+            'INSERT INTO dialogs (channel_id, title, title_lower, username, updated_at) VALUES (?, ?, ?, ?, ?) '
+            'ON CONFLICT (channel_id) DO UPDATE SET title = excluded.title, title_lower = excluded.title_lower, '
+            'username = excluded.username, updated_at = excluded.updated_at',
+            rows
+        )
+
+    async def remove_dialog(self, channel_id):
+        await self._execute('DELETE FROM dialogs WHERE channel_id = ?', (str(channel_id),))
+
+    async def prune_dialogs(self, seen_before):
+        await self._execute('DELETE FROM dialogs WHERE updated_at < ?', (archive_date(seen_before).isoformat(),))
+
+    async def get_dialogs_updated_at(self):
+        value = await self._fetchval('SELECT MAX(updated_at) FROM dialogs')
+        return datetime.fromisoformat(value) if value else None
+
+    async def get_dialogs_page(self, query=None, after_id=None, before_id=None, limit=20):
+        pattern = like_pattern(query)
+        columns = '''d.id, d.channel_id, d.title, d.username,
+            EXISTS(SELECT 1 FROM channels c WHERE c.channel_id = d.channel_id
+                   OR lower(c.channel_id) = '@' || lower(d.username)) AS monitored'''
+        if before_id is not None:
+            sql = f"SELECT {columns} FROM dialogs d WHERE d.title_lower LIKE ? ESCAPE '\\' AND d.id < ? ORDER BY d.id DESC LIMIT ?"
+            params = (pattern, before_id, limit + 1)
+        else:
+            sql = f"SELECT {columns} FROM dialogs d WHERE d.title_lower LIKE ? ESCAPE '\\' AND d.id > ? ORDER BY d.id LIMIT ?"
+            params = (pattern, after_id or 0, limit + 1)
+        rows = await self._fetch(sql, params)
+        return keyset_page(rows, limit, after_id, before_id)
+
+    async def get_dialog(self, row_id):
+        rows = await self._fetch('SELECT * FROM dialogs WHERE id = ?', (row_id,))
+        return rows[0] if rows else None
+
+    async def get_backfill_state(self, channel_id):
+        rows = await self._fetch('SELECT * FROM backfill_state WHERE channel_id = ?', (str(channel_id),))
+        return rows[0] if rows else None
+
+    async def save_backfill_state(self, channel_id, offset_id, scanned, done=False):
+        await self._execute(
+            'INSERT INTO backfill_state (channel_id, offset_id, scanned, done, updated_at) '
+            'VALUES (?, ?, ?, ?, CURRENT_TIMESTAMP) '
+            'ON CONFLICT (channel_id) DO UPDATE SET offset_id = excluded.offset_id, scanned = excluded.scanned, '
+            'done = excluded.done, updated_at = CURRENT_TIMESTAMP',
+            (str(channel_id), offset_id, scanned, int(done))
+        )
+
+    async def reset_backfill_state(self, channel_id):
+        await self._execute('DELETE FROM backfill_state WHERE channel_id = ?', (str(channel_id),))
+
+    async def get_rule_set(self, name):
+        rows = await self._fetch(f'SELECT {RULE_SET_COLUMNS} FROM rule_sets WHERE name = ?', (name,))
+        return dict(rows[0]) if rows else None
+
+    async def add_rule_set(self, name, owner_id=None, target_chat=None, rate_limit=None):
+        def run():
+            with self.conn:
+                return self.conn.execute(
+                    'INSERT INTO rule_sets (name, owner_id, target_chat, rate_limit) VALUES (?, ?, ?, ?) '
+                    'ON CONFLICT (name) DO UPDATE SET owner_id = COALESCE(excluded.owner_id, rule_sets.owner_id), '
+                    'target_chat = COALESCE(excluded.target_chat, rule_sets.target_chat), '
+                    'rate_limit = COALESCE(excluded.rate_limit, rule_sets.rate_limit) RETURNING id',
+                    (name, owner_id, None if target_chat is None else str(target_chat), rate_limit)
+                ).fetchone()[0]
+        return await self._run(run)
+
+    async def remove_rule_set(self, rule_set_id):
+        def run():
+            with self.conn:
+                self.conn.execute('DELETE FROM channel_rule_sets WHERE rule_set_id = ?', (rule_set_id,))
+                self.conn.execute('DELETE FROM keyword_stats WHERE rule_set_id = ?', (rule_set_id,))
+                self.conn.execute('DELETE FROM rule_sets WHERE id = ?', (rule_set_id,))
+        await self._run(run)
+
+    async def add_rule_set_words(self, rule_set_id, words, stop=False):
+        rows = [(rule_set_id, w, int(stop)) for w in dict.fromkeys(words)]
+        await self._executemany(
+            'INSERT OR IGNORE INTO rule_set_words (rule_set_id, word, is_stopword) VALUES (?, ?, ?)',
+            rows
+        )
+        return len(rows)
+
+    async def _delete(self, sql, params):
+        def run():
+            with self.conn:
+                return self.conn.execute(sql, params).rowcount > 0
+        return await self._run(run)
+
+    async def remove_rule_set_word(self, rule_set_id, word, stop=False):
+        return await self._delete(
+            'DELETE FROM rule_set_words WHERE rule_set_id = ? AND word = ? AND is_stopword = ?',
+            (rule_set_id, word, int(stop))
+        )
+
+    async def attach_rule_set(self, channel_id, rule_set_id):
+        await self._execute(
+            'INSERT OR IGNORE INTO channel_rule_sets (channel_id, rule_set_id) VALUES (?, ?)',
+            (str(channel_id), rule_set_id)
+        )
+
+    async def detach_rule_set(self, channel_id, rule_set_id):
+        return await self._delete(
+            'DELETE FROM channel_rule_sets WHERE channel_id = ? AND rule_set_id = ?',
+            (str(channel_id), rule_set_id)
+        )
+
+    async def get_rule_sets(self):
+        sets = await self._fetch(f'SELECT {RULE_SET_COLUMNS} FROM rule_sets ORDER BY id')
+        words = await self._fetch('SELECT rule_set_id, word, is_stopword FROM rule_set_words ORDER BY id')
+        return group_rule_sets(sets, words)
+
+    async def get_rule_set_attachments(self):
+        rows = await self._fetch('SELECT channel_id, rule_set_id FROM channel_rule_sets')
+        return [(row['channel_id'], row['rule_set_id']) for row in rows]
+
+    async def save_hit_counts(self, keyword_rows, channel_rows):
+        # Время хранится в ISO 8601 (UTC), поэтому MAX сравнивает строки как даты
+        def last_hit(value):
+            return archive_date(value).isoformat() if value else None
+
+        def run():
+            with self.conn:
+                self.conn.executemany(
+                    'INSERT INTO keyword_stats (rule_set_id, keyword, hits, forwards, last_hit_at) VALUES (?, ?, ?, ?, ?) '
+                    'ON CONFLICT (rule_set_id, keyword) DO UPDATE SET hits = hits + excluded.hits, '
+                    'forwards = forwards + excluded.forwards, '
+                    'last_hit_at = COALESCE(MAX(last_hit_at, excluded.last_hit_at), last_hit_at, excluded.last_hit_at)',
+                    [(r, k, h, f, last_hit(t)) for r, k, h, f, t in keyword_rows]
+                )
+                self.conn.executemany(
+                    'INSERT INTO channel_stats (channel_id, hits, forwards, last_hit_at) VALUES (?, ?, ?, ?) '
+                    'ON CONFLICT (channel_id) DO UPDATE SET hits = hits + excluded.hits, '
+                    'forwards = forwards + excluded.forwards, '
+                    'last_hit_at = COALESCE(MAX(last_hit_at, excluded.last_hit_at), last_hit_at, excluded.last_hit_at)',
+                    [(str(c), h, f, last_hit(t)) for c, h, f, t in channel_rows]
+                )
+        await self._run(run)
+
+    async def get_keyword_stats(self):
+        rows = await self._fetch(KEYWORD_STATS_QUERY.format(true='1', false='0'))
+        return [
+            {**dict(row), 'last_hit_at': datetime.fromisoformat(row['last_hit_at']) if row['last_hit_at'] else None}
+            for row in rows
+        ]
+
+    async def get_channel_stats(self, limit=10):
+        rows = await self._fetch(
+            'SELECT s.channel_id, c.name, s.hits, s.forwards, s.last_hit_at FROM channel_stats s '
+            'LEFT JOIN channels c ON c.channel_id = s.channel_id ORDER BY s.hits DESC LIMIT ?',
+            (limit,)
+        )
+        return [
+            {**dict(row), 'last_hit_at': datetime.fromisoformat(row['last_hit_at']) if row['last_hit_at'] else None}
+            for row in rows
+        ]
+
+    async def load_telethon_session(self, name):
+        def run():
+            session = self.conn.execute(
+                'SELECT dc_id, server_address, port, auth_key, takeout_id FROM telethon_sessions WHERE name = ?', (name,)
+            ).fetchone()
+            entities = self.conn.execute(
+                'SELECT id, hash, username, phone, name, date FROM telethon_entities WHERE session_name = ?', (name,)
+            ).fetchall()
+            states = self.conn.execute(
+                'SELECT id, pts, qts, date, seq FROM telethon_update_state WHERE session_name = ?', (name,)
+            ).fetchall()
+            files = self.conn.execute(
+                'SELECT md5_digest, file_size, type, id, hash FROM telethon_sent_files WHERE session_name = ?', (name,)
+            ).fetchall()
+            return (tuple(session) if session else None, [tuple(r) for r in entities],
+                    [tuple(r) for r in states], [tuple(r) for r in files])
+        return await self._run(run)
+
+    async def save_telethon_session(self, name, session, entities, states, files):
+        def run():
+            with self.conn:
+                if session:
+                    self.conn.execute(
+                        'INSERT OR REPLACE INTO telethon_sessions (name, dc_id, server_address, port, auth_key, takeout_id) '
+                        'VALUES (?, ?, ?, ?, ?, ?)',
+                        (name, *session)
+                    )
+                self.conn.executemany(
+                    'INSERT OR REPLACE INTO telethon_entities (session_name, id, hash, username, phone, name, date) '
+                    'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                    [(name, *row) for row in entities]
+                )
+                self.conn.executemany(
+                    'INSERT OR REPLACE INTO telethon_update_state (session_name, id, pts, qts, date, seq) '
+                    'VALUES (?, ?, ?, ?, ?, ?)',
+                    [(name, *row) for row in states]
+                )
+                self.conn.executemany(
+                    'INSERT OR REPLACE INTO telethon_sent_files (session_name, md5_digest, file_size, type, id, hash) '
+                    'VALUES (?, ?, ?, ?, ?, ?)',
+                    [(name, *row) for row in files]
+                )
+        await self._run(run)
@@ -0,0 +1,140 @@
+import asyncio
+import gzip
+import json
+import logging
+import os
+import time
+from datetime import datetime, timezone
+
+logger = logging.getLogger(__name__)
+
+TAPE_VERSION = 1
+
+# Сколько страниц копится в буфере до записи вне конца цикла
+TAPE_FLUSH_PAGES = 100
+
+
+class TapeMessage:
+    """Сообщение с ленты: те же поля, что у результата MessageParser.convert_message."""
+
+    __slots__ = ("message_id", "date", "text", "caption", "type", "has_media", "edit_date")
+
+    def __init__(self, message_id, date, text, caption=None, type="текст", has_media=False, edit_date=None):
+        self.message_id = message_id
+        self.date = date
+        self.text = text
+        self.caption = caption
+        self.type = type
+        self.has_media = has_media
+        self.edit_date = edit_date
+
+
+def _open(path, mode):
+    if path.endswith(".gz"):
+        return gzip.open(path, mode + "t", encoding="utf-8")
+    return open(path, mode, encoding="utf-8")
+
+
+class TapeWriter:
+    """Запись полученных страниц сообщений в ленту для воспроизведения (replay_tape.py).
+
+    Лента — файл JSON Lines, который только дописывается: в начале каждого
+    открытия строка-заголовок, затем по строке на страницу
+    {"t": время получения, "c": канал, "m": [[id, дата, текст, подпись, тип, медиа, дата правки], ...]}.
+    Даты хранятся в секундах Unix; у сообщения без правки поле даты правки
+    не пишется. Файл с расширением .gz сжимается
+    (каждое открытие — отдельный блок gzip, который читается как продолжение).
+
+    record() только добавляет строку в буфер; сжатие и запись выполняет
+    flush() в отдельном потоке, чтобы не блокировать цикл событий.
+    """
+
+    def __init__(self, path=None):
+        """Открывает ленту на дозапись.
+
+        Args:
+            path: Путь к файлу ленты (по умолчанию TAPE_PATH)
+        """
+        self.path = path or os.getenv("TAPE_PATH")
+        self.pages = 0
+        self.buffer = []
+        self._lock = asyncio.Lock()
+        self.f = _open(self.path, "a")
+        self._write({"tape": TAPE_VERSION, "started_at": time.time()})
+
+    def _write(self, record):
+        self.buffer.append(json.dumps(record, ensure_ascii=False, separators=(",", ":")) + "\n")
+
+    def _write_lines(self, lines):
+        self.f.write("".join(lines))
+        self.f.flush()
+
+    @staticmethod
+    def _message(m):
+        row = [m.message_id, m.date.timestamp() if m.date else None, m.text, m.caption, m.type, m.has_media]
+        edit_date = getattr(m, "edit_date", None)
+        if edit_date:
+            row.append(edit_date.timestamp())
+        return row
+
+    def record(self, channel_id, messages, fetched_at=None):
+        """Дописывает страницу сообщений канала в порядке получения."""
+        fetched_at = fetched_at or datetime.now(timezone.utc)
+        try:
+            self._write({
+                "t": round(fetched_at.timestamp(), 3),
+                "c": str(channel_id),
+                "m": [self._message(m) for m in messages],
+            })
+            self.pages += 1
+        except Exception as e:
+            logger.error(f"Ошибка при записи страницы канала {channel_id} в ленту {self.path}: {e}")
+
+    async def flush(self):
+        """Записывает накопленные страницы в файл в отдельном потоке."""
+        async with self._lock:
+            if not self.buffer:
+                return
+            lines, self.buffer = self.buffer, []
+            try:
+                await asyncio.to_thread(self._write_lines, lines)
+            except Exception as e:
+                logger.error(f"Ошибка при записи в ленту {self.path}: {e}")
+
+    def close(self):
+        """Дописывает буфер и закрывает файл (при остановке, после остановки парсера)."""
+        if self.buffer:
+            self._write_lines(self.buffer)
+            self.buffer = []
+        self.f.close()
+        logger.info(f"Лента {self.path} закрыта, записано страниц: {self.pages}")
+
+
+def read_tape(path):
+    """Читает ленту.
+
+    Yields:
+        (время получения, канал, список TapeMessage) в порядке записи
+    """
+    with _open(path, "r") as f:
+        for line_number, line in enumerate(f, 1):
+            try:
+                record = json.loads(line)
+            except ValueError:
+                # Недописанная последняя строка после аварийной остановки
+                logger.warning(f"Лента {path}: пропущена поврежденная строка {line_number}")
+                continue
+            if "tape" in record:
+                if record["tape"] != TAPE_VERSION:
+                    raise ValueError(f"Неподдерживаемая версия ленты {path}: {record['tape']}")
+                continue
+            messages = [
+                TapeMessage(
+                    message_id,
+                    datetime.fromtimestamp(date, timezone.utc) if date is not None else None,
+                    text, caption, message_type, has_media,
+                    datetime.fromtimestamp(edited[0], timezone.utc) if edited else None
+                )
+                for message_id, date, text, caption, message_type, has_media, *edited in record["m"]
+            ]
+            yield datetime.fromtimestamp(record["t"], timezone.utc), record["c"], messages
@@ -0,0 +1,386 @@
+import asyncio
+import datetime
+import logging
+import os
+import sqlite3
+import time
+from telethon import TelegramClient, utils
+from telethon.crypto import AuthKey
+from telethon.sessions import MemorySession, SQLiteSession
+from telethon.sessions.memory import _SentFileType
+from telethon.tl import types
+import config
+import metrics
+
+logger = logging.getLogger(__name__)
+
+SESSION_FLUSH_SECONDS = metrics.registry.histogram(
+    "telethon_session_flush_seconds", "Запись накопленного состояния сессии Telethon", ("store",)
+)
+
+# Параметры устройства, которые видит Telegram (одинаковые для всех клиентов аккаунта)
+DEVICE = {
+    "device_model": "Windows Desktop",
+    "system_version": "4.16.30-vxCUSTOM",
+    "app_version": "1.0.0",
+}
+
+
+class SessionBatch:
+    """Изменения сессии с прошлой записи: строки в формате таблиц сессии Telethon."""
+
+    __slots__ = ("session", "entities", "states", "files")
+
+    def __init__(self, session=None, entities=(), states=(), files=()):
+        # (dc_id, server_address, port, auth_key, takeout_id)
+        self.session = session
+        # (id, hash, username, phone, name, date)
+        self.entities = list(entities)
+        # (id, pts, qts, date, seq)
+        self.states = list(states)
+        # (md5_digest, file_size, type, id, hash)
+        self.files = list(files)
+
+    def __bool__(self):
+        return bool(self.session or self.entities or self.states or self.files)
+
+
+class FileSessionStore:
+    """Файл .session в формате SQLiteSession Telethon.
+
+    Файл остается совместимым с authorize_telethon.py и обычным
+    TelegramClient: при открытии его создает или обновляет сам Telethon,
+    а изменения записываются одной транзакцией на пачку в отдельном потоке.
+    """
+
+    name = "file"
+
+    def __init__(self, session_name):
+        self.path = session_name if session_name.endswith(".session") else f"{session_name}.session"
+
+    def _load(self):
+        # SQLiteSession создает таблицы или обновляет старую версию схемы
+        SQLiteSession(self.path).close()
+        conn = sqlite3.connect(self.path)
+        try:
+            return SessionBatch(
+                conn.execute("SELECT dc_id, server_address, port, auth_key, takeout_id FROM sessions").fetchone(),
+                conn.execute("SELECT id, hash, username, phone, name, date FROM entities").fetchall(),
+                conn.execute("SELECT id, pts, qts, date, seq FROM update_state").fetchall(),
+                conn.execute("SELECT md5_digest, file_size, type, id, hash FROM sent_files").fetchall(),
+            )
+        finally:
+            conn.close()
+
+    def _write(self, batch):
+        conn = sqlite3.connect(self.path)
+        try:
+            with conn:
+                if batch.session:
+                    conn.execute("DELETE FROM sessions")
+                    conn.execute("INSERT INTO sessions VALUES (?, ?, ?, ?, ?)", batch.session)
+                conn.executemany("INSERT OR REPLACE INTO entities VALUES (?, ?, ?, ?, ?, ?)", batch.entities)
+                conn.executemany("INSERT OR REPLACE INTO update_state VALUES (?, ?, ?, ?, ?)", batch.states)
+                conn.executemany("INSERT OR REPLACE INTO sent_files VALUES (?, ?, ?, ?, ?)", batch.files)
+        finally:
+            conn.close()
+
+    async def load(self):
+        return await asyncio.to_thread(self._load)
+
+    async def write(self, batch):
+        await asyncio.to_thread(self._write, batch)
+
+
+class DatabaseSessionStore:
+    """Сессия в основной базе бота (PostgreSQL или SQLite, см. DB_BACKEND)."""
+
+    name = "database"
+
+    def __init__(self, session_name, db):
+        self.session_name = session_name
+        self.db = db
+
+    async def load(self):
+        return SessionBatch(*await self.db.load_telethon_session(self.session_name))
+
+    async def write(self, batch):
+        await self.db.save_telethon_session(
+            self.session_name, batch.session, batch.entities, batch.states, batch.files
+        )
+
+
+class BufferedSession(MemorySession):
+    """Сессия Telethon, которая держит состояние в памяти и записывает его пачками.
+
+    Telethon обновляет сущности после каждого ответа API и состояние
+    обновлений при каждом сохранении. Здесь эти изменения только помечаются,
+    а в хранилище (файл или база) записываются одной пачкой по таймеру,
+    при смене ключа авторизации или дата-центра и при закрытии. Поиск
+    сущностей идет по словарям, а не по таблице.
+    """
+
+    def __init__(self, store, interval=None):
+        super().__init__()
+        self.store = store
+        self.interval = interval if interval is not None else config.TELETHON_SESSION_FLUSH_INTERVAL
+        self.save_entities = True
+        # id -> (id, hash, username, phone, name, date) и индексы для поиска
+        self._rows = {}
+        self._by_username = {}
+        self._by_phone = {}
+        self._by_name = {}
+        self._dirty_session = False
+        self._dirty_entities = set()
+        self._dirty_states = set()
+        self._dirty_files = set()
+        self._flush_task = None
+        self._periodic_task = None
+
+    @classmethod
+    async def open(cls, store, interval=None):
+        """Загружает сессию из хранилища."""
+        session = cls(store, interval)
+        batch = await store.load()
+        if batch.session:
+            session._dc_id, session._server_address, session._port, key, session._takeout_id = batch.session
+            session._auth_key = AuthKey(data=key) if key else None
+        for row in batch.entities:
+            session._put_row(tuple(row))
+        for entity_id, pts, qts, date, seq in batch.states:
+            date = datetime.datetime.fromtimestamp(date, tz=datetime.timezone.utc)
+            session._update_states[entity_id] = types.updates.State(pts, qts, date, seq, unread_count=0)
+        for md5_digest, file_size, kind, file_id, file_hash in batch.files:
+            session._files[(md5_digest, file_size, _SentFileType(kind))] = (file_id, file_hash)
+        logger.info(f"Сессия Telethon загружена ({store.name}): сущностей {len(session._rows)}")
+        return session
+
+    # Параметры подключения: изменения редкие и важные, записываются сразу
+
+    def set_dc(self, dc_id, server_address, port):
+        super().set_dc(dc_id, server_address, port)
+        self._dirty_session = True
+
+    @MemorySession.auth_key.setter
+    def auth_key(self, value):
+        self._auth_key = value
+        self._dirty_session = True
+
+    @MemorySession.takeout_id.setter
+    def takeout_id(self, value):
+        self._takeout_id = value
+        self._dirty_session = True
+
+    def save(self):
+        # Telethon вызывает save() после смены ключа и раз в минуту;
+        # сущности и состояние обновлений ждут таймера
+        if self._dirty_session:
+            self._schedule_flush()
+
+    def close(self):
+        self._schedule_flush()
+
+    def delete(self):
+        # После выхода из аккаунта ключ авторизации удаляется при следующей записи
+        self._auth_key = None
+        self._dirty_session = True
+        self._schedule_flush()
+
+    # Состояние обновлений и файлы
+
+    def set_update_state(self, entity_id, state):
+        previous = self._update_states.get(entity_id)
+        if previous is not None and (previous.pts, previous.qts, previous.seq) == (state.pts, state.qts, state.seq):
+            return
+        self._update_states[entity_id] = state
+        self._dirty_states.add(entity_id)
+
+    def cache_file(self, md5_digest, file_size, instance):
+        super().cache_file(md5_digest, file_size, instance)
+        self._dirty_files.add((md5_digest, file_size, _SentFileType.from_type(type(instance))))
+
+    # Сущности
+
+    def _put_row(self, row):
+        entity_id, _, username, phone, name = row[:5]
+        row = (entity_id, row[1], username, None if phone is None else str(phone), name, row[5])
+        previous = self._rows.get(entity_id)
+        if previous is not None:
+            for index, key in ((self._by_username, previous[2]), (self._by_phone, previous[3]), (self._by_name, previous[4])):
+                if key is not None and index.get(key) == entity_id:
+                    del index[key]
+        if username is not None:
+            # Имя пользователя принадлежит одной сущности: у прежнего владельца оно сбрасывается
+            other = self._by_username.get(username)
+            if other is not None and other != entity_id:
+                old = self._rows[other]
+                self._rows[other] = (old[0], old[1], None, old[3], old[4], old[5])
+                self._dirty_entities.add(other)
+            self._by_username[username] = entity_id
+        if row[3] is not None:
+            self._by_phone[row[3]] = entity_id
+        if name is not None:
+            self._by_name[name] = entity_id
+        self._rows[entity_id] = row
+
+    def process_entities(self, tlo):
+        if not self.save_entities:
+            return
+        now = int(time.time())
+        for row in self._entities_to_rows(tlo):
+            previous = self._rows.get(row[0])
+            phone = None if row[3] is None else str(row[3])
+            if previous is not None and previous[1:5] == (row[1], row[2], phone, row[4]):
+                # Сущность не изменилась: запись не нужна
+                continue
+            self._put_row(row + (now,))
+            self._dirty_entities.add(row[0])
+
+    def _id_hash(self, entity_id):
+        row = self._rows.get(entity_id) if entity_id is not None else None
+        return (row[0], row[1]) if row else None
+
+    def get_entity_rows_by_phone(self, phone):
+        return self._id_hash(self._by_phone.get(str(phone)))
+
+    def get_entity_rows_by_username(self, username):
+        return self._id_hash(self._by_username.get(username))
+
+    def get_entity_rows_by_name(self, name):
+        return self._id_hash(self._by_name.get(name))
+
+    def get_entity_rows_by_id(self, id, exact=True):
+        if exact:
+            return self._id_hash(id)
+        for marked in (utils.get_peer_id(types.PeerUser(id)), utils.get_peer_id(types.PeerChat(id)),
+                       utils.get_peer_id(types.PeerChannel(id))):
+            result = self._id_hash(marked)
+            if result:
+                return result
+        return None
+
+    # Запись в хранилище
+
+    def _take_batch(self):
+        """Забирает накопленные изменения в пачку."""
+        batch = SessionBatch()
+        if self._dirty_session:
+            batch.session = (
+                self._dc_id, self._server_address, self._port,
+                self._auth_key.key if self._auth_key else b"", self._takeout_id
+            )
+        batch.entities = [self._rows[i] for i in self._dirty_entities if i in self._rows]
+        for entity_id in self._dirty_states:
+            state = self._update_states[entity_id]
+            batch.states.append((entity_id, state.pts, state.qts, int(state.date.timestamp()), state.seq))
+        for key in self._dirty_files:
+            file_id, file_hash = self._files[key]
+            batch.files.append((key[0], key[1], key[2].value, file_id, file_hash))
+        self._dirty_session = False
+        self._dirty_entities = set()
+        self._dirty_states = set()
+        self._dirty_files = set()
+        return batch
+
+    def _restore_batch(self, batch):
+        """Возвращает незаписанную пачку в очередь изменений."""
+        self._dirty_session = self._dirty_session or bool(batch.session)
+        self._dirty_entities.update(row[0] for row in batch.entities)
+        self._dirty_states.update(row[0] for row in batch.states)
+        self._dirty_files.update((row[0], row[1], _SentFileType(row[2])) for row in batch.files)
+
+    async def flush(self):
+        """Записывает накопленные изменения одной пачкой."""
+        batch = self._take_batch()
+        if not batch:
+            return
+        started = time.perf_counter()
+        try:
+            await self.store.write(batch)
+            logger.debug(f"Сессия Telethon записана: сущностей {len(batch.entities)}, состояний {len(batch.states)}")
+        except Exception as e:
+            self._restore_batch(batch)
+            logger.error(f"Ошибка при записи сессии Telethon: {e}")
+        finally:
+            SESSION_FLUSH_SECONDS.observe(time.perf_counter() - started, store=self.store.name)
+
+    def _schedule_flush(self):
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            # Вне цикла событий изменения запишутся при следующей записи по таймеру
+            return
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = loop.create_task(self.flush())
+
+    async def _run_periodic(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            await self.flush()
+
+    def start(self):
+        """Запускает периодическую запись."""
+        if self._periodic_task is None:
+            self._periodic_task = asyncio.get_running_loop().create_task(self._run_periodic())
+
+    async def stop(self):
+        """Останавливает периодическую запись и записывает оставшиеся изменения."""
+        if self._periodic_task:
+            self._periodic_task.cancel()
+            self._periodic_task = None
+        if self._flush_task and not self._flush_task.done():
+            await self._flush_task
+        await self.flush()
+
+
+def create_store(session_name, db=None):
+    """Хранилище сессии по config.TELETHON_SESSION_STORE: file или database."""
+    if config.TELETHON_SESSION_STORE.lower() == "database":
+        if db is None:
+            raise ValueError("Для TELETHON_SESSION_STORE=database нужна база данных")
+        return DatabaseSessionStore(session_name, db)
+    return FileSessionStore(session_name)
+
+
+# Общие клиенты процесса: один на аккаунт (имя сессии)
+_clients = {}
+_clients_lock = asyncio.Lock()
+
+
+async def get_client(db=None, session_name=None):
+    """Возвращает общий клиент Telethon аккаунта, создавая и подключая его при первом вызове.
+
+    Бот, парсер и индекс диалогов получают один и тот же клиент, поэтому
+    у аккаунта одно соединение и одна сессия.
+
+    Returns:
+        Подключенный TelegramClient или None, если не заданы TELEGRAM_API_ID и TELEGRAM_API_HASH
+    """
+    name = session_name or config.TELETHON_SESSION_NAME
+    async with _clients_lock:
+        client = _clients.get(name)
+        if client is None:
+            api_id = os.getenv("TELEGRAM_API_ID")
+            api_hash = os.getenv("TELEGRAM_API_HASH")
+            if not api_id or not api_hash:
+                return None
+            session = await BufferedSession.open(create_store(name, db))
+            client = TelegramClient(session, int(api_id), api_hash, **DEVICE)
+            session.start()
+            _clients[name] = client
+            logger.info(f"Создан общий клиент Telethon для сессии {name}")
+        if not client.is_connected():
+            await client.connect()
+        return client
+
+
+async def close_clients():
+    """Отключает общие клиенты и записывает их сессии."""
+    async with _clients_lock:
+        for name, client in list(_clients.items()):
+            try:
+                await client.disconnect()
+            except Exception as e:
+                logger.error(f"Ошибка при отключении клиента Telethon {name}: {e}")
+            await client.session.stop()
+        _clients.clear()
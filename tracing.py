@@ -0,0 +1,113 @@
+import os
+import time
+from collections import deque
+from datetime import datetime, timezone
+import metrics
+
+# Этапы конвейера в порядке выполнения
+STAGES = ("scheduled_wait", "entity", "fetch", "dedup", "match", "forward")
+
+STAGE_SECONDS = metrics.registry.histogram(
+    "pipeline_stage_seconds", "Длительность этапов обработки сообщения", ("stage", "channel"),
+    buckets=(0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 10.0, 30.0, 60.0, 180.0, 600.0, 1800.0, 3600.0)
+)
+END_TO_END_SECONDS = metrics.registry.histogram(
+    "pipeline_publish_to_forward_seconds", "Время от публикации в канале до пересылки", ("channel",),
+    buckets=(1.0, 5.0, 10.0, 30.0, 60.0, 120.0, 180.0, 300.0, 600.0, 1800.0, 3600.0, 21600.0)
+)
+
+
+class MessageTrace:
+    """Трасса одного сообщения: длительности этапов от публикации до пересылки."""
+
+    __slots__ = ("channel_id", "message_id", "published", "stages", "total")
+
+    def __init__(self, channel_id, message_id, published, fetch_spans=None):
+        self.channel_id = str(channel_id)
+        self.message_id = message_id
+        self.published = published
+        self.stages = dict(fetch_spans) if fetch_spans else {}
+        self.total = None
+
+    def span(self, stage):
+        """Контекстный менеджер, измеряющий этап stage."""
+        return _Span(self, stage)
+
+    def describe(self):
+        stages = ", ".join(f"{s}={self.stages[s]:.2f}s" for s in STAGES if s in self.stages)
+        return f"{self.channel_id}/{self.message_id}: {self.total:.1f}s ({stages})"
+
+
+class _Span:
+    __slots__ = ("trace", "stage", "start")
+
+    def __init__(self, trace, stage):
+        self.trace = trace
+        self.stage = stage
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.trace.stages[self.stage] = self.trace.stages.get(self.stage, 0.0) + time.perf_counter() - self.start
+        return False
+
+
+class Tracer:
+    """Собирает трассы сообщений в гистограммы и хранит последние пересланные."""
+
+    def __init__(self, keep=None):
+        self.recent = deque(maxlen=keep or int(os.getenv("TRACE_KEEP", "500")))
+
+    @staticmethod
+    def fetch_spans(started_at, entity_seconds, fetch_seconds):
+        """Описывает этапы, общие для всех сообщений одной страницы канала."""
+        return {"fetch_started": started_at, "entity": entity_seconds, "fetch": fetch_seconds}
+
+    def start(self, channel_id, message, fetch_spans=None):
+        spans = {}
+        published = getattr(message, "date", None)
+        if fetch_spans:
+            spans = {"entity": fetch_spans["entity"], "fetch": fetch_spans["fetch"]}
+            if published is not None:
+                # Сколько сообщение ждало начала опроса канала
+                spans["scheduled_wait"] = max(0.0, (fetch_spans["fetch_started"] - published).total_seconds())
+        return MessageTrace(channel_id, message.message_id, published, spans)
+
+    def finish(self, trace, forwarded):
+        """Записывает этапы в гистограммы; для пересланных — и сквозную задержку."""
+        for stage, seconds in trace.stages.items():
+            STAGE_SECONDS.observe(seconds, stage=stage, channel=trace.channel_id)
+        if forwarded and trace.published is not None:
+            trace.total = (datetime.now(timezone.utc) - trace.published).total_seconds()
+            END_TO_END_SECONDS.observe(trace.total, channel=trace.channel_id)
+            self.recent.append(trace)
+
+    def slowest(self, n=10):
+        """Возвращает n самых медленных из последних пересланных сообщений."""
+        return sorted(self.recent, key=lambda t: t.total, reverse=True)[:n]
+
+    def stage_summary(self):
+        """Средняя длительность и p95 каждого этапа по всем каналам."""
+        totals = {}
+        for (stage, _), (counts, total, count) in STAGE_SECONDS.values.items():
+            entry = totals.setdefault(stage, [0.0, 0])
+            entry[0] += total
+            entry[1] += count
+        lines = []
+        for stage in STAGES:
+            if stage in totals and totals[stage][1]:
+                total, count = totals[stage]
+                lines.append(f"{stage}: avg={total / count:.3f}s, n={count}")
+        e2e_count, e2e_total = END_TO_END_SECONDS.total()
+        if e2e_count:
+            lines.append(
+                f"публикация→пересылка: avg={e2e_total / e2e_count:.1f}s, "
+                f"p95≤{END_TO_END_SECONDS.quantile(0.95)}s, n={e2e_count}"
+            )
+        return lines
+
+
+# Глобальный трассировщик процесса
+tracer = Tracer()
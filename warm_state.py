@@ -0,0 +1,107 @@
+import asyncio
+import base64
+import json
+import logging
+import os
+import time
+from telethon.extensions import BinaryReader
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_VERSION = 1
+
+
+class WarmStateSnapshot:
+    """Снимок теплого состояния парсера в локальном файле.
+
+    В снимок попадают разрешенные сущности каналов (в бинарном формате TL),
+    последние просмотренные ID сообщений по каналам, окно недавно
+    обработанных сообщений, отметки их редактирования и карантин каналов. Снимок записывается при остановке и периодически,
+    а при запуске загружается до первого цикла, поэтому после перезапуска
+    парсер не разрешает каналы заново и не ходит в базу за каждым сообщением.
+    """
+
+    def __init__(self, path=None, interval=None):
+        """Инициализирует снимок.
+
+        Args:
+            path: Путь к файлу снимка
+            interval: Период автосохранения в секундах (0 отключает его)
+        """
+        self.path = path or os.getenv("WARM_STATE_PATH", "warm_state.json")
+        self.interval = float(interval if interval is not None else os.getenv("WARM_STATE_INTERVAL", "300"))
+
+    def save(self, parser):
+        """Атомарно записывает состояние парсера в файл."""
+        entities = {}
+        for key, entity in parser.entity_cache.items():
+            try:
+                entities[key] = base64.b64encode(bytes(entity)).decode("ascii")
+            except Exception:
+                # Объект без TL-сериализации (например, заглушка в тестах)
+                continue
+        data = {
+            "version": SNAPSHOT_VERSION,
+            "saved_at": time.time(),
+            "entities": entities,
+            "watermarks": parser.watermarks,
+            "dedup": [list(key) for key in parser.dedup_window],
+            "circuits": parser.breaker.snapshot(),
+            "edits": parser.edits.snapshot(),
+        }
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False)
+        os.replace(tmp_path, self.path)
+        logger.debug(f"Снимок состояния сохранен: {len(entities)} сущностей, {len(parser.dedup_window)} сообщений")
+
+    def load(self, parser):
+        """Восстанавливает состояние парсера из файла.
+
+        Returns:
+            True, если снимок найден и загружен
+        """
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return False
+        except Exception as e:
+            logger.warning(f"Не удалось прочитать снимок состояния {self.path}: {e}")
+            return False
+
+        if data.get("version") != SNAPSHOT_VERSION:
+            logger.warning(f"Снимок состояния {self.path} устаревшей версии, пропускаем")
+            return False
+
+        for key, raw in data.get("entities", {}).items():
+            try:
+                parser.entity_cache[key] = BinaryReader(base64.b64decode(raw)).tgread_object()
+            except Exception:
+                continue
+        for key, message_id in data.get("watermarks", {}).items():
+            if message_id > parser.watermarks.get(key, 0):
+                parser.watermarks[key] = message_id
+        for channel_id, message_id in data.get("dedup", []):
+            parser.remember_processed(channel_id, message_id)
+        parser.breaker.restore(data.get("circuits", {}))
+        parser.edits.restore(data.get("edits", []))
+
+        age = time.time() - data.get("saved_at", time.time())
+        logger.info(
+            f"Загружен снимок состояния ({age:.0f} сек.): {len(parser.entity_cache)} сущностей, "
+            f"{len(parser.watermarks)} каналов, {len(parser.dedup_window)} сообщений, "
+            f"{len(parser.breaker.quarantined())} каналов на карантине"
+        )
+        return True
+
+    async def run_periodic(self, parser):
+        """Периодически сохраняет снимок, пока задача не будет отменена."""
+        if not self.interval:
+            return
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                self.save(parser)
+            except Exception as e:
+                logger.error(f"Ошибка при сохранении снимка состояния: {e}")